@@ -0,0 +1,68 @@
+"""
+Benchmarks for each stage of creating a job, and the whole of it.
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from cptools2 import filelist, job, loaddata, parse_metadata, splitter
+
+pytest.importorskip("pytest_benchmark")
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, os.pardir, "tests", "example_pipeline.cppipe")
+CHUNK = 96
+
+
+def list_files(experiment):
+    lister = filelist.Filelist(experiment.microscope)
+    return [lister.files_from_plate(i) for i in lister.paths_to_plates(experiment.path)]
+
+
+def test_filelist(experiment, measure):
+    plate_files = measure(list_files, experiment)
+    assert sum(len(i) for i in plate_files) == len(experiment.files)
+
+
+def test_metadata_parser(experiment, measure):
+    parser = parse_metadata.MetadataParser(experiment.microscope)
+    metadata = measure(parser.parse_filepath_list, experiment.files)
+    assert len(metadata) == len(experiment.files)
+
+
+def split_plates(experiment):
+    return [splitter.split(i, CHUNK, experiment.microscope) for i in experiment.plate_files]
+
+
+def test_split(experiment, measure):
+    measure(split_plates, experiment)
+
+
+def create_loaddata(experiment):
+    return [loaddata.create_loaddata(i, experiment.microscope) for i in experiment.plate_files]
+
+
+def test_create_loaddata(experiment, measure):
+    measure(create_loaddata, experiment)
+
+
+def create_commands(experiment):
+    location = tempfile.mkdtemp()
+    try:
+        jobber = job.Job(experiment.microscope)
+        jobber.add_experiment(experiment.path)
+        jobber.chunk(CHUNK)
+        jobber.create_commands(
+            pipeline=PIPELINE, location=location, commands_location=location,
+            job_size=CHUNK, channel_dict=None
+        )
+    finally:
+        shutil.rmtree(location)
+
+
+def test_create_commands(experiment, measure):
+    """end to end, from listing the files to writing the commands"""
+    measure(create_commands, experiment)
@@ -0,0 +1,30 @@
+"""
+Benchmarks for how long the command line takes to start.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+# trivial commands should start in well under this
+MAX_STARTUP_SECONDS = 0.5
+
+
+def run_template():
+    subprocess.check_call(
+        [sys.executable, "-m", "cptools2", "--template"], stdout=subprocess.DEVNULL
+    )
+
+
+def import_package():
+    subprocess.check_call([sys.executable, "-c", "import cptools2.__main__"])
+
+
+@pytest.mark.parametrize("func", [run_template, import_package],
+                         ids=["template", "import"])
+def test_startup(benchmark, func):
+    benchmark.pedantic(func, rounds=5, warmup_rounds=1)
+    assert benchmark.stats.stats.median < MAX_STARTUP_SECONDS
@@ -0,0 +1,69 @@
+"""
+Fixtures for the benchmarks, which use pytest-benchmark:
+
+    pip install pytest-benchmark
+    pytest benchmarks
+
+Which scales and microscopes are run is set with environment variables, as
+generating the larger experiments takes a while:
+
+    CPTOOLS2_BENCH_SCALES=10k,100k,1M CPTOOLS2_BENCH_MICROSCOPES=yokogawa pytest benchmarks
+"""
+
+import os
+import tracemalloc
+
+import pytest
+
+from benchmarks import synthetic
+from cptools2 import filelist
+
+
+SCALES = os.environ.get("CPTOOLS2_BENCH_SCALES", "10k").split(",")
+MICROSCOPES = os.environ.get("CPTOOLS2_BENCH_MICROSCOPES", "yokogawa,imagexpress").split(",")
+ROUNDS = int(os.environ.get("CPTOOLS2_BENCH_ROUNDS", "3"))
+
+
+class Experiment(object):
+    """a generated experiment and its list of image files per plate"""
+
+    def __init__(self, path, microscope, scale):
+        self.path = path
+        self.microscope = microscope
+        self.scale = scale
+        lister = filelist.Filelist(microscope)
+        self.plate_paths = sorted(lister.paths_to_plates(path))
+        self.plate_files = [lister.files_from_plate(i) for i in self.plate_paths]
+        self.files = [i for files in self.plate_files for i in files]
+
+
+@pytest.fixture(scope="session", params=[(m, s) for m in MICROSCOPES for s in SCALES],
+                ids=lambda x: "{}-{}".format(*x))
+def experiment(request, tmp_path_factory):
+    microscope, scale = request.param
+    path = str(tmp_path_factory.mktemp("experiment").joinpath("{}_{}".format(microscope, scale)))
+    synthetic.make_experiment(path, microscope, **synthetic.SCALES[scale])
+    return Experiment(path, microscope, scale)
+
+
+def peak_memory(func, *args, **kwargs):
+    """peak memory allocated in MB while running func once"""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture
+def measure(benchmark):
+    """
+    benchmark a function over a few rounds, and record its peak memory
+    in the benchmark's extra_info
+    """
+    def _measure(func, *args, **kwargs):
+        result = benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=ROUNDS)
+        benchmark.extra_info["peak_memory_mb"] = peak_memory(func, *args, **kwargs)
+        return result
+    return _measure
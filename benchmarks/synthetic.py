@@ -0,0 +1,124 @@
+"""
+Generate fake experiment directories of empty image files, named as the
+ImageXpress and Yokogawa microscopes name them, for benchmarking.
+
+ImageXpress:
+    experiment/<plate>/<date>/<plate id>/<name>_<well>_s<site>_w<channel><UUID>.tif
+    (plus a _thumb file per image)
+
+Yokogawa:
+    experiment/<measurement>/<plate>/<plate>_<well>_T0001F<site>L01A<channel>Z<z>C<channel>.tif
+"""
+
+import os
+import random
+import string
+import uuid
+
+
+# images per plate for the benchmark scales is wells * sites * channels,
+# 384 * 5 * 5 = 9600
+SCALES = {
+    "10k": dict(n_plates=1, n_wells=384, n_sites=5, n_channels=5),
+    "100k": dict(n_plates=10, n_wells=384, n_sites=5, n_channels=5),
+    "1M": dict(n_plates=100, n_wells=384, n_sites=5, n_channels=5),
+}
+MAX_WELLS = 384
+
+
+def well_names(n_wells):
+    """
+    well labels in row order for a 384 well plate, e.g ["A01", "A02", ...]
+    """
+    if not 0 < n_wells <= MAX_WELLS:
+        raise ValueError("n_wells must be between 1 and {}".format(MAX_WELLS))
+    wells = ["{}{:02d}".format(row, column)
+             for row in string.ascii_uppercase[:16] for column in range(1, 25)]
+    return wells[:n_wells]
+
+
+def n_images(n_plates=1, n_wells=384, n_sites=9, n_z=1, n_channels=5):
+    """number of images, not including thumbnails, in an experiment"""
+    return n_plates * n_wells * n_sites * n_z * n_channels
+
+
+def _touch(path):
+    open(path, "w").close()
+
+
+def _imagexpress_plate(plate_dir, plate, wells, n_sites, n_channels, thumbnails, rng):
+    image_dir = os.path.join(plate_dir, "2019-01-01", str(rng.randint(1000, 9999)))
+    os.makedirs(image_dir)
+    for well in wells:
+        for site in range(1, n_sites + 1):
+            for channel in range(1, n_channels + 1):
+                prefix = "{}_{}_s{}_w{}".format(plate, well, site, channel)
+                image_uuid = str(uuid.UUID(int=rng.getrandbits(128))).upper()
+                _touch(os.path.join(image_dir, "{}{}.tif".format(prefix, image_uuid)))
+                if thumbnails:
+                    thumb_uuid = str(uuid.UUID(int=rng.getrandbits(128))).upper()
+                    _touch(os.path.join(image_dir, "{}_thumb{}.tif".format(prefix, thumb_uuid)))
+
+
+def _yokogawa_plate(plate_dir, plate, wells, n_sites, n_z, n_channels):
+    os.makedirs(plate_dir)
+    for well in wells:
+        for site in range(1, n_sites + 1):
+            for z in range(1, n_z + 1):
+                for channel in range(1, n_channels + 1):
+                    name = "{}_{}_T0001F{:03d}L01A{:02d}Z{:02d}C{:02d}.tif".format(
+                        plate, well, site, channel, z, channel
+                    )
+                    _touch(os.path.join(plate_dir, name))
+
+
+def make_experiment(path, microscope="yokogawa", n_plates=1, n_wells=384,
+                    n_sites=9, n_z=1, n_channels=5, thumbnails=True, seed=0):
+    """
+    create a fake experiment directory of empty image files
+
+    Parameters:
+    -----------
+    path: string
+        experiment directory to create, must not already exist
+    microscope: string
+        "yokogawa" or "imagexpress"
+    n_plates: int
+    n_wells: int
+        wells per plate, filled in row order, at most 384
+    n_sites: int
+        images per well
+    n_z: int
+        z-planes per site, only 1 for the ImageXpress
+    n_channels: int
+    thumbnails: Boolean (default = True)
+        whether to also create ImageXpress thumbnails, which are filtered
+        out when listing files
+    seed: int
+        seed for the random parts of ImageXpress names
+
+    Returns:
+    --------
+    string, path to the experiment directory, as used in the config
+    """
+    wells = well_names(n_wells)
+    rng = random.Random(seed)
+    os.makedirs(path)
+    if microscope == "imagexpress":
+        if n_z != 1:
+            raise ValueError("only a single z-plane is supported for the ImageXpress")
+        for i in range(1, n_plates + 1):
+            plate = "plate-{}".format(i)
+            _imagexpress_plate(
+                os.path.join(path, plate), plate, wells, n_sites, n_channels, thumbnails, rng
+            )
+    elif microscope == "yokogawa":
+        measurement = os.path.join(path, "screen-name-batch1_20190101_120000")
+        for i in range(1, n_plates + 1):
+            plate = "A{:06d}-PC".format(i)
+            _yokogawa_plate(
+                os.path.join(measurement, plate), plate, wells, n_sites, n_z, n_channels
+            )
+    else:
+        raise ValueError("microscope must be 'yokogawa' or 'imagexpress'")
+    return path
@@ -1,8 +1,32 @@
-from cptools2 import filelist
-from cptools2 import splitter
-from cptools2 import commands
-from cptools2 import parse_config
-from cptools2 import utils
-from cptools2 import job
-from cptools2 import colours
-from cptools2 import cookiecutter
+"""
+Tools for running CellProfiler on HPC setups.
+
+Submodules are imported on first use, e.g `cptools2.job`, so that importing
+the package doesn't import pandas.
+"""
+
+import importlib
+import sys
+
+__version__ = "0.1"
+
+_SUBMODULES = [
+    "filelist",
+    "splitter",
+    "commands",
+    "parse_config",
+    "utils",
+    "job",
+    "colours",
+    "cookiecutter",
+]
+
+if sys.version_info < (3, 7):
+    # no module __getattr__ before python 3.7
+    for _name in _SUBMODULES:
+        importlib.import_module("cptools2." + _name)
+else:
+    def __getattr__(name):
+        if name in _SUBMODULES:
+            return importlib.import_module("cptools2." + name)
+        raise AttributeError("module 'cptools2' has no attribute '{}'".format(name))
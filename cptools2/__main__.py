@@ -1,11 +1,15 @@
+"""
+Command line interface.
+
+Only lightweight modules are imported here, each command imports what it
+uses when it runs, so that commands like `cptools2 --template` don't pay
+for importing pandas.
+"""
+
 import argparse
 import sys
 import os
 import textwrap
-from cptools2 import generate_scripts
-from cptools2 import job
-from cptools2 import parse_config
-from cptools2 import utils
 from cptools2 import colours
 from cptools2 import template
 from cptools2.colours import pretty_print, green
@@ -18,7 +22,31 @@ def check_arguments():
         raise ValueError(msg)
 
 
-def configure_job(config):
+def make_job(config, filelister=None):
+    """
+    create a job.Job with the plates from the config added, before the
+    images are chunked
+
+    Parameters:
+    ------------
+    config: cptools.parse_config.Config
+    filelister: filelist.Filelist (optional)
+        passed to the Job class, to share directory scans between jobs
+
+    Returns:
+    ---------
+    job.Job
+    """
+    from cptools2 import job
+    channels = config.get_used_channels()
+    if channels is not None:
+        pretty_print("pipeline uses channel(s) {}, dropping the others".format(
+            colours.yellow(", ".join(str(i) for i in channels)))
+        )
+    return job.make_job(config, filelister, channels)
+
+
+def configure_job(config, filelister=None):
     """
     configure job to generate the commands and scripts
 
@@ -27,23 +55,123 @@ def configure_job(config):
     config: namedtuple
         config namedtuple containing the dictionaries which are
         passed as arguments via **kwargs to the Job class.
+    filelister: filelist.Filelist (optional)
+        passed to the Job class, to share directory scans between jobs
 
     Returns:
     ---------
     nothing, saves commands and scripts to disk
     """
-    jobber = job.Job(config.microscope)
-    # some of the optional arguments might be none if that option was not present in the
-    # configuration file, in which case don't pass them as arguments to the methods
-    if config.experiment is not None:
-        jobber.add_experiment(config.experiment)
-    if config.remove_plate is not None:
-        jobber.remove_plate(config.remove_plate)
-    if config.add_plate is not None:
-        jobber.add_plate(**config.add_plate)
+    jobber = make_job(config, filelister)
     if config.chunk is not None:
         jobber.chunk(config.chunk)
     jobber.create_commands(**config.create_command_args())
+    if config.result_cache is not None:
+        find_cached_tasks(config, jobber)
+    if config.resources is not None:
+        estimate_resources(config, jobber)
+    if config.validate is not None:
+        validate_images(config, jobber)
+
+
+def find_cached_tasks(config, jobber):
+    """
+    leave the tasks with cached results out of the array job, see
+    `result_cache`
+    """
+    from cptools2 import result_cache
+    pretty_print("checking the result cache")
+    done, pending = result_cache.mark_cached_tasks(
+        jobber, config.location, config.commands_location, config.get_pipeline(),
+        **config.result_cache
+    )
+    pretty_print("{} of {} task(s) have cached results, {} to run".format(
+        colours.yellow(len(done)), len(done) + len(pending), colours.yellow(len(pending))
+    ))
+
+
+def estimate_resources(config, jobber):
+    """
+    estimate the memory and run time of the tasks from the image headers,
+    saved in `commands_location` for `make_scripts`
+    """
+    from cptools2 import resources
+    estimate = resources.estimate_job(jobber, **config.resources)
+    if estimate is None:
+        pretty_print(colours.yellow(
+            "could not read any image headers, not requesting memory or run time"
+        ))
+        # so an estimate for an earlier job isn't used for this one
+        resources.remove_estimate(config.commands_location)
+        return
+    resources.write_estimate(config.commands_location, estimate)
+    pretty_print("estimated {} memory and {} run time per task from {} images".format(
+        colours.yellow(estimate.memory), colours.yellow(estimate.runtime),
+        estimate.n_images
+    ))
+
+
+def validate_images(config, jobber):
+    """
+    check the job's images before anything is submitted, reporting the bad
+    images and their tasks, also written to `commands_location`/bad_images.txt
+    """
+    from cptools2 import validate
+    pretty_print("validating images")
+    n_checked, bad_images = validate.validate_job(
+        jobber, config.commands_location, **config.validate
+    )
+    if not bad_images:
+        pretty_print("checked {} images, no problems found".format(colours.yellow(n_checked)))
+        return
+    report = validate.write_report(config.commands_location, bad_images)
+    pretty_print(colours.red("{} of {} images checked are bad, in {} task(s):".format(
+        len(bad_images), n_checked, len(set(i.task for i in bad_images))
+    )))
+    bad_images = sorted(bad_images, key=lambda i: (i.task, i.path))
+    # the rest are in the report
+    for image in bad_images[:20]:
+        print(colours.purple("\t {}".format(image.task)), image.path, colours.yellow(image.problem))
+    if len(bad_images) > 20:
+        print(colours.purple("\t ... and {} more".format(len(bad_images) - 20)))
+    pretty_print("bad images written to {}".format(colours.yellow(report)))
+
+
+def profile_job(config, trace_memory=False, use_cprofile=False):
+    """
+    configure the job while recording the time and memory used by each
+    stage, written to `commands_location`/cptools2_profile.json
+
+    Parameters:
+    -----------
+    config: cptools.parse_config.Config
+    trace_memory: Boolean (default = False)
+        record the peak memory allocated in each stage with tracemalloc
+    use_cprofile: Boolean (default = False)
+        also run under cProfile, written to
+        `commands_location`/cptools2_profile.prof
+    """
+    from cptools2 import profiling
+    profiler = profiling.enable(trace_memory)
+    cprofiler = None
+    if use_cprofile:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    try:
+        configure_job(config)
+    finally:
+        if cprofiler is not None:
+            cprofiler.disable()
+        profiling.disable()
+    profiler.report()
+    profile_path = profiling.profile_path(config.commands_location)
+    profiler.write(profile_path)
+    pretty_print("written profile to {}".format(colours.yellow(profile_path)))
+    if cprofiler is not None:
+        cprofile_path = profiling.cprofile_path(config.commands_location)
+        cprofiler.dump_stats(cprofile_path)
+        pretty_print("written cProfile stats to {}".format(colours.yellow(cprofile_path)))
 
 
 def make_scripts(config):
@@ -58,19 +186,638 @@ def make_scripts(config):
     ---------
     nothing
     """
-    commands_line_count = generate_scripts.lines_in_commands(config.commands_location)
+    from cptools2 import generate_scripts
     logfile_location = os.path.join(config.location, "logfiles")
+    estimate = None
+    if config.resources is not None:
+        from cptools2 import resources
+        estimate = resources.read_estimate(config.commands_location)
+    runtime = estimate.runtime if estimate is not None else None
+    memory = estimate.memory if estimate is not None else None
+    task_ids = None
+    task_list = None
+    result_cache_location = None
+    if config.result_cache is not None:
+        from cptools2 import manifest
+        from cptools2 import result_cache
+        task_list = result_cache.pending_list_path(config.commands_location)
+        task_ids = manifest.read_task_list(task_list)
+        result_cache_location = config.location
+        if not task_ids:
+            pretty_print("every task has cached results, nothing to submit")
+            return
+    if config.canary is not None:
+        from cptools2 import canary
+        scripts = canary.make_canary_scripts(
+            config.commands_location,
+            logfile_location,
+            by=config.canary,
+            scheduler=config.scheduler,
+            max_running=config.max_running,
+            circuit_breaker=config.circuit_breaker,
+            runtime=runtime,
+            memory=memory,
+            task_ids=task_ids,
+            result_cache=result_cache_location
+        )
+        if scripts["submit"] is not None:
+            pretty_print("created canary tasks, submit with {}".format(
+                colours.yellow(scripts["submit"]))
+            )
+        return
+    if task_ids is None:
+        commands_line_count = generate_scripts.lines_in_commands(config.commands_location)
+    else:
+        commands_line_count = {"cp_commands": len(task_ids)}
     generate_scripts.make_qsub_scripts(
-       config.commands_location,
+        config.commands_location,
         commands_line_count,
-        logfile_location=logfile_location
+        logfile_location=logfile_location,
+        task_list=task_list,
+        scheduler=config.scheduler,
+        max_running=config.max_running,
+        circuit_breaker=config.circuit_breaker,
+        runtime=runtime,
+        memory=memory,
+        result_cache=result_cache_location
+    )
+
+
+def prepare_scan(config):
+    """
+    list the plate directories and create the scan array job and the
+    reduce job which creates the job from its results, see `scan`
+    """
+    from cptools2 import scan
+    pretty_print("listing plates for a distributed scan")
+    shards = scan.assign_shards(scan.list_plates(config), config.distributed_scan["n_tasks"])
+    if not shards:
+        raise scan.ScanError("no plates to scan")
+    n_tasks = scan.write_plates(config.commands_location, shards)
+    pretty_print("{} plate(s) split over {} scan task(s)".format(
+        colours.yellow(len(shards)), colours.yellow(n_tasks))
+    )
+    kwargs = dict(config.distributed_scan)
+    kwargs.update(n_tasks=n_tasks)
+    scripts = scan.make_scan_scripts(
+        config.commands_location,
+        os.path.join(config.location, "logfiles"),
+        config.yaml_path,
+        scheduler=config.scheduler,
+        **kwargs
+    )
+    pretty_print("submit the scan with {}".format(colours.yellow(scripts["submit"])))
+    pretty_print("once the reduce job has finished, submit the analysis script as usual")
+
+
+def scan_command(argv):
+    """
+    run a task of a distributed scan, or the reduce job which merges the
+    scan's results and creates the job
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `scan`
+
+    Returns:
+    --------
+    int, exit code
+    """
+    from cptools2 import parse_config
+    from cptools2 import scan
+    parser = argparse.ArgumentParser(prog="cptools2 scan")
+    parser.add_argument("config", help="config file")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--task", type=int, help="scan task to run")
+    group.add_argument(
+        "--reduce", action="store_true",
+        help="merge the partial image tables and create the job"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    if args.reduce:
+        try:
+            lister = scan.ScanFilelist(config.microscope, config.commands_location)
+        except scan.ScanError as err:
+            pretty_print(colours.red(str(err)))
+            return 1
+        configure_job(config, lister)
+        make_scripts(config)
+        return 0
+    from cptools2 import filelist
+    from cptools2 import job
+    jobber = job.Job(
+        config.microscope, channels=config.get_used_channels(),
+        image_filter=filelist.ImageFilter(**config.image_filter_args())
+    )
+    n_plates, n_images = scan.scan_task(jobber, config.commands_location, args.task)
+    pretty_print("scanned {} image(s) from {} plate(s)".format(n_images, n_plates))
+    return 0
+
+
+def batch_command(argv):
+    """
+    create the jobs for several config files at once, sharing the
+    directory scans between them
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `batch`
+
+    Returns:
+    --------
+    int, exit code, 1 if any job failed
+    """
+    from cptools2 import batch
+    from cptools2 import parse_config
+    parser = argparse.ArgumentParser(prog="cptools2 batch")
+    parser.add_argument("configs", nargs="+", help="config files")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=batch.DEFAULT_WORKERS,
+        help="number of directory scans to run at once"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="number of jobs to create at once (default: number of cpus)"
+    )
+    args = parser.parse_args(argv)
+    configs = [parse_config.Config(path) for path in args.configs]
+    pretty_print("creating {} job(s)".format(colours.yellow(len(configs))))
+
+    def create_job(config, filelister):
+        configure_job(config, filelister)
+        make_scripts(config)
+
+    errors = batch.run_batch(configs, create_job, workers=args.workers, jobs=args.jobs)
+    for path, err in zip(args.configs, errors):
+        if err is None:
+            print(colours.purple("\t {}".format(path)), colours.green("done"))
+        else:
+            print(colours.purple("\t {}".format(path)), colours.red("failed: {}".format(err)))
+    return 1 if any(err is not None for err in errors) else 0
+
+
+def resubmit_command(argv):
+    """
+    create a script to re-run the failed or missing tasks of a job
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `resubmit`
+    """
+    from cptools2 import parse_config
+    from cptools2 import resubmit
+    from cptools2 import utils
+    parser = argparse.ArgumentParser(prog="cptools2 resubmit")
+    parser.add_argument("config", help="config file used to create the job")
+    parser.add_argument(
+        "--expect", nargs="+", default=None,
+        help="files expected in each task's output directory, e.g Image.csv"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    logfile_location = os.path.join(config.location, "logfiles")
+    pretty_print("checking status logs in {}".format(colours.yellow(logfile_location)))
+    failed, script = resubmit.resubmit(
+        config.commands_location, logfile_location, args.expect,
+        scheduler=config.scheduler
+    )
+    if script is None:
+        pretty_print("no failed tasks found")
+    else:
+        pretty_print("{} failed task(s): {}".format(
+            colours.yellow(len(failed)),
+            colours.yellow(utils.compact_ranges(failed)))
+        )
+        pretty_print("created resubmission script {}".format(colours.yellow(script)))
+
+
+def stats_command(argv):
+    """
+    summarise the runtime, memory use and throughput of an array job's tasks
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `stats`
+
+    Returns:
+    --------
+    int, exit code, 1 if there are no runtime records
+    """
+    from cptools2 import parse_config
+    from cptools2 import runtime
+    parser = argparse.ArgumentParser(prog="cptools2 stats")
+    parser.add_argument("config", help="config file used to create the job")
+    parser.add_argument(
+        "--threshold", type=float, default=runtime.OUTLIER_THRESHOLD,
+        help="robust z-score above which a task is reported as an outlier"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    logfile_location = os.path.join(config.location, "logfiles")
+    records = runtime.read_runtime_records(logfile_location)
+    if not records:
+        pretty_print("no runtime records found in {}".format(colours.yellow(logfile_location)))
+        return 1
+    summary = runtime.summarise(records, args.threshold)
+    pretty_print("{} task(s) on {} host(s), {} failed".format(
+        colours.yellow(summary.n_tasks),
+        colours.yellow(summary.n_hosts),
+        colours.yellow(summary.n_failed))
+    )
+    if summary.imagesets_per_second is not None:
+        pretty_print("{} imagesets, {:.1f} GB input, {:.3f} imagesets/s per task".format(
+            summary.n_imagesets, summary.input_bytes / 1024 ** 3,
+            summary.imagesets_per_second)
+        )
+    for label, values, unit in [("task time", summary.task_seconds, "s"),
+                                ("peak memory", summary.memory_mb, "MB")]:
+        if values[50] is None:
+            continue
+        pretty_print("{}: median {:.0f}{unit}, 90% {:.0f}{unit}, 99% {:.0f}{unit}, max {:.0f}{unit}".format(
+            label, values[50], values[90], values[99], values[100], unit=unit)
+        )
+    if summary.outliers:
+        pretty_print("{} outlier task(s):".format(colours.yellow(len(summary.outliers))))
+        for outlier in summary.outliers:
+            print(colours.purple("\t task {} ({})".format(outlier.task_id, outlier.name)),
+                  "{} {:.2f} vs median {:.2f} on {}".format(
+                      outlier.reason, outlier.value, outlier.median, outlier.hostname))
+
+
+def pilot_command(argv):
+    """
+    create a pilot job from a sample of the imagesets, or once it has run,
+    recommend the chunk size, runtime and memory for the full run
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `pilot`
+
+    Returns:
+    --------
+    int, exit code, 1 if reporting and no pilot tasks have finished
+    """
+    from cptools2 import parse_config
+    from cptools2 import pilot
+    parser = argparse.ArgumentParser(prog="cptools2 pilot")
+    parser.add_argument("config", help="config file")
+    parser.add_argument(
+        "--fraction", type=float, default=0.01,
+        help="fraction of the imagesets in each plate to run"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the sample")
+    parser.add_argument(
+        "--chunk", type=int, default=None,
+        help="imagesets per pilot task (default: chunk in the config)"
+    )
+    parser.add_argument(
+        "--report", action="store_true",
+        help="recommend settings from a finished pilot run rather than create one"
+    )
+    parser.add_argument(
+        "--target-hours", type=float, default=pilot.DEFAULT_TARGET_SECONDS / 3600.0,
+        help="how long each task of the full run should take"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    location, commands_location, logfile_location = pilot.pilot_locations(
+        config.location, config.commands_location
+    )
+    if args.report:
+        from cptools2 import runtime
+        info = pilot.read_pilot_info(commands_location) or dict()
+        recommendation = pilot.recommend(
+            runtime.read_runtime_records(logfile_location),
+            target_seconds=args.target_hours * 3600,
+            total_imagesets=info.get("n_total")
+        )
+        if recommendation is None:
+            pretty_print("no finished pilot tasks in {}".format(colours.yellow(logfile_location)))
+            return 1
+        pretty_print("{} pilot task(s): {:.1f}s startup, {:.2f}s per imageset".format(
+            colours.yellow(recommendation.n_tasks),
+            recommendation.overhead_seconds,
+            recommendation.seconds_per_imageset)
+        )
+        pretty_print("recommended chunk: {}".format(colours.yellow(recommendation.chunk)))
+        pretty_print("recommended h_rt: {}".format(colours.yellow(recommendation.h_rt)))
+        if recommendation.memory_mb is not None:
+            pretty_print("recommended memory: {}".format(
+                colours.yellow("{}M".format(recommendation.memory_mb)))
+            )
+        if recommendation.cpu_hours is not None:
+            pretty_print("full run: {} imagesets, about {:.0f} cpu hours".format(
+                recommendation.total_imagesets, recommendation.cpu_hours)
+            )
+        return 0
+    from cptools2 import generate_scripts
+    if not 0 < args.fraction <= 1:
+        parser.error("--fraction has to be between 0 and 1")
+    jobber = make_job(config)
+    n_sampled, n_total = pilot.sample_job(jobber, args.fraction, args.seed)
+    pretty_print("sampled {} of {} imagesets".format(
+        colours.yellow(n_sampled), colours.yellow(n_total))
+    )
+    chunk = args.chunk or config.chunk
+    if chunk is not None:
+        jobber.chunk(chunk)
+    command_args = config.create_command_args()
+    command_args.update(location=location, commands_location=commands_location, job_size=chunk)
+    if not os.path.isdir(commands_location):
+        os.makedirs(commands_location)
+    jobber.create_commands(**command_args)
+    pilot.write_pilot_info(commands_location, args.fraction, n_sampled, n_total)
+    script = generate_scripts.make_qsub_scripts(
+        commands_location,
+        generate_scripts.lines_in_commands(commands_location),
+        logfile_location=logfile_location,
+        script_name="pilot",
+        scheduler=config.scheduler
+    )
+    pretty_print("created pilot script {}".format(colours.yellow(script)))
+    pretty_print("once it has finished run {}".format(
+        colours.yellow("cptools2 pilot {} --report".format(args.config)))
+    )
+    return 0
+
+
+def run_local_command(argv):
+    """
+    create the job and run the tasks on this machine rather than
+    submitting an array job
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `run-local`
+
+    Returns:
+    --------
+    int, exit code, 1 if any tasks failed
+    """
+    from cptools2 import local
+    from cptools2 import parse_config
+    parser = argparse.ArgumentParser(prog="cptools2 run-local")
+    parser.add_argument("config", help="config file")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count(),
+        help="number of tasks to run at once (default: number of cpus)"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None,
+        help="seconds before a task is killed and marked as failed"
+    )
+    parser.add_argument(
+        "--memory", type=int, default=None,
+        help="memory budget in MB for all running tasks (default: total memory)"
+    )
+    parser.add_argument(
+        "--task-memory", type=int, default=local.DEFAULT_TASK_MEMORY,
+        help="memory in MB reserved for each task"
+    )
+    parser.add_argument(
+        "--report-interval", type=float, default=30,
+        help="seconds between progress reports"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    pretty_print("parsing config file {}".format(colours.yellow(args.config)))
+    configure_job(config)
+    logfile_location = os.path.join(config.location, "logfiles")
+    pretty_print("running tasks with {} worker(s)".format(colours.yellow(args.workers)))
+    summary = local.run_local(
+        config.commands_location,
+        logfile_location,
+        workers=args.workers,
+        timeout=args.timeout,
+        memory=args.memory,
+        task_memory=args.task_memory,
+        report_interval=args.report_interval
+    )
+    pretty_print("{} task(s) finished, {} failed in {:.1f}s".format(
+        colours.yellow(summary.n_finished),
+        colours.yellow(summary.n_failed),
+        summary.elapsed)
+    )
+    return 1 if summary.n_failed > 0 else 0
+
+
+def merge_command(argv):
+    """
+    merge each task's cellprofiler output into Parquet files per plate
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `merge`
+    """
+    from cptools2 import merge
+    from cptools2 import parse_config
+    parser = argparse.ArgumentParser(prog="cptools2 merge")
+    parser.add_argument("config", help="config file used to create the job")
+    parser.add_argument(
+        "-o", "--output", default=None,
+        help="directory to write Parquet files (default: location/merged)"
+    )
+    parser.add_argument(
+        "--tables", nargs="+", default=None,
+        help="tables to merge, e.g Image Cells (default: all)"
     )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None,
+        help="number of processes (default: number of cpus)"
+    )
+    parser.add_argument(
+        "--float32", action="store_true",
+        help="downcast float64 columns to float32"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=merge.DEFAULT_CHUNKSIZE,
+        help="rows read from each csv file at a time"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    out_dir = args.output or os.path.join(config.location, "merged")
+    tasks = merge.discover_tasks(
+        config.location, config.commands_location, config.layout
+    )
+    pretty_print("merging output from {} task(s) into {}".format(
+        colours.yellow(len(tasks)), colours.yellow(out_dir))
+    )
+    results = merge.merge(
+        tasks, out_dir,
+        tables=args.tables,
+        workers=args.workers,
+        float32=args.float32,
+        chunksize=args.chunksize
+    )
+    for table, plate, n_rows in results:
+        print(colours.purple("\t {}".format(table)), colours.yellow(plate), n_rows)
+
+
+def aggregate_command(argv):
+    """
+    reduce each task's object tables to per-well profiles
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `aggregate`
+    """
+    from cptools2 import aggregate
+    from cptools2 import merge
+    from cptools2 import parse_config
+    parser = argparse.ArgumentParser(prog="cptools2 aggregate")
+    parser.add_argument("config", help="config file used to create the job")
+    parser.add_argument(
+        "-o", "--output", default=None,
+        help="directory to write the profiles (default: location/aggregated)"
+    )
+    parser.add_argument(
+        "--tables", nargs="+", default=None,
+        help="tables to aggregate, e.g Cells Nuclei (default: all)"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None,
+        help="number of processes (default: number of cpus)"
+    )
+    parser.add_argument(
+        "--sketch-size", type=int, default=aggregate.DEFAULT_SKETCH_SIZE,
+        help="size of the quantile sketch, larger is more accurate"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=merge.DEFAULT_CHUNKSIZE,
+        help="rows read from each csv file at a time"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    out_dir = args.output or os.path.join(config.location, "aggregated")
+    tasks = merge.discover_tasks(
+        config.location, config.commands_location, config.layout
+    )
+    pretty_print("aggregating output from {} task(s) into {}".format(
+        colours.yellow(len(tasks)), colours.yellow(out_dir))
+    )
+    paths = aggregate.aggregate(
+        tasks, out_dir,
+        tables=args.tables,
+        workers=args.workers,
+        sketch_size=args.sketch_size,
+        chunksize=args.chunksize
+    )
+    for path in paths:
+        print(colours.purple("\t {}".format(path)))
+
+
+def collate_command(argv):
+    """
+    merge each task's cellprofiler output as soon as the task finishes
+
+    Parameters:
+    -----------
+    argv: list
+        command line arguments after `collate`
+    """
+    from cptools2 import collate
+    from cptools2 import parse_config
+    from cptools2 import utils
+    parser = argparse.ArgumentParser(prog="cptools2 collate")
+    parser.add_argument("config", help="config file used to create the job")
+    parser.add_argument(
+        "-o", "--output", default=None,
+        help="directory to write Parquet files (default: location/merged)"
+    )
+    parser.add_argument(
+        "-f", "--follow", action="store_true",
+        help="keep watching the status logs until every task is merged or has failed"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=60,
+        help="seconds between checking the status logs"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None,
+        help="number of processes (default: number of cpus)"
+    )
+    parser.add_argument(
+        "--float32", action="store_true",
+        help="downcast float64 columns to float32"
+    )
+    parser.add_argument(
+        "--no-compact", action="store_true",
+        help="keep a file per task rather than combining them per plate"
+    )
+    args = parser.parse_args(argv)
+    config = parse_config.Config(args.config)
+    out_dir = args.output or os.path.join(config.location, "merged")
+    collator = collate.Collator(
+        config.commands_location,
+        os.path.join(config.location, "logfiles"),
+        out_dir,
+        float32=args.float32,
+        compact=not args.no_compact,
+        workers=args.workers
+    )
+    pretty_print("collating output into {}".format(colours.yellow(out_dir)))
+
+    def report(n_merged):
+        pretty_print("merged {} new task(s), {}/{} in total".format(
+            colours.yellow(n_merged),
+            colours.yellow(len(collator.state.merged)),
+            colours.yellow(len(collator.tasks)))
+        )
+
+    collator.run(follow=args.follow, poll_interval=args.poll_interval, callback=report)
+    failed = collator.failed()
+    if failed:
+        pretty_print("{} task(s) failed or finished without output: {}".format(
+            colours.yellow(len(failed)),
+            colours.yellow(utils.compact_ranges(failed)))
+        )
+        pretty_print("re-run them with `cptools2 resubmit`, then collate again")
+
+
+SUBCOMMANDS = {
+    "batch": batch_command,
+    "resubmit": resubmit_command,
+    "run-local": run_local_command,
+    "pilot": pilot_command,
+    "stats": stats_command,
+    "merge": merge_command,
+    "collate": collate_command,
+    "aggregate": aggregate_command,
+    "scan": scan_command,
+}
 
 
 def main():
     """run cptools.job.Job on a yaml file containing arguments"""
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        return_code = SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        sys.exit(return_code or 0)
     parser = argparse.ArgumentParser()
+    parser.add_argument("config", nargs="?", help="config file")
     parser.add_argument("-t", "--template", action="store_true")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="record the time and memory used by each stage, written as JSON "
+             "next to the commands"
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="with --profile, also record the peak memory allocated in each "
+             "stage with tracemalloc (much slower)"
+    )
+    parser.add_argument(
+        "--cprofile", action="store_true",
+        help="also write a cProfile dump next to the commands"
+    )
     args, unknown = parser.parse_known_args()
     if args.template:
         # print out template and exit
@@ -83,12 +830,19 @@ def main():
      \___|_|   |_| \___/ \___/|____|___/___|
     """)))
     check_arguments()
+    from cptools2 import parse_config
     # parse yaml file into a dictionary
-    path_to_config = sys.argv[1]
+    path_to_config = args.config
     config = parse_config.Config(path_to_config)
     pretty_print("parsing config file {}".format(colours.yellow(path_to_config)))
-    configure_job(config)
-    pretty_print("creating SGE script")
+    if config.distributed_scan is not None:
+        prepare_scan(config)
+        return
+    if args.profile or args.cprofile:
+        profile_job(config, args.trace_memory, args.cprofile)
+    else:
+        configure_job(config)
+    pretty_print("creating {} script".format(config.scheduler.upper()))
     make_scripts(config)
     pretty_print("DONE!")
 
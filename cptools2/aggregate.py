@@ -0,0 +1,436 @@
+"""
+Reduce the per-object CellProfiler output to per-well profiles, without ever
+holding all of the objects in memory.
+
+Each task's tables are streamed through once in chunks. Objects are matched
+to their well through the `Metadata_plate` and `Metadata_well` columns of the
+task's Image table, and every well keeps running statistics for each feature:
+the count, mean and variance, plus a quantile sketch which gives the median
+and median absolute deviation. These statistics can be merged, so tasks are
+aggregated in parallel and a well split across several tasks is combined
+exactly as if it had been read in one go.
+
+The quantile sketch follows KLL (Karnin, Lang & Liberty 2016): sorted buffers
+are repeatedly halved and promoted to a level where each value stands for
+twice as many objects, giving a rank error of roughly 1.7 / `sketch_size`
+with memory proportional to `sketch_size`. Wells with fewer objects than
+`sketch_size` are never compacted, so their medians are exact.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as _pd
+
+from cptools2 import merge, utils
+
+
+STATISTICS = ("mean", "variance", "median", "mad")
+WELL_COLUMNS = ["Metadata_plate", "Metadata_well"]
+IMAGE_TABLE = "Image"
+DEFAULT_SKETCH_SIZE = 200
+# each level of the sketch holds this fraction of the level above it
+SKETCH_DECAY = 2.0 / 3.0
+
+
+class RunningMoments(object):
+    """
+    Count, mean and sum of squared deviations for each column, updated in
+    batches and merged with Chan et al.'s parallel algorithm. Missing values
+    are ignored.
+
+    Parameters:
+    -----------
+    n_features: int
+        number of columns
+    """
+
+    def __init__(self, n_features):
+        self.n = np.zeros(n_features, dtype=np.int64)
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+
+    def _combine(self, n, mean, m2):
+        total = self.n + n
+        delta = mean - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = np.where(total > 0, n / total, 0.0)
+        self.mean = self.mean + delta * frac
+        self.m2 = self.m2 + m2 + delta ** 2 * self.n * frac
+        self.n = total
+
+    def update(self, values):
+        """add a 2D array of values, rows are objects"""
+        present = ~np.isnan(values)
+        n = present.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(n > 0, np.nansum(values, axis=0) / n, 0.0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+        self._combine(n, mean, m2)
+
+    def merge(self, other):
+        self._combine(other.n, other.mean, other.m2)
+
+    def variance(self):
+        """sample variance, NaN for columns with fewer than two values"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.n > 1, self.m2 / (self.n - 1), np.nan)
+
+    def get_mean(self):
+        return np.where(self.n > 0, self.mean, np.nan)
+
+
+def weighted_quantile(values, weights, q):
+    """
+    quantile of each column of `values`, where each row has a weight
+
+    The midpoint is taken where the quantile falls between two values, so
+    with equal weights the median matches numpy's. Missing values are
+    ignored.
+
+    Parameters:
+    -----------
+    values: numpy.ndarray
+        2D array, rows are items
+    weights: numpy.ndarray
+        1D array of row weights
+    q: float
+        quantile between 0 and 1
+
+    Returns:
+    --------
+    numpy.ndarray, one value per column, NaN for empty columns
+    """
+    n_features = values.shape[1]
+    if values.shape[0] == 0:
+        return np.full(n_features, np.nan)
+    # NaNs are sorted to the end of each column
+    order = np.argsort(values, axis=0, kind="mergesort")
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    sorted_weights = np.where(np.isnan(sorted_values), 0, weights[order])
+    cumulative = np.cumsum(sorted_weights, axis=0)
+    target = q * cumulative[-1]
+    lower = (cumulative >= target).argmax(axis=0)
+    upper = (cumulative > target).argmax(axis=0)
+    columns = np.arange(n_features)
+    result = (sorted_values[lower, columns].astype(np.float64) +
+              sorted_values[upper, columns]) / 2
+    result[cumulative[-1] == 0] = np.nan
+    return result
+
+
+class QuantileSketch(object):
+    """
+    KLL quantile sketch of each column of a stream of 2D arrays.
+
+    Every column is sorted independently when a level is compacted, so a
+    single set of buffers serves all of the features.
+
+    Parameters:
+    -----------
+    n_features: int
+        number of columns
+    size: int (default = DEFAULT_SKETCH_SIZE)
+        capacity of the top level, larger is more accurate
+    seed: int (optional)
+        seed for choosing which half of a buffer is kept
+    """
+
+    def __init__(self, n_features, size=DEFAULT_SKETCH_SIZE, seed=None):
+        self.n_features = n_features
+        self.size = size
+        self.levels = []
+        self.random = np.random.RandomState(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.size * SKETCH_DECAY ** depth)))
+
+    def _add(self, level, values):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty((0, self.n_features), dtype=np.float32))
+        self.levels[level] = np.concatenate([self.levels[level], values])
+
+    def _compact(self, level):
+        buffer = np.sort(self.levels[level], axis=0)
+        # an odd row out stays behind, so the total weight is unchanged
+        n_pairs = buffer.shape[0] // 2
+        self.levels[level] = buffer[2 * n_pairs:]
+        offset = self.random.randint(2)
+        self._add(level + 1, buffer[offset:2 * n_pairs:2])
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if self.levels[level].shape[0] > self.capacity(level):
+                self._compact(level)
+                # capacities change if a new level was added
+                level = 0
+            else:
+                level += 1
+
+    def update(self, values):
+        """add a 2D array of values, rows are objects"""
+        self._add(0, values.astype(np.float32))
+        self._compress()
+
+    def merge(self, other):
+        for level, values in enumerate(other.levels):
+            self._add(level, values)
+        self._compress()
+
+    def _items(self):
+        if not self.levels:
+            return np.empty((0, self.n_features), dtype=np.float32), np.empty(0)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(i.shape[0], 2 ** level) for level, i in enumerate(self.levels)]
+        )
+        return values, weights
+
+    def quantile(self, q):
+        values, weights = self._items()
+        return weighted_quantile(values, weights, q)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def mad(self):
+        """median absolute deviation from the median, unscaled"""
+        values, weights = self._items()
+        median = weighted_quantile(values, weights, 0.5)
+        return weighted_quantile(np.abs(values - median), weights, 0.5)
+
+
+class WellStats(object):
+    """
+    Running statistics for the objects in one well of one table.
+
+    Parameters:
+    -----------
+    n_features: int
+        number of feature columns
+    sketch_size: int (default = DEFAULT_SKETCH_SIZE)
+        size of the quantile sketch
+    """
+
+    def __init__(self, n_features, sketch_size=DEFAULT_SKETCH_SIZE):
+        self.n_objects = 0
+        self.moments = RunningMoments(n_features)
+        self.sketch = QuantileSketch(n_features, sketch_size, seed=0)
+
+    def update(self, values):
+        self.n_objects += values.shape[0]
+        self.moments.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self.n_objects += other.n_objects
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def statistic(self, name):
+        """one of STATISTICS for each feature"""
+        if name == "mean":
+            return self.moments.get_mean()
+        if name == "variance":
+            return self.moments.variance()
+        if name == "median":
+            return self.sketch.median()
+        if name == "mad":
+            return self.sketch.mad()
+        raise ValueError("unknown statistic '{}', expected one of {}".format(
+            name, STATISTICS)
+        )
+
+
+def feature_columns(columns):
+    """the numeric measurement columns, i.e not metadata or object numbers"""
+    return [i for i in columns if merge.column_type(i) == "float"]
+
+
+def table_features(tasks, tables):
+    """
+    dictionary of table: feature columns, from the csv headers of every
+    task, so every plate is aggregated to the same columns
+
+    Tables without an ImageNumber column can't be matched to a well, and are
+    left out.
+    """
+    features = dict()
+    for table in tables:
+        columns = merge.table_columns(tasks, table)
+        if "ImageNumber" in columns:
+            features[table] = feature_columns(columns)
+    return features
+
+
+def image_wells(task, image_table=IMAGE_TABLE):
+    """
+    the well for each image in a task
+
+    Returns:
+    --------
+    tuple of (list of (plate, well), numpy array mapping ImageNumber to an
+    index into the list, -1 for unknown images)
+    """
+    path = merge.table_path(task, image_table)
+    images = _pd.read_csv(
+        path, usecols=["ImageNumber"] + WELL_COLUMNS, dtype={i: str for i in WELL_COLUMNS}
+    )
+    keys = list(images[WELL_COLUMNS].drop_duplicates().itertuples(index=False, name=None))
+    key_index = {key: i for i, key in enumerate(keys)}
+    lookup = np.full(images["ImageNumber"].max() + 1, -1, dtype=np.int64)
+    codes = [key_index[i] for i in images[WELL_COLUMNS].itertuples(index=False, name=None)]
+    lookup[images["ImageNumber"].values] = codes
+    return keys, lookup
+
+
+def aggregate_task(task, features, sketch_size=DEFAULT_SKETCH_SIZE,
+                   chunksize=merge.DEFAULT_CHUNKSIZE, image_table=IMAGE_TABLE):
+    """
+    running statistics for each well in a single task
+
+    Parameters:
+    -----------
+    task: merge.TaskOutput
+    features: dict
+        table: feature columns, from `table_features`
+
+    Returns:
+    --------
+    dictionary of (table, plate, well): WellStats
+    """
+    stats = dict()
+    if not os.path.isfile(merge.table_path(task, image_table)):
+        return stats
+    keys, lookup = image_wells(task, image_table)
+    for table, columns in features.items():
+        path = merge.table_path(task, table)
+        if not os.path.isfile(path):
+            continue
+        present = set(merge.read_header(path))
+        usecols = ["ImageNumber"] + [i for i in columns if i in present]
+        for chunk in _pd.read_csv(path, usecols=usecols, chunksize=chunksize):
+            image_numbers = chunk["ImageNumber"].values
+            known = (image_numbers >= 0) & (image_numbers < len(lookup))
+            codes = np.full(len(image_numbers), -1, dtype=np.int64)
+            codes[known] = lookup[image_numbers[known]]
+            values = chunk.reindex(columns=columns).apply(
+                _pd.to_numeric, errors="coerce"
+            ).values.astype(np.float64)
+            # group the chunk's rows by well
+            order = np.argsort(codes, kind="mergesort")
+            codes, values = codes[order], values[order]
+            uniques, starts = np.unique(codes, return_index=True)
+            ends = np.append(starts[1:], len(codes))
+            for code, start, end in zip(uniques, starts, ends):
+                if code < 0:
+                    continue
+                key = (table,) + keys[code]
+                if key not in stats:
+                    stats[key] = WellStats(len(columns), sketch_size)
+                stats[key].update(values[start:end])
+    return stats
+
+
+def _aggregate_task(args):
+    """aggregate_task() in a worker process"""
+    return aggregate_task(*args)
+
+
+def merge_stats(results):
+    """merge dictionaries of WellStats from several tasks"""
+    merged = dict()
+    for stats in results:
+        for key, well_stats in stats.items():
+            if key in merged:
+                merged[key].merge(well_stats)
+            else:
+                merged[key] = well_stats
+    return merged
+
+
+def well_profiles(stats, features, statistic):
+    """
+    well-level table of one statistic
+
+    Parameters:
+    -----------
+    stats: dict
+        (table, plate, well): WellStats
+    features: dict
+        table: feature columns
+    statistic: string
+        one of STATISTICS
+
+    Returns:
+    --------
+    pandas.DataFrame, one row per well, with a Count_<table> column of the
+    number of objects and a <table>_<feature> column per feature
+    """
+    tables = sorted(features)
+    wells = sorted(set(key[1:] for key in stats))
+    columns = list(WELL_COLUMNS)
+    columns += ["Count_{}".format(table) for table in tables]
+    for table in tables:
+        columns += ["{}_{}".format(table, i) for i in features[table]]
+    rows = []
+    for plate, well in wells:
+        row = [plate, well]
+        for table in tables:
+            well_stats = stats.get((table, plate, well))
+            row.append(well_stats.n_objects if well_stats is not None else 0)
+        for table in tables:
+            well_stats = stats.get((table, plate, well))
+            if well_stats is None:
+                row.extend([np.nan] * len(features[table]))
+            else:
+                row.extend(well_stats.statistic(statistic))
+        rows.append(row)
+    return _pd.DataFrame(rows, columns=columns)
+
+
+def aggregate(tasks, out_dir, tables=None, workers=None, sketch_size=DEFAULT_SKETCH_SIZE,
+              chunksize=merge.DEFAULT_CHUNKSIZE, image_table=IMAGE_TABLE):
+    """
+    aggregate the tasks' object tables to well-level profiles
+
+    Plates are aggregated one at a time, so only one plate's running
+    statistics are held in memory. Writes `out_dir`/<statistic>.csv for each
+    of STATISTICS.
+
+    Parameters:
+    -----------
+    tasks: list of merge.TaskOutput
+    out_dir: string
+        directory to write the profiles to
+    tables: list of strings (optional)
+        names of tables to aggregate, defaults to every table found
+    workers: int (optional)
+        number of processes, defaults to the number of cpus
+    sketch_size: int
+        size of the quantile sketch for the median and MAD
+    chunksize: int
+        number of rows to read from a csv file at a time
+
+    Returns:
+    --------
+    list of paths written
+    """
+    if tables is None:
+        tables = merge.find_tables(tasks)
+    features = table_features(tasks, tables)
+    utils.make_dir(out_dir)
+    paths = [os.path.join(out_dir, "{}.csv".format(i)) for i in STATISTICS]
+    plates = merge.group_by_plate(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for i, plate in enumerate(sorted(plates)):
+            args = [(task, features, sketch_size, chunksize, image_table)
+                    for task in plates[plate]]
+            stats = merge_stats(executor.map(_aggregate_task, args))
+            for statistic, path in zip(STATISTICS, paths):
+                profiles = well_profiles(stats, features, statistic)
+                profiles.to_csv(path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+    return paths
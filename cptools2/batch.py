@@ -0,0 +1,183 @@
+"""
+Create the jobs for several configs at once.
+
+Scanning directories is the slow part of creating a job on a network
+filesystem, so the scans for every config are run together in one shared
+thread pool, with a cache so that an experiment or plate used by more than
+one config is only scanned once. Each config's job is created as soon as its
+own scans are ready, and written to its own locations as if run alone.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cptools2 import filelist
+
+
+# directory scans wait on the filesystem rather than the cpu
+DEFAULT_WORKERS = 16
+
+
+class ScanCache(object):
+    """
+    Thread-safe cache of directory scans, run in a shared executor.
+
+    Parameters:
+    -----------
+    executor: concurrent.futures.Executor
+        pool to run the scans in
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._futures = dict()
+        self._listers = dict()
+        self._lock = threading.Lock()
+
+    def lister(self, microscope):
+        """the filelist.Filelist for a microscope"""
+        with self._lock:
+            if microscope not in self._listers:
+                self._listers[microscope] = filelist.Filelist(microscope)
+            return self._listers[microscope]
+
+    def _submit(self, key, func, arg):
+        with self._lock:
+            if key not in self._futures:
+                self._futures[key] = self.executor.submit(func, arg)
+            return self._futures[key]
+
+    def paths_to_plates(self, microscope, exp_dir):
+        """future of the plate directories in an experiment"""
+        lister = self.lister(microscope)
+        return self._submit(("plates", microscope, exp_dir), lister.paths_to_plates, exp_dir)
+
+    def files_from_plate(self, microscope, plate_dir):
+        """future of the image files in a plate directory"""
+        lister = self.lister(microscope)
+        return self._submit(("files", microscope, plate_dir), lister.files_from_plate, plate_dir)
+
+    def filelister(self, microscope):
+        """a filelister for job.Job which answers from this cache"""
+        return CachedFilelist(self, microscope)
+
+    def __len__(self):
+        return len(self._futures)
+
+
+class CachedFilelist(object):
+    """
+    Stand-in for filelist.Filelist, waiting on scans from a ScanCache.
+
+    Parameters:
+    -----------
+    cache: ScanCache
+    microscope: string
+    """
+
+    def __init__(self, cache, microscope):
+        self.cache = cache
+        self.microscope = microscope
+
+    def paths_to_plates(self, exp_dir):
+        return self.cache.paths_to_plates(self.microscope, exp_dir).result()
+
+    def files_from_plate(self, plate_dir):
+        return self.cache.files_from_plate(self.microscope, plate_dir).result()
+
+    def clean_filelist(self, filelist):
+        return self.cache.lister(self.microscope).clean_filelist(filelist)
+
+
+def prefetch(cache, config):
+    """
+    start every scan a config needs, without waiting for them
+
+    Parameters:
+    -----------
+    cache: ScanCache
+    config: parse_config.Config
+    """
+    microscope = config.microscope
+    image_filter = filelist.ImageFilter(**config.image_filter_args())
+    removed = set(config.removed_plates())
+    if config.experiment is not None:
+
+        def scan_plates(future):
+            if future.exception() is not None:
+                # raised again when the job asks for the plates
+                return
+            for plate_dir in future.result():
+                plate = os.path.basename(plate_dir)
+                if plate in removed or not image_filter.keep_plate(plate):
+                    continue
+                try:
+                    cache.files_from_plate(microscope, plate_dir)
+                except RuntimeError:
+                    # the pool has shut down after a failed job
+                    return
+
+        cache.paths_to_plates(microscope, config.experiment).add_done_callback(scan_plates)
+    for add_plate in config.add_plate or []:
+        for plate in add_plate["plates"]:
+            if not image_filter.keep_plate(plate):
+                continue
+            cache.files_from_plate(microscope, os.path.join(add_plate["exp_dir"], plate))
+
+
+def check_locations(configs):
+    """
+    raise a ValueError if configs would write to the same location or
+    commands location
+    """
+    for attr in ["location", "commands_location"]:
+        seen = dict()
+        for config in configs:
+            path = os.path.abspath(getattr(config, attr))
+            if path in seen:
+                err_msg = "'{}' and '{}' have the same {}: '{}'"
+                raise ValueError(err_msg.format(
+                    seen[path], config.yaml_path, attr.replace("_", " "), path
+                ))
+            seen[path] = config.yaml_path
+
+
+def run_batch(configs, create_job, workers=DEFAULT_WORKERS, jobs=None):
+    """
+    create the jobs for several configs, sharing directory scans
+
+    Parameters:
+    -----------
+    configs: list of parse_config.Config
+    create_job: function
+        called as create_job(config, filelister) in a thread for each
+        config, should create the job using `filelister` to list files
+    workers: int (default = DEFAULT_WORKERS)
+        number of directory scans to run at once
+    jobs: int (optional)
+        number of jobs to create at once, defaults to the number of cpus
+
+    Returns:
+    --------
+    list of the exception raised for each config, None if it succeeded
+    """
+    check_locations(configs)
+    jobs = min(len(configs), jobs or os.cpu_count() or 1)
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as scan_pool:
+        cache = ScanCache(scan_pool)
+        for config in configs:
+            prefetch(cache, config)
+        with ThreadPoolExecutor(max_workers=jobs) as job_pool:
+            futures = [
+                job_pool.submit(create_job, config, cache.filelister(config.microscope))
+                for config in configs
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                    errors.append(None)
+                except Exception as err:
+                    errors.append(err)
+    return errors
@@ -0,0 +1,174 @@
+"""
+Canary tasks, run before the rest of the array job to catch a broken
+pipeline or LoadData file after a few tasks rather than after every task has
+failed.
+
+A small task is picked from each plate, or from each distinct channel layout
+of the LoadData files. These run as their own array job, and the array job of
+the remaining tasks is held until they succeed. If a canary task fails the
+remaining tasks never start.
+"""
+
+import os
+from datetime import datetime
+from cptools2 import cookiecutter
+from cptools2 import generate_scripts
+from cptools2 import manifest
+
+
+CANARY_OPTIONS = ["plate", "layout"]
+
+
+def channel_layout(loaddata_path):
+    """the image columns in the header of a LoadData file"""
+    with open(loaddata_path, "r") as f:
+        header = f.readline().strip().split(",")
+    return tuple(sorted(i for i in header if i.startswith("FileName_")))
+
+
+def select_canary_tasks(tasks, by="plate"):
+    """
+    pick the canary tasks, the task with the fewest imagesets in each group
+
+    Parameters:
+    -----------
+    tasks: list of manifest.Task
+    by: string (default = "plate")
+        "plate": a task per plate
+        "layout": a task per distinct set of image columns in the LoadData
+        files
+
+    Returns:
+    --------
+    sorted list of task_ids
+    """
+    if by == "plate":
+        group = lambda task: task.plate
+    elif by == "layout":
+        group = lambda task: channel_layout(task.loaddata)
+    else:
+        err_msg = "unknown canary option '{}', options = {}"
+        raise ValueError(err_msg.format(by, CANARY_OPTIONS))
+    smallest = dict()
+    for task in tasks:
+        key = group(task)
+        if key not in smallest or task.n_imagesets < smallest[key].n_imagesets:
+            smallest[key] = task
+    return sorted(task.task_id for task in smallest.values())
+
+
+def make_submit_script(commands_location, canary_script, analysis_script,
+                       scheduler="sge", name="SUBMIT_JOBS"):
+    """
+    script which submits the canary job then the analysis job held on it
+
+    On SGE the analysis script already holds on the canary job's name. On
+    SLURM dependencies need a job ID, so it's passed to sbatch here. Also
+    used for the scan and reduce jobs of a distributed scan, see `scan`,
+    saved as `name` so it isn't confused with the analysis job's.
+
+    Returns:
+    --------
+    string, path to the saved script
+    """
+    if scheduler == "sge":
+        text = [
+            "#!/bin/sh",
+            "qsub {}".format(canary_script),
+            "qsub {}".format(analysis_script),
+        ]
+    else:
+        text = [
+            "#!/bin/sh",
+            "CANARY_JOB=$(sbatch --parsable {} | cut -d ';' -f 1)".format(canary_script),
+            "sbatch --dependency=afterok:$CANARY_JOB {}".format(analysis_script),
+        ]
+    time_now = str(datetime.now().replace(microsecond=0)).replace(" ", "-")
+    submit_path = os.path.join(commands_location, "{}_{}.sh".format(time_now, name))
+    with open(submit_path, "w") as f:
+        f.write("\n".join(text) + "\n")
+    os.chmod(submit_path, 0o755)
+    return submit_path
+
+
+def make_canary_scripts(commands_location, logfile_location, by="plate",
+                        scheduler="sge", max_running=None, circuit_breaker=None,
+                        runtime=None, memory=None, task_ids=None, result_cache=None):
+    """
+    create a canary array job and an analysis array job of the remaining
+    tasks which is held until the canary tasks succeed
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the task manifest
+    logfile_location: string
+        directory for the log files
+    by: string (default = "plate")
+        how to pick the canary tasks, see `select_canary_tasks`
+    scheduler: string (default = "sge")
+    max_running: int (optional)
+        maximum number of canary or analysis tasks to run at once
+    circuit_breaker: dictionary (optional)
+        circuit breaker for the analysis tasks, see
+        `generate_scripts.make_qsub_scripts`
+    runtime: string (optional)
+        run time limit of each task, e.g "02:00:00"
+    memory: string (optional)
+        memory limit of each task, e.g "4G"
+    task_ids: list of ints (optional)
+        only run these tasks of the manifest, e.g those without cached
+        results, defaults to every task
+    result_cache: string (optional)
+        location of the job, to record the keys of successful tasks in its
+        result cache, see `result_cache`
+
+    Returns:
+    --------
+    dictionary of paths to the "canary", "analysis" and "submit" scripts.
+    If every task would be a canary task only the analysis script is
+    created, and the others are None.
+    """
+    tasks = list(manifest.read_manifest(commands_location))
+    if task_ids is not None:
+        task_ids = set(task_ids)
+        tasks = [task for task in tasks if task.task_id in task_ids]
+    canary_ids = select_canary_tasks(tasks, by)
+    canary_set = set(canary_ids)
+    remaining_ids = [task.task_id for task in tasks if task.task_id not in canary_set]
+    if len(remaining_ids) == 0:
+        # nothing to protect
+        task_list = None
+        if task_ids is not None:
+            task_list = os.path.join(commands_location, "analysis_tasks.txt")
+            manifest.write_task_list(task_list, canary_ids)
+        analysis_script = generate_scripts.make_qsub_scripts(
+            commands_location, {"cp_commands": len(tasks)}, logfile_location,
+            task_list=task_list, scheduler=scheduler, max_running=max_running,
+            circuit_breaker=circuit_breaker, runtime=runtime, memory=memory,
+            result_cache=result_cache
+        )
+        return {"canary": None, "analysis": analysis_script, "submit": None}
+    canary_list = os.path.join(commands_location, "canary_tasks.txt")
+    n_canary = manifest.write_task_list(canary_list, canary_ids)
+    remaining_list = os.path.join(commands_location, "analysis_tasks.txt")
+    n_remaining = manifest.write_task_list(remaining_list, remaining_ids)
+    canary_hex = cookiecutter.generate_random_hex()
+    canary_script = generate_scripts.make_qsub_scripts(
+        commands_location, {"cp_commands": n_canary}, logfile_location,
+        task_list=canary_list, script_name="canary", scheduler=scheduler,
+        max_running=max_running, job_hex=canary_hex, canary=True,
+        runtime=runtime, memory=memory, result_cache=result_cache
+    )
+    analysis_script = generate_scripts.make_qsub_scripts(
+        commands_location, {"cp_commands": n_remaining}, logfile_location,
+        task_list=remaining_list, scheduler=scheduler, max_running=max_running,
+        circuit_breaker=circuit_breaker, runtime=runtime, memory=memory,
+        result_cache=result_cache,
+        # SGE holds on the job name, SLURM on the job ID set by the submit script
+        hold_jid="canary_{}".format(canary_hex) if scheduler == "sge" else False
+    )
+    submit_script = make_submit_script(
+        commands_location, canary_script, analysis_script, scheduler
+    )
+    return {"canary": canary_script, "analysis": analysis_script, "submit": submit_script}
@@ -0,0 +1,363 @@
+"""
+Merge each task's output as soon as the task finishes, while the rest of the
+array job is still running.
+
+The status logs are tailed for newly finished tasks, and each task's csv
+files are written to their own Parquet file in the plate's partition,
+`out_dir`/<table>/plate=<plate>/<task>.parquet. Once every task in a plate
+has been merged, the task files are compacted into a single
+`out_dir`/<table>/plate=<plate>/<plate>.parquet, the same layout as
+`cptools2 merge`.
+
+Progress is recorded in a state file in `out_dir`, so collation can be
+stopped and resumed, and a task is never merged twice.
+
+Requires pyarrow.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cptools2 import manifest, merge, status, utils
+
+
+STATE_NAME = ".collate_state"
+
+
+class CollateState(object):
+    """
+    Append-only record of merged tasks and compacted plates.
+
+    Each record is flushed and synced to disk before returning, so after an
+    interruption anything recorded is known to be complete.
+
+    Parameters:
+    -----------
+    path: string
+        path to the state file, created if it doesn't exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.merged = set()
+        self.compacted = set()
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if fields[0] == "task" and len(fields) == 2:
+                        self.merged.add(fields[1])
+                    elif fields[0] == "compacted" and len(fields) == 3:
+                        self.compacted.add((fields[1], fields[2]))
+
+    def _append(self, *fields):
+        with open(self.path, "a") as f:
+            f.write("\t".join(fields) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def mark_merged(self, task_name):
+        self._append("task", task_name)
+        self.merged.add(task_name)
+
+    def mark_compacted(self, table, plate):
+        self._append("compacted", table, plate)
+        self.compacted.add((table, plate))
+
+
+class StatusTail(object):
+    """
+    Read lines added to the status logs since the last poll.
+
+    Parameters:
+    -----------
+    logfile_location: string
+        directory containing the status logs
+    commands_location: string (optional)
+        directory containing the task manifest, if given only the logs of
+        the jobs recorded by `manifest.add_job` are read, so lines left by
+        the jobs of an earlier manifest are ignored
+    """
+
+    def __init__(self, logfile_location, commands_location=None):
+        self.logfile_location = logfile_location
+        self.commands_location = commands_location
+        self.offsets = dict()
+
+    def find_logs(self):
+        """the status logs to read"""
+        logs = status.find_status_logs(self.logfile_location)
+        if self.commands_location is None:
+            return logs
+        # re-read every poll, as resubmitting adds jobs
+        jobs = manifest.read_jobs(self.commands_location)
+        if jobs is None:
+            return logs
+        names = set("{}.log".format(i) for i in jobs)
+        return [i for i in logs if os.path.basename(i) in names]
+
+    def poll(self):
+        """
+        Returns:
+        --------
+        list of status.StatusLine added since the last poll
+        """
+        new_lines = []
+        for log in self.find_logs():
+            with open(log, "rb") as f:
+                f.seek(self.offsets.get(log, 0))
+                data = f.read()
+            # leave any partially written line until the next poll
+            end = data.rfind(b"\n") + 1
+            self.offsets[log] = self.offsets.get(log, 0) + end
+            for line in data[:end].decode("utf-8").splitlines():
+                status_line = status.parse_status_line(line)
+                if status_line is not None:
+                    new_lines.append(status_line)
+        return new_lines
+
+
+def task_part_path(out_dir, table, task):
+    """path to a single task's Parquet file within its plate's partition"""
+    partition = merge.plate_partition(out_dir, table, task.plate)
+    return os.path.join(partition, "{}.parquet".format(task.name))
+
+
+def merge_task(task, out_dir, float32=False, chunksize=merge.DEFAULT_CHUNKSIZE):
+    """
+    write each of a task's tables to its own Parquet file
+
+    Re-running this for the same task overwrites the same files, so it is
+    safe to repeat after an interruption.
+
+    Returns:
+    --------
+    list of table names written, empty if the task has no output
+    """
+    tables = merge.find_tables([task])
+    for table in tables:
+        utils.make_dir(merge.plate_partition(out_dir, table, task.plate))
+        columns = merge.table_columns([task], table)
+        merge.write_parquet(
+            [task], table, columns, task_part_path(out_dir, table, task),
+            float32=float32, chunksize=chunksize
+        )
+    return tables
+
+
+def _merge_task(args):
+    """merge_task() in a worker process"""
+    return merge_task(*args)
+
+
+def unify_fields(part_fields):
+    """
+    a single field for each column of the parts
+
+    Each task's column types are decided from that task alone, so a column
+    of numbers in one task can be text in another, in which case it is text
+    in the combined file.
+
+    Parameters:
+    -----------
+    part_fields: list of lists of pyarrow.Field, one list per part
+
+    Returns:
+    --------
+    list of pyarrow.Field, in the order they are first seen
+    """
+    pyarrow = merge.import_pyarrow()
+    fields = dict()
+    order = []
+    for part in part_fields:
+        for field in part:
+            if field.name not in fields:
+                fields[field.name] = field
+                order.append(field.name)
+            elif field.type != fields[field.name].type and (
+                    pyarrow.types.is_string(field.type) or
+                    pyarrow.types.is_floating(field.type) and
+                    pyarrow.types.is_integer(fields[field.name].type)):
+                fields[field.name] = field
+    return [fields[i] for i in order]
+
+
+def compact_parts(part_paths, path):
+    """
+    combine Parquet files into a single file, with the union of their columns
+
+    Parts are copied one row group at a time, so memory is bounded by the
+    row group size, and their columns are cast to the types from
+    `unify_fields`. Written to a temporary path then moved into place.
+    """
+    pyarrow = merge.import_pyarrow()
+    schema = pyarrow.schema(
+        unify_fields([list(pyarrow.parquet.read_schema(i)) for i in part_paths])
+    )
+    tmp_path = path + ".tmp"
+    writer = pyarrow.parquet.ParquetWriter(tmp_path, schema)
+    try:
+        for part in part_paths:
+            part_file = pyarrow.parquet.ParquetFile(part)
+            for i in range(part_file.num_row_groups):
+                row_group = part_file.read_row_group(i)
+                columns = []
+                for field in schema:
+                    if field.name in row_group.column_names:
+                        column = row_group.column(field.name)
+                        if column.type != field.type:
+                            column = column.cast(field.type)
+                        columns.append(column)
+                    else:
+                        columns.append(pyarrow.nulls(row_group.num_rows, type=field.type))
+                writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+    finally:
+        writer.close()
+    os.replace(tmp_path, path)
+
+
+class Collator(object):
+    """
+    Merge tasks' output as they finish.
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the task manifest
+    logfile_location: string
+        directory containing the status logs
+    out_dir: string
+        directory to write the Parquet files to
+    float32: Boolean (default = False)
+        whether to downcast float columns to float32
+    compact: Boolean (default = True)
+        whether to combine a plate's task files into a single file once
+        every task in the plate has been merged
+    workers: int (optional)
+        number of processes used to merge tasks, defaults to the number
+        of cpus
+    """
+
+    def __init__(self, commands_location, logfile_location, out_dir, float32=False,
+                 compact=True, workers=None, chunksize=merge.DEFAULT_CHUNKSIZE):
+        self.tasks = {i.task_id: i for i in manifest.read_manifest(commands_location)}
+        self.plates = merge.group_by_plate(self.tasks[i] for i in sorted(self.tasks))
+        self.out_dir = out_dir
+        self.float32 = float32
+        self.compact = compact
+        self.workers = workers
+        self.chunksize = chunksize
+        utils.make_dir(out_dir)
+        self.state = CollateState(os.path.join(out_dir, STATE_NAME))
+        self.tail = StatusTail(logfile_location, commands_location)
+        self.compacted_plates = set()
+        # task_id: latest status logged by the current jobs
+        self.last_status = dict()
+        # task_ids logged as finished without any output tables
+        self.missing_output = set()
+
+    def merge_tasks(self, tasks):
+        """
+        merge tasks in parallel, recording each in the state file, a task
+        without any output tables is not recorded as merged
+        """
+        args = [(task, self.out_dir, self.float32, self.chunksize) for task in tasks]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for task, tables in zip(tasks, executor.map(_merge_task, args)):
+                if tables:
+                    self.state.mark_merged(task.name)
+                    self.missing_output.discard(task.task_id)
+                else:
+                    self.missing_output.add(task.task_id)
+
+    def compact_plate(self, plate):
+        """combine the task files for a fully merged plate"""
+        tasks = self.plates[plate]
+        for table in merge.find_tables(tasks):
+            parts = [task_part_path(self.out_dir, table, task) for task in tasks]
+            parts = [i for i in parts if os.path.isfile(i)]
+            if (table, plate) not in self.state.compacted:
+                partition = merge.plate_partition(self.out_dir, table, plate)
+                compact_parts(parts, os.path.join(partition, "{}.parquet".format(plate)))
+                self.state.mark_compacted(table, plate)
+            # only removed once recorded as compacted, any left over from an
+            # interruption are already in the plate's file
+            for part in parts:
+                os.remove(part)
+
+    def plate_complete(self, plate):
+        return all(task.name in self.state.merged for task in self.plates[plate])
+
+    def poll(self):
+        """
+        merge any newly finished tasks, and compact completed plates
+
+        Returns:
+        --------
+        int, number of tasks merged
+        """
+        to_merge = dict()
+        for line in self.tail.poll():
+            task = self.tasks.get(line.task_id)
+            if task is not None:
+                self.last_status[task.task_id] = line.status
+            if (line.status == status.FINISHED and task is not None
+                    and task.name not in self.state.merged):
+                to_merge[task.task_id] = task
+        to_merge = [to_merge[i] for i in sorted(to_merge)]
+        if to_merge:
+            self.merge_tasks(to_merge)
+        if self.compact:
+            for plate in self.plates:
+                if plate not in self.compacted_plates and self.plate_complete(plate):
+                    self.compact_plate(plate)
+                    self.compacted_plates.add(plate)
+        return len(to_merge)
+
+    def complete(self):
+        """whether every task in the manifest has been merged"""
+        return all(task.name in self.state.merged for task in self.tasks.values())
+
+    def job_finished(self):
+        """
+        whether every task in the manifest has been merged or logged as
+        finished or failed, i.e the jobs have nothing left to run
+        """
+        return all(task.name in self.state.merged or task.task_id in self.last_status
+                   for task in self.tasks.values())
+
+    def failed(self):
+        """
+        task_ids which aren't merged, as their latest status was a failure
+        or they finished without any output tables
+        """
+        return sorted(
+            task.task_id for task in self.tasks.values()
+            if task.name not in self.state.merged and (
+                task.task_id in self.missing_output or
+                self.last_status.get(task.task_id, status.FINISHED) != status.FINISHED
+            )
+        )
+
+    def run(self, follow=False, poll_interval=60, callback=None):
+        """
+        merge finished tasks, if `follow` then keep polling until every
+        task has been merged, or the jobs have finished with some tasks
+        failed, see `failed`
+
+        Parameters:
+        -----------
+        follow: Boolean (default = False)
+        poll_interval: float (default = 60)
+            seconds between polls
+        callback: function (optional)
+            called with the number of tasks merged after each poll
+        """
+        while True:
+            n_merged = self.poll()
+            if callback is not None:
+                callback(n_merged)
+            if not follow or self.complete() or self.job_finished():
+                return
+            time.sleep(poll_interval)
@@ -1,9 +1,135 @@
+import hashlib
 import os
 
-from cptools2 import utils
+from cptools2 import profiling, utils
 
 
-def make_cp_cmnd(name, pipeline, location, output_loc):
+# how the loaddata, raw_data and img_data directories are split up
+#   flat: every task in the same directory
+#   plate: a sub-directory per plate
+#   hash: two levels of sub-directories from a hash of the task name
+LAYOUTS = ["flat", "plate", "hash"]
+# hex characters of the task name's hash per level of the hash layout,
+# 2 levels of 2 gives 65536 directories
+HASH_WIDTH = 2
+HASH_LEVELS = 2
+
+
+def task_name(plate, job_num):
+    """
+    name of an individual job, from the plate name and the job's chunk
+    number within that plate, used for the loaddata and output files
+
+    Parameters:
+    -----------
+    plate: string
+        plate name
+    job_num: int
+        chunk number, starting from 0
+
+    Returns:
+    --------
+    string: e.g "plate-1_12"
+    """
+    return "{}_{}".format(plate, str(job_num))
+
+
+def split_task_name(name):
+    """
+    split a job name created by `task_name` back into the plate name and
+    chunk number
+
+    Parameters:
+    -----------
+    name: string
+        name of an individual job
+
+    Returns:
+    --------
+    tuple of (plate: string, job_num: int), or None if `name` is not a
+    job name
+    """
+    plate, sep, job_num = name.rpartition("_")
+    if sep == "" or plate == "" or not job_num.isdigit():
+        return None
+    return plate, int(job_num)
+
+
+def check_layout(layout):
+    """raise a ValueError if `layout` is not one of LAYOUTS"""
+    if layout not in LAYOUTS:
+        raise ValueError("unknown layout '{}', options = {}".format(layout, LAYOUTS))
+
+
+def shard(name, layout="flat"):
+    """
+    the sub-directory an individual job's files are kept in, so that no
+    directory holds an entry for every job of a large experiment
+
+    Parameters:
+    -----------
+    name: string
+        name of the individual job, from `task_name`
+    layout: string (default = "flat")
+        one of LAYOUTS
+
+    Returns:
+    --------
+    string: relative path, "" for the flat layout, the plate name for the
+    plate layout, e.g "3f/a2" for the hash layout
+    """
+    check_layout(layout)
+    if layout == "flat":
+        return ""
+    if layout == "plate":
+        plate_job = split_task_name(name)
+        if plate_job is None:
+            raise ValueError("'{}' is not a job name".format(name))
+        return plate_job[0]
+    digest = hashlib.md5(name.encode("utf-8")).hexdigest()
+    return os.path.join(*[digest[i * HASH_WIDTH:(i + 1) * HASH_WIDTH]
+                          for i in range(HASH_LEVELS)])
+
+
+def shard_depth(layout="flat"):
+    """number of directory levels `shard` adds for a layout"""
+    check_layout(layout)
+    return {"flat": 0, "plate": 1, "hash": HASH_LEVELS}[layout]
+
+
+def task_relpath(name, layout="flat"):
+    """
+    path of an individual job's files relative to the loaddata, raw_data
+    and img_data directories, without the .csv extension for loaddata
+
+    Returns:
+    --------
+    string: e.g "plate-1_12", or "plate-1/plate-1_12" for the plate layout
+    """
+    return os.path.join(shard(name, layout), name)
+
+
+def output_path(name, location, layout="flat"):
+    """
+    path to the cellprofiler output directory for an individual job
+
+    Parameters:
+    -----------
+    name: string
+        name of the individual job
+    location: string
+        filepath to the directory which contains raw_data
+    layout: string (default = "flat")
+        one of LAYOUTS
+
+    Returns:
+    --------
+    string: path to the output directory
+    """
+    return os.path.join(location, "raw_data", task_relpath(name, layout))
+
+
+def make_cp_cmnd(name, pipeline, location, output_loc, layout="flat"):
     """
     create cellprofiler command
 
@@ -17,19 +143,40 @@ def make_cp_cmnd(name, pipeline, location, output_loc):
         filepath to the directory which contains the loaddata csv files
     output_loc: string
         where to store the results from the cellprofiler job
+    layout: string (default = "flat")
+        one of LAYOUTS, where the loaddata csv file is
 
     Returns:
     --------
     string: a cellprofiler command
     """
-    loaddata_name = os.path.join(location, "loaddata", name)
     cmnd = cp_command(pipeline=pipeline,
-                      load_data=loaddata_name + ".csv",
+                      load_data=loaddata_path(name, location, layout),
                       output_location=output_loc)
     return cmnd
 
 
-def write_loaddata(name, location, dataframe, fix_paths=True):
+def loaddata_path(name, location, layout="flat"):
+    """
+    path to the loaddata csv file for an individual job
+
+    Parameters:
+    -----------
+    name: string
+        name of the individual job
+    location: string
+        filepath to the directory which contains the loaddata csv files
+    layout: string (default = "flat")
+        one of LAYOUTS
+
+    Returns:
+    --------
+    string: path to the loaddata csv file
+    """
+    return os.path.join(location, "loaddata", task_relpath(name, layout) + ".csv")
+
+
+def write_loaddata(name, location, dataframe, fix_paths=True, layout="flat"):
     """
     write a loaddata csv file to disk
 
@@ -44,15 +191,22 @@ def write_loaddata(name, location, dataframe, fix_paths=True):
     fix_paths: Boolean (default = True)
         whether to prefix the filepaths in a loaddata dataframe so that
         the paths point to the image location after the images have been staged
+    layout: string (default = "flat")
+        one of LAYOUTS, the shard directories must already exist, see
+        `make_shard_directories`
 
     Returns:
     --------
     nothing, writes the csv file to disk
     """
-    loaddata_name = os.path.join(location, "loaddata", name + ".csv")
-    if fix_paths is True:
-        dataframe = utils.prefix_filepaths(dataframe, name, location)
-    dataframe.to_csv(loaddata_name, index=False)
+    loaddata_name = loaddata_path(name, location, layout)
+    with profiling.stage("commands.write_loaddata") as record:
+        if fix_paths is True:
+            dataframe = utils.prefix_filepaths(
+                dataframe, task_relpath(name, layout), location
+            )
+        dataframe.to_csv(loaddata_name, index=False)
+        record.n_items = dataframe.shape[0]
 
 
 def _write_single(commands_location, commands, final_name):
@@ -74,9 +228,11 @@ def _write_single(commands_location, commands, final_name):
     nothing, writes commands to disk
     """
     cmnd_loc = os.path.join(commands_location, final_name + ".txt")
-    with open(cmnd_loc, "w") as outfile:
-        for line in commands:
-            outfile.write(line + "\n")
+    with profiling.stage("commands.write_commands") as record:
+        with open(cmnd_loc, "w") as outfile:
+            for line in commands:
+                outfile.write(line + "\n")
+        record.n_items = len(commands)
 
 
 def cp_command(pipeline, load_data, output_location):
@@ -124,6 +280,53 @@ def make_output_directories(location):
         utils.make_dir(os.path.join(location, "logfiles", subdirec))
 
 
+def make_shard_directories(location, shard_dir):
+    """
+    create a shard's sub-directories of loaddata and raw_data, used in
+    job.Job() for each shard the first time it's used
+
+    Parameters:
+    -----------
+    location: string
+        path to directory containing loaddata and raw_data
+    shard_dir: string
+        from `shard`, nothing is created for ""
+    """
+    if shard_dir == "":
+        return
+    for direc in ["loaddata", "raw_data"]:
+        utils.make_dir(os.path.join(location, direc, shard_dir))
+
+
+def find_task_directories(directory, layout="flat"):
+    """
+    find the per-job entries of a directory written with `layout`, e.g
+    each job's output directory in raw_data
+
+    Parameters:
+    -----------
+    directory: string
+        e.g `location`/raw_data
+    layout: string (default = "flat")
+        one of LAYOUTS
+
+    Returns:
+    --------
+    sorted list of (name, path) tuples of entries named like a job
+    """
+    found = []
+    # walk down to the depth the jobs are at, ignoring anything else
+    level = [directory]
+    for _ in range(shard_depth(layout)):
+        level = [os.path.join(i, j) for i in level for j in os.listdir(i)
+                 if os.path.isdir(os.path.join(i, j))]
+    for parent in level:
+        for name in os.listdir(parent):
+            if split_task_name(name) is not None:
+                found.append((name, os.path.join(parent, name)))
+    return sorted(found)
+
+
 def check_commands(location):
     """
     Check commands files are not empty, raise an Error if they are.
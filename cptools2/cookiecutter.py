@@ -1,14 +1,203 @@
 """
-Automatically generate SGE submission scripts from a template.
+Automatically generate SGE and SLURM submission scripts from a template.
 """
 
 import os
 import random
+import shutil
 import subprocess
 import textwrap
 
 
-class SGEScript(object):
+class BatchScript(object):
+    """
+    Base class for submission scripts, the scheduler specific directives
+    are added by the subclasses.
+
+    Subclasses set `task_id_var` and `job_id_var` to the names of the
+    environment variables holding the array task ID and job ID, and
+    implement `_tasks_directive()` and `submit()`.
+    """
+
+    task_id_var = None
+    job_id_var = None
+
+    def __str__(self):
+        return str(self.template)
+
+    def __iadd__(self, right_side):
+        self.template = self.template + textwrap.dedent("{}\n".format(right_side))
+        return self
+
+    def loop_through_file(self, input_file, prefix=None):
+        """
+        Add text to script template to loop through a file containing a
+        command to be run on each line.
+
+        This using an array job this will setup an awk command to run each
+        line of according to the array task ID
+
+        Parameters:
+        -----------
+        input_file: path to a file
+            This file should contain multiple lines of commands.
+            Each line will be run separately in an array job.
+
+        Returns:
+        --------
+        Nothing, adds text to template script in place.
+        """
+        # if the number of tasks is not set, but we can read the input file
+        # then automatically detect the number of lines in `input_file`
+        # and set this value as `self.tasks`.
+        if self.tasks is None and os.path.isfile(input_file):
+            num_lines = get_num_lines(input_file)
+            self.tasks = self._tasks_directive("1-{}".format(num_lines))
+            self.template += self.tasks
+            self.array = True
+            print(
+                "NOTE:{} tasks inferred from number of lines in {}".format(
+                    num_lines, input_file
+                )
+            )
+        # if the number of tasks if not given and we can't read `input_file`,
+        # then the number of tasks cannot be set automatically, so raise a
+        # ScriptError
+        elif self.array is False and self.tasks is None:
+            err_msg = "'tasks` was not set, and cannot read {}".format(input_file)
+            raise ScriptError(err_msg)
+        # one way of getting the line from `input_file` to match the task ID
+        if prefix is None:
+            text = """
+                CP_COMMAND_LIST="{input_file}"
+                CP_COMMAND=$(awk "NR==${task_id_var}" "$CP_COMMAND_LIST")
+                $CP_COMMAND
+                """.format(
+                input_file=input_file,
+                task_id_var=self.task_id_var
+            )
+        else:
+            text = """
+                CP_COMMAND_LIST="{input_file}"
+                CP_COMMAND=$(awk "NR==${task_id_var}" "$CP_COMMAND_LIST")
+                {prefix} $CP_COMMAND
+                """.format(
+                input_file=input_file,
+                prefix=prefix,
+                task_id_var=self.task_id_var
+            )
+
+        self.template += textwrap.dedent(text)
+
+    def loop_through_indexed_file(self, input_file, index_file, index_width,
+                                  field=None, prefix=None, task_list=None,
+                                  before_command=None):
+        """
+        Add text to script template to run a command from a line of
+        `input_file`, found by looking up its byte offset in `index_file`.
+
+        Unlike `loop_through_file` this doesn't read `input_file` from the
+        start for every task, so the cost of each lookup doesn't grow with
+        the number of tasks.
+
+        Parameters:
+        -----------
+        input_file: path to a file
+            File containing a line per task.
+        index_file: path to a file
+            Fixed-width file containing the byte offset of each line in
+            `input_file`, the offset for task N is entry N.
+        index_width: int
+            Width of each entry in `index_file` in bytes, including newline.
+        field: int (optional)
+            If given, the line is split on tabs and the command taken from
+            field `field` onwards, otherwise the whole line is the command.
+        prefix: string (optional)
+            Inserted before the command, e.g. a container to run it in.
+        task_list: path to a file (optional)
+            Fixed-width file, in the same format as `index_file`, mapping
+            the array task ID to the line in `input_file` to run. Used to run a
+            subset of the lines in `input_file`. `tasks` has to be set.
+        before_command: string (optional)
+            Text run after the task's line has been looked up, so $TASK_ID
+            and $TASK_LINE are set, and before its command is run.
+
+        Returns:
+        --------
+        Nothing, adds text to template script in place.
+        """
+        if task_list is not None and self.tasks is None:
+            raise ScriptError("'tasks' has to be set when using a task_list")
+        if self.tasks is None and os.path.isfile(index_file):
+            num_lines = os.path.getsize(index_file) // index_width
+            self.tasks = self._tasks_directive("1-{}".format(num_lines))
+            self.template += self.tasks
+            self.array = True
+            print(
+                "NOTE:{} tasks inferred from size of {}".format(
+                    num_lines, index_file
+                )
+            )
+        elif self.array is False and self.tasks is None:
+            err_msg = "'tasks` was not set, and cannot read {}".format(index_file)
+            raise ScriptError(err_msg)
+        if task_list is None:
+            text = "\nTASK_ID=${}".format(self.task_id_var)
+        else:
+            text = (
+                '\nTASK_ID=$(( $(dd if="{task_list}" bs={index_width} '
+                'skip=$(({task_id_var} - 1)) count=1 2>/dev/null) ))'
+            ).format(task_list=task_list, index_width=index_width,
+                     task_id_var=self.task_id_var)
+        text += textwrap.dedent(
+            """
+            TASK_LIST="{input_file}"
+            TASK_OFFSET=$(dd if="{index_file}" bs={index_width} skip=$((TASK_ID - 1)) count=1 2>/dev/null)
+            TASK_LINE=$(tail -c +$((TASK_OFFSET + 1)) "$TASK_LIST" | head -n 1)
+            """.format(
+                input_file=input_file,
+                index_file=index_file,
+                index_width=index_width
+            )
+        )
+        if before_command is not None:
+            text += textwrap.dedent(before_command)
+        if field is None:
+            text += 'CP_COMMAND="$TASK_LINE"\n'
+        else:
+            text += "CP_COMMAND=$(printf '%s\\n' \"$TASK_LINE\" | cut -f {}-)\n".format(field)
+        if prefix is None:
+            text += "$CP_COMMAND\n"
+        else:
+            text += "{} $CP_COMMAND\n".format(prefix)
+        self.template += text
+
+    def save(self, path):
+        """save script/template to path"""
+        with open(path, "w") as out_file:
+            out_file.write(self.template + "\n")
+        self.save_path = path
+
+    def submit(self):
+        """
+        submit the saved script to the job queue
+
+        Returns:
+        --------
+        string, the job ID of the submitted job
+        """
+        raise NotImplementedError
+
+    def run(self):
+        """alias for submit()"""
+        return self.submit()
+
+    def _tasks_directive(self, tasks):
+        """directive setting the array tasks, e.g 1-100"""
+        raise NotImplementedError
+
+
+class SGEScript(BatchScript):
     """
     Base class for SGE submission scripts.
     Just the bare basics for an SGE submission without any actual code.
@@ -51,6 +240,12 @@ class SGEScript(object):
     pe: string. (optional)
         parallel environment passed to `#$ -pe`
 
+    max_running: int. (optional)
+        maximum number of array tasks to run at once, passed to `#$ -tc`
+
+    memory: string. (optional)
+        memory limit per task, e.g "4G", passed to `#$ -l h_vmem`
+
 
     Methods:
     --------
@@ -86,6 +281,9 @@ class SGEScript(object):
         none
     """
 
+    task_id_var = "SGE_TASK_ID"
+    job_id_var = "JOB_ID"
+
     def __init__(
         self,
         name=None,
@@ -97,6 +295,8 @@ class SGEScript(object):
         hold_jid=False,
         hold_jid_ad=False,
         pe=None,
+        max_running=None,
+        memory=None,
     ):
         self.name = generate_random_hex() if name is None else name
         self.user = get_user(user)
@@ -123,7 +323,7 @@ class SGEScript(object):
         if tasks is not None:
             self.tasks = parse_tasks(tasks)
             self.array = True
-            self.template += "#$ -t {}\n".format(self.tasks)
+            self.template += self._tasks_directive(self.tasks) + "\n"
         else:
             self.array = False
             self.tasks = None
@@ -137,99 +337,211 @@ class SGEScript(object):
             self.template += "#$ -hold_jid_ad {}\n".format(hold_jid_ad)
         if pe is not None:
             self.template += "#$ -pe {}\n".format(pe)
-
-    def __str__(self):
-        return str(self.template)
+        if max_running is not None:
+            self.template += "#$ -tc {}\n".format(max_running)
+        if memory is not None:
+            self.template += "#$ -l h_vmem={}\n".format(memory)
 
     def __repr__(self):
         return "SGEScript: name={}, runtime={}, user={}".format(
             self.name, self.runtime, self.user
         )
 
-    def __iadd__(self, right_side):
-        self.template = self.template + textwrap.dedent("{}\n".format(right_side))
-        return self
+    def _tasks_directive(self, tasks):
+        return "#$ -t {}".format(tasks)
 
-    def loop_through_file(self, input_file, prefix=None):
+    def submit(self):
         """
-        Add text to script template to loop through a file containing a
-        command to be run on each line.
-
-        This using an array job this will setup an awk command to run each
-        line of according to the SGE_TASK_ID
-
-        Parameters:
-        -----------
-        input_file: path to a file
-            This file should contain multiple lines of commands.
-            Each line will be run separately in an array job.
+        submit script with qsub (if on a login node)
 
         Returns:
         --------
-        Nothing, adds text to template script in place.
+        string, the job ID of the submitted job
         """
-        # if the number of tasks is not set, but we can read the input file
-        # then automatically detect the number of lines in `input_file`
-        # and set this value as `self.tasks`.
-        if self.tasks is None and os.path.isfile(input_file):
-            num_lines = get_num_lines(input_file)
-            self.tasks = "#$ -t 1-{}".format(num_lines)
-            self.template += self.tasks
-            self.array = True
-            print(
-                "NOTE:{} tasks inferred from number of lines in {}".format(
-                    num_lines, input_file
-                )
-            )
-        # if the number of tasks if not given and we can't read `input_file`,
-        # then the number of tasks cannot be set automatically, so raise a
-        # ScriptError
-        elif self.array is False and self.tasks is None:
-            err_msg = "'tasks` was not set, and cannot read {}".format(input_file)
-            raise ScriptError(err_msg)
-        # one way of getting the line from `input_file` to match $SGE_TASK_ID
-        if prefix is None:
-            text = """
-                CP_COMMAND_LIST="{input_file}"
-                CP_COMMAND=$(awk "NR==$SGE_TASK_ID" "$CP_COMMAND_LIST")
-                $CP_COMMAND
-                """.format(
-                input_file=input_file
-            )
-        else:
-            text = """
-                CP_COMMAND_LIST="{input_file}"
-                CP_COMMAND=$(awk "NR==$SGE_TASK_ID" "$CP_COMMAND_LIST")
-                {prefix} $CP_COMMAND
-                """.format(
-                input_file=input_file,
-                prefix=prefix
-            )
-
-        self.template += textwrap.dedent(text)
-
-    def save(self, path):
-        """save script/template to path"""
-        with open(path, "w") as out_file:
-            out_file.write(self.template + "\n")
-        self.save_path = path
-
-    def submit(self):
-        """submit script to the job queue (if on a login node)"""
         if on_login_node():
             if self.save_path is None:
                 raise SubmissionError("Need to save script before submitting")
             else:
                 abs_save_path = os.path.abspath(self.save_path)
-                return_code = subprocess.Popen(["qsub", abs_save_path]).wait()
-                if return_code != 0:
+                proc = subprocess.Popen(
+                    ["qsub", "-terse", abs_save_path],
+                    stdout=subprocess.PIPE,
+                    universal_newlines=True
+                )
+                stdout, _ = proc.communicate()
+                if proc.returncode != 0:
                     raise SubmissionError("Job submission failed")
+                # -terse prints "jobid", or "jobid.1-N:1" for array jobs
+                return stdout.strip().split(".")[0]
         else:
             raise SubmissionError("Cannot submit job, not on a login node.")
 
-    def run(self):
-        """alias for submit()"""
-        self.submit()
+
+class SlurmScript(BatchScript):
+    """
+    Base class for SLURM submission scripts, taking the same arguments as
+    SGEScript where there is an equivalent.
+
+    Parameters:
+    -----------
+    name: string (default = randomly generated hex code)
+        Name of the job.
+
+    user: string (default = $USER from environment)
+        Username on the cluster.
+
+    output: string (default = /scratch/$USER/)
+        directory for the stdout and stderr files.
+
+    queue: string (optional)
+        partition to be used, passed to `--partition`
+
+    runtime: string (optional)
+        Run time limit for the job, passed to `--time`.
+
+    tasks: string, integer, or list of two integers. (optional)
+        The array tasks passed to `--array`, in the same formats as SGEScript.
+
+    hold_jid: string. (optional)
+        job ID of a job which has to finish successfully for this job to
+        start running, passed as `--dependency=afterok`
+
+    hold_jid_ad: string. (optional)
+        job ID of an array job, each task in this array job will wait for
+        the corresponding task in `hold_jid_ad` to finish successfully,
+        passed as `--dependency=aftercorr`
+
+    cpus: int. (optional)
+        number of cpus per task, passed to `--cpus-per-task`
+
+    max_running: int. (optional)
+        maximum number of array tasks to run at once, the `%` throttle in
+        `--array`
+
+    memory: string. (optional)
+        memory per task, e.g "4G", passed to `--mem`
+    """
+
+    task_id_var = "SLURM_ARRAY_TASK_ID"
+    job_id_var = "SLURM_ARRAY_JOB_ID"
+
+    def __init__(
+        self,
+        name=None,
+        user=None,
+        runtime=None,
+        queue=None,
+        output=None,
+        tasks=None,
+        hold_jid=False,
+        hold_jid_ad=False,
+        cpus=None,
+        max_running=None,
+        memory=None,
+    ):
+        self.name = generate_random_hex() if name is None else name
+        self.user = get_user(user, check_cluster=False)
+        self.runtime = runtime
+        self.queue = queue
+        self.max_running = max_running
+        self.save_path = None
+        self.output = (
+            "/scratch/{}/".format(self.user) if output is None else output
+        )
+        # sbatch needs the shebang on the very first line
+        self.template = textwrap.dedent(
+            """\
+            #!/bin/bash
+
+            #SBATCH --job-name={name}
+            #SBATCH --output={output}
+            """.format(
+                name=self.name,
+                output=os.path.join(self.output, "%x.o%A.%a"),
+            )
+        )
+        if queue is not None:
+            self.template += "#SBATCH --partition={}\n".format(queue)
+        if tasks is not None:
+            self.tasks = parse_tasks(tasks)
+            self.array = True
+            self.template += self._tasks_directive(self.tasks) + "\n"
+        else:
+            self.array = False
+            self.tasks = None
+        if runtime is not None:
+            self.template += "#SBATCH --time={}\n".format(self.runtime)
+        if hold_jid is not False and hold_jid_ad is not False:
+            raise ValueError("Cannot use both 'hold_jid' and 'hold_jid_ad'")
+        if hold_jid is not False:
+            self.template += "#SBATCH --dependency=afterok:{}\n".format(hold_jid)
+        if hold_jid_ad is not False:
+            self.template += "#SBATCH --dependency=aftercorr:{}\n".format(hold_jid_ad)
+        if cpus is not None:
+            self.template += "#SBATCH --cpus-per-task={}\n".format(cpus)
+        if memory is not None:
+            self.template += "#SBATCH --mem={}\n".format(memory)
+
+    def __repr__(self):
+        return "SlurmScript: name={}, runtime={}, user={}".format(
+            self.name, self.runtime, self.user
+        )
+
+    def _tasks_directive(self, tasks):
+        if self.max_running is not None:
+            tasks = "{}%{}".format(tasks, self.max_running)
+        return "#SBATCH --array={}".format(tasks)
+
+    def submit(self):
+        """
+        submit script with sbatch
+
+        Returns:
+        --------
+        string, the job ID of the submitted job, which can be used as
+        `hold_jid` or `hold_jid_ad` for subsequent jobs
+        """
+        if self.save_path is None:
+            raise SubmissionError("Need to save script before submitting")
+        if shutil.which("sbatch") is None:
+            raise SubmissionError("Cannot submit job, sbatch not found.")
+        abs_save_path = os.path.abspath(self.save_path)
+        proc = subprocess.Popen(
+            ["sbatch", "--parsable", abs_save_path],
+            stdout=subprocess.PIPE,
+            universal_newlines=True
+        )
+        stdout, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise SubmissionError("Job submission failed")
+        # --parsable prints "jobid" or "jobid;cluster"
+        return stdout.strip().split(";")[0]
+
+
+SCRIPT_CLASSES = {
+    "sge": SGEScript,
+    "slurm": SlurmScript,
+}
+
+
+def get_script_class(scheduler="sge"):
+    """
+    Return the submission script class for a scheduler.
+
+    Parameters:
+    -----------
+    scheduler: string
+        one of "sge" or "slurm"
+
+    Returns:
+    --------
+    BatchScript subclass
+    """
+    scheduler = "sge" if scheduler is None else scheduler.strip().lower()
+    if scheduler not in SCRIPT_CLASSES:
+        err_msg = "unknown scheduler '{}', options = {}"
+        raise ScriptError(err_msg.format(scheduler, sorted(SCRIPT_CLASSES)))
+    return SCRIPT_CLASSES[scheduler]
 
 
 def generate_random_hex():
@@ -246,24 +558,30 @@ def generate_random_hex():
     return "".join(result)
 
 
-def get_user(user):
+def get_user(user, check_cluster=True):
     """
     - Return username. If passed a username then will simply return that.
     - If not given a user an an argument, then this will try and determine
       username from the environment variables (if running on the cluster).
-    - Will raise a ValueError if not passed a user and not running on the
-      cluster.
+    - Will raise a UserError if not passed a user and not running on the
+      cluster, unless `check_cluster` is False, as for SLURM scripts which
+      take $USER wherever they're created.
     """
     if user is not None:
         return user
-    elif on_the_cluster():
-        return os.environ["USER"]
-    else:
+    if check_cluster and not on_the_cluster():
         raise UserError(
             "No argument given for 'user' and not running on "
             "the cluster, therefore unable to automatically "
             "detect the username"
         )
+    try:
+        return os.environ["USER"]
+    except KeyError:
+        raise UserError(
+            "No argument given for 'user' and unable to automatically "
+            "detect the username"
+        )
 
 
 def parse_tasks(tasks):
@@ -0,0 +1,145 @@
+"""
+Find the images a CellProfiler pipeline uses, so that channels it never
+references can be dropped when listing files.
+
+With LoadData each `FileName_<name>` column is loaded as an image called
+`<name>`, which is `W<channel>` or the name given in the config's
+`channels`. The modules after the input modules refer to images by these
+names in their settings, e.g `Select the input image:W1`, or to every
+image at once, e.g `Calculate metrics for which images?:All loaded images`
+in MeasureImageQuality, in which case every channel is used.
+"""
+
+import json
+import re
+
+
+# modules which load images rather than use them, their settings name images
+# which are never loaded when the pipeline is run with LoadData
+INPUT_MODULES = set(["LoadData", "Images", "Metadata", "NamesAndTypes", "Groups"])
+MODULE_HEADER = re.compile(r"^(\w+):\[(.*)\]\s*$")
+IMAGE_COLUMN = re.compile(r"^(?:FileName|PathName|URL)_(.+)$")
+# setting values which select every loaded image rather than naming them
+ALL_IMAGES = re.compile(r"^all (?:loaded )?images$", re.IGNORECASE)
+
+
+class PipelineError(Exception):
+    pass
+
+
+def read_modules(path):
+    """
+    read the modules of a .cppipe pipeline, either the text format or the
+    json format of CellProfiler 4.1+
+
+    Parameters:
+    -----------
+    path: string
+        path to .cppipe file
+
+    Returns:
+    --------
+    list of (module_name, enabled, [setting values]) tuples
+    """
+    with open(path, "r") as f:
+        text = f.read()
+    if text.lstrip().startswith("{"):
+        return _read_json_modules(text, path)
+    if not text.startswith("CellProfiler Pipeline"):
+        raise PipelineError("'{}' is not a CellProfiler pipeline".format(path))
+    modules = []
+    for line in text.splitlines():
+        header = MODULE_HEADER.match(line)
+        if header is not None:
+            enabled = "enabled:False" not in header.group(2)
+            modules.append((header.group(1), enabled, []))
+        elif modules and line[:1].isspace() and ":" in line:
+            modules[-1][2].append(line.split(":", 1)[1])
+    return modules
+
+
+def _read_json_modules(text, path):
+    try:
+        pipeline = json.loads(text)
+        modules = []
+        for module in pipeline["modules"]:
+            attributes = module["attributes"]
+            # e.g cellprofiler.modules.loaddata.LoadData
+            modules.append((
+                attributes["module_path"].split(".")[-1],
+                attributes.get("enabled", True) is not False,
+                [str(setting["value"]) for setting in module["settings"]]
+            ))
+    except (ValueError, KeyError, TypeError):
+        raise PipelineError("'{}' is not a CellProfiler pipeline".format(path))
+    return modules
+
+
+def referenced_names(path):
+    """
+    every name used in the settings of the pipeline's enabled, non-input
+    modules, with `FileName_`, `PathName_` and `URL_` prefixes removed
+
+    Returns:
+    --------
+    set of strings
+    """
+    names = set()
+    for module_name, enabled, values in read_modules(path):
+        if not enabled or module_name in INPUT_MODULES:
+            continue
+        for value in values:
+            # lists of images are separated with commas, or "|" in older
+            # versions
+            for name in re.split(r"[,|]", value):
+                name = name.strip().strip("'\"")
+                column = IMAGE_COLUMN.match(name)
+                names.add(column.group(1) if column is not None else name)
+    return names
+
+
+def uses_all_images(path):
+    """
+    whether any of the pipeline's enabled, non-input modules has a setting
+    selecting every loaded image, e.g "All loaded images"
+    """
+    for module_name, enabled, values in read_modules(path):
+        if not enabled or module_name in INPUT_MODULES:
+            continue
+        if any(ALL_IMAGES.match(value.strip()) for value in values):
+            return True
+    return False
+
+
+def used_channels(path, channel_dict=None):
+    """
+    the channel numbers whose images are used by a pipeline
+
+    Parameters:
+    -----------
+    path: string
+        path to .cppipe file
+    channel_dict: dict (optional)
+        mapping of channel numbers to names, from the config's `channels`.
+        If not given images are called W<channel number>.
+
+    Returns:
+    --------
+    sorted list of channel numbers, or None if the pipeline uses every
+    loaded image, or doesn't reference any of the images so the channels
+    used can't be worked out
+    """
+    if uses_all_images(path):
+        return None
+    names = referenced_names(path)
+    if channel_dict is None:
+        channels = set()
+        for name in names:
+            match = re.match(r"^W(\d+)$", name)
+            if match is not None:
+                channels.add(int(match.group(1)))
+    else:
+        channels = set(k for k, v in channel_dict.items() if v in names)
+    if not channels:
+        return None
+    return sorted(channels)
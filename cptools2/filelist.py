@@ -1,5 +1,9 @@
+import fnmatch
 import glob
 import os
+import re
+
+from cptools2 import parse_metadata, profiling
 
 
 class Filelist:
@@ -13,15 +17,198 @@ class Filelist:
         self.filelist_micro = self.filelist_map[microscope]()
 
     def files_from_plate(self, plate_dir):
-        return self.filelist_micro.files_from_plate(plate_dir)
+        with profiling.stage("filelist.files_from_plate") as record:
+            files = self.filelist_micro.files_from_plate(plate_dir)
+            record.n_items = len(files)
+        return files
 
     def paths_to_plates(self, exp_dir):
-        return self.filelist_micro.paths_to_plates(exp_dir)
+        with profiling.stage("filelist.paths_to_plates") as record:
+            plate_paths = self.filelist_micro.paths_to_plates(exp_dir)
+            record.n_items = len(plate_paths)
+        return plate_paths
 
     def clean_filelist(self, filelist):
         return self.filelist_micro.clean_filelist(filelist)
 
 
+def filter_channels(files, microscope, channels, plate_dir=None):
+    """
+    keep only the images of certain channels
+
+    Parameters:
+    -----------
+    files: list
+        image paths from Filelist.files_from_plate
+    microscope: string
+    channels: list of ints
+        channel numbers to keep
+    plate_dir: string (optional)
+        directory the files came from, for the error message
+
+    Returns:
+    --------
+    list of image paths, raises a RuntimeError if none are left
+    """
+    parser = parse_metadata.MetadataParser(microscope)
+    channels = set(channels)
+    with profiling.stage("filelist.filter_channels") as record:
+        kept = [f for f in files if parser.parse_channel(f) in channels]
+        record.n_items = len(files)
+    if len(kept) == 0:
+        err_msg = "No files for channel(s) {} found in '{}'"
+        raise RuntimeError(err_msg.format(sorted(channels), plate_dir))
+    return kept
+
+
+def _plate_matcher(pattern):
+    """
+    function matching plate names against a glob pattern, or a regular
+    expression prefixed with "re:"
+    """
+    pattern = str(pattern)
+    if pattern.startswith("re:"):
+        regex = re.compile(pattern[3:])
+        return lambda name: regex.search(name) is not None
+    return lambda name: fnmatch.fnmatchcase(name, pattern)
+
+
+def _split_well(well):
+    """"B3" -> ("B", 3)"""
+    well = str(well).strip().upper()
+    match = re.match(r"^([A-Z]+)0*([0-9]+)$", well)
+    if match is None:
+        raise ValueError("'{}' is not a well".format(well))
+    return match.group(1), int(match.group(2))
+
+
+def expand_wells(wells):
+    """
+    expand a list of wells and ranges of wells
+
+    Parameters:
+    -----------
+    wells: list
+        wells, e.g "B03" or "b3", and ranges, e.g "A01-B12" is every well in
+        rows A to B and columns 1 to 12
+
+    Returns:
+    --------
+    set of well names, zero-padded to two digits, e.g "B03"
+    """
+    expanded = set()
+    for well in wells:
+        start, sep, end = str(well).partition("-")
+        start_row, start_col = _split_well(start)
+        end_row, end_col = _split_well(end) if sep else (start_row, start_col)
+        if len(start_row) != 1 or len(end_row) != 1:
+            if sep:
+                raise ValueError("well ranges need single letter rows, got '{}'".format(well))
+            expanded.add("{}{:02d}".format(start_row, start_col))
+            continue
+        for row in range(ord(start_row), ord(end_row) + 1):
+            for col in range(start_col, end_col + 1):
+                expanded.add("{}{:02d}".format(chr(row), col))
+    return expanded
+
+
+def expand_sites(sites):
+    """
+    expand a list of sites and ranges of sites, e.g [1, "3-5"]
+
+    Returns:
+    --------
+    set of ints
+    """
+    expanded = set()
+    for site in sites:
+        start, sep, end = str(site).partition("-")
+        expanded.update(range(int(start), int(end if sep else start) + 1))
+    return expanded
+
+
+class ImageFilter(object):
+    """
+    Include and exclude filters on plate names, wells and sites, applied
+    while listing files so excluded plates are never scanned and excluded
+    images are never parsed.
+
+    Each argument is a dictionary with optional "include" and "exclude"
+    lists. Without an "include" everything is included, and "exclude" wins
+    over "include".
+
+    Parameters:
+    -----------
+    plates: dictionary (optional)
+        glob patterns, e.g "plate_1*", or regular expressions prefixed with
+        "re:", e.g "re:^A00000[1-4]-PC$"
+    wells: dictionary (optional)
+        wells and ranges of wells, see `expand_wells`
+    sites: dictionary (optional)
+        sites and ranges of sites, see `expand_sites`
+    """
+
+    def __init__(self, plates=None, wells=None, sites=None):
+        plates = plates or dict()
+        wells = wells or dict()
+        sites = sites or dict()
+        self.plate_include = [_plate_matcher(i) for i in plates.get("include", [])]
+        self.plate_exclude = [_plate_matcher(i) for i in plates.get("exclude", [])]
+        self.well_include = expand_wells(wells["include"]) if "include" in wells else None
+        self.well_exclude = expand_wells(wells.get("exclude", []))
+        self.site_include = expand_sites(sites["include"]) if "include" in sites else None
+        self.site_exclude = expand_sites(sites.get("exclude", []))
+
+    def keep_plate(self, name):
+        """whether a plate name passes the plate filters"""
+        if self.plate_include and not any(match(name) for match in self.plate_include):
+            return False
+        return not any(match(name) for match in self.plate_exclude)
+
+    def filters_images(self):
+        """whether there are any well or site filters"""
+        return (self.well_include is not None or self.site_include is not None
+                or len(self.well_exclude) > 0 or len(self.site_exclude) > 0)
+
+    def keep_image(self, well, site):
+        """whether an image's well and site pass the filters"""
+        well = "{}{:02d}".format(*_split_well(well))
+        if self.well_include is not None and well not in self.well_include:
+            return False
+        if self.site_include is not None and site not in self.site_include:
+            return False
+        return well not in self.well_exclude and site not in self.site_exclude
+
+
+def filter_images(files, microscope, image_filter, plate_dir=None):
+    """
+    keep only the images passing the well and site filters
+
+    Parameters:
+    -----------
+    files: list
+        image paths from Filelist.files_from_plate
+    microscope: string
+    image_filter: ImageFilter
+    plate_dir: string (optional)
+        directory the files came from, for the error message
+
+    Returns:
+    --------
+    list of image paths, raises a RuntimeError if none are left
+    """
+    if not image_filter.filters_images():
+        return files
+    parser = parse_metadata.MetadataParser(microscope)
+    with profiling.stage("filelist.filter_images") as record:
+        kept = [f for f in files if image_filter.keep_image(*parser.parse_well_site(f))]
+        record.n_items = len(files)
+    if len(kept) == 0:
+        err_msg = "No files for the well and site filters found in '{}'"
+        raise RuntimeError(err_msg.format(plate_dir))
+    return kept
+
+
 class Micro:
     """abstract class for Microscope filelist"""
     def __init__(self):
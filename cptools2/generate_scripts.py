@@ -8,6 +8,9 @@ import os
 import textwrap
 from datetime import datetime
 from cptools2 import cookiecutter
+from cptools2 import manifest
+from cptools2 import runtime
+from cptools2 import status
 from cptools2 import utils
 
 
@@ -75,9 +78,13 @@ def lines_in_commands(commands_location):
     return _lines_in_commands(**command_paths)
 
 
-def make_qsub_scripts(commands_location, commands_count_dict, logfile_location):
+def make_qsub_scripts(commands_location, commands_count_dict, logfile_location,
+                      task_list=None, script_name="analysis", scheduler="sge",
+                      max_running=None, job_hex=None, hold_jid=False, canary=False,
+                      circuit_breaker=None, runtime=None, memory=None,
+                      result_cache=None):
     """
-    Create and save qsub submission scripts in the same location as the
+    Create and save submission scripts in the same location as the
     commands.
 
     Parameters:
@@ -93,40 +100,129 @@ def make_qsub_scripts(commands_location, commands_count_dict, logfile_location):
         where to store the log files. By default this will store them
         in a directory alongside the results.
 
+    task_list: string (optional)
+        path to a task list file (see `manifest.write_task_list`) of the
+        task_ids in the manifest to run, if only running a subset of tasks.
+        `commands_count_dict` should then contain the length of the task list.
+
+    script_name: string (default = "analysis")
+        used in the job name and the script's filename
+
+    scheduler: string (default = "sge")
+        which scheduler to create the script for, "sge" or "slurm"
+
+    max_running: int (optional)
+        maximum number of tasks to run at once
+
+    job_hex: string (optional)
+        random hex appended to the job name, generated if not given
+
+    hold_jid: string (optional)
+        job the array job is held on, see `cookiecutter.SGEScript`
+
+    canary: Boolean (default = False)
+        whether the script is for canary tasks, which exit with an error
+        that holds any job waiting on them if their command fails, see
+        `canary.make_canary_scripts`
+
+    circuit_breaker: dictionary (optional)
+        {"failures": int, "window": int, "hook": string}, stop starting
+        new tasks once `failures` of the last `window` finished tasks have
+        failed, see `make_breaker_text`
+
+    runtime: string (optional)
+        run time limit per task, e.g "01:30:00", see `resources`
+
+    memory: string (optional)
+        memory limit per task, e.g "4096M", see `resources`
+
+    result_cache: string (optional)
+        location of the job, if given each successful task records its
+        key in the result cache there, see `result_cache`
 
     Returns:
     ---------
-    Nothing, writes files to `commands_location`
+    string, path to the saved script
     """
     cmd_path = make_command_paths(commands_location)
     time_now = datetime.now().replace(microsecond=0)
     time_now = str(time_now).replace(" ", "-")
     # append random hex to job names - this allows you to run multiple jobs
     # without the -hold_jid flags fron clashing
-    job_hex = cookiecutter.generate_random_hex()
+    if job_hex is None:
+        job_hex = cookiecutter.generate_random_hex()
     n_tasks = commands_count_dict["cp_commands"]
-    analysis_script = cookiecutter.SGEScript(
-        name="analysis_{}".format(job_hex),
+    script_class = cookiecutter.get_script_class(scheduler)
+    analysis_script = script_class(
+        name="{}_{}".format(script_name, job_hex),
         tasks=n_tasks,
-        output=os.path.join(logfile_location, "analysis")
+        output=os.path.join(logfile_location, "analysis"),
+        max_running=max_running,
+        hold_jid=hold_jid,
+        runtime=runtime,
+        memory=memory
     )
     analysis_script += "\n"
     analysis_script += "module load jdk/1.8.0_25"
     analysis_script += "module load singularity"
     analysis_script += 'CP_CONTAINER="/HPC_projets/CPCB-AI/singularity_containers/cellprofiler_319.simg"'
-    analysis_script.loop_through_file(
-        cmd_path["cp_commands"],
-        prefix="singularity exec $CP_CONTAINER"
-    )
+    prefix = "singularity exec $CP_CONTAINER"
+    instrumented = manifest.has_manifest(commands_location)
+    if instrumented:
+        # so collate only reads the status logs of this manifest's jobs
+        manifest.add_job(commands_location, job_hex)
+        # look up each task's command by its byte offset rather than
+        # scanning through the commands file
+        manifest_paths = manifest.make_manifest_paths(commands_location)
+        analysis_script += make_runtime_setup_text()
+        prefix = "$TASK_TIMER " + prefix
+        analysis_script.loop_through_indexed_file(
+            manifest_paths["manifest"],
+            manifest_paths["index"],
+            index_width=manifest.INDEX_WIDTH,
+            field=manifest.command_field(),
+            prefix=prefix,
+            task_list=task_list,
+            before_command=None if circuit_breaker is None else make_breaker_check_text(
+                logfile_location, job_file=job_hex, job_id_var=analysis_script.job_id_var
+            )
+        )
+    elif task_list is not None:
+        raise RuntimeError("running a task list requires a task manifest")
+    elif circuit_breaker is not None:
+        raise RuntimeError("a circuit breaker requires a task manifest")
+    elif result_cache is not None:
+        raise RuntimeError("a result cache requires a task manifest")
+    else:
+        analysis_script.loop_through_file(cmd_path["cp_commands"], prefix=prefix)
     analysis_loc = os.path.join(commands_location,
-                                "{}_analysis_script.sh".format(time_now))
+                                "{}_{}_script.sh".format(time_now, script_name))
     analysis_script += make_logfile_text(logfile_location,
                                          job_file=job_hex,
-                                         n_tasks=n_tasks)
+                                         n_tasks=n_tasks,
+                                         job_id_var=analysis_script.job_id_var,
+                                         task_id_var=analysis_script.task_id_var)
+    if result_cache is not None:
+        # imported here as it imports pandas
+        from cptools2 import result_cache as cache
+        analysis_script += cache.make_cache_text(result_cache, commands_location)
+    if instrumented:
+        analysis_script += make_runtime_text(logfile_location,
+                                             job_file=job_hex,
+                                             job_id_var=analysis_script.job_id_var)
+    if circuit_breaker is not None:
+        analysis_script += make_breaker_text(logfile_location,
+                                             job_file=job_hex,
+                                             job_id_var=analysis_script.job_id_var,
+                                             **circuit_breaker)
+    if canary:
+        analysis_script += make_canary_exit_text(scheduler)
     analysis_script.save(analysis_loc)
+    return analysis_loc
 
 
-def make_logfile_text(logfile_location, job_file, n_tasks):
+def make_logfile_text(logfile_location, job_file, n_tasks,
+                      job_id_var="JOB_ID", task_id_var="SGE_TASK_ID"):
     text = """
     # get the exit code from the cellprofiler job
     RETURN_VAL=$?
@@ -138,9 +234,184 @@ def make_logfile_text(logfile_location, job_file, n_tasks):
     fi
 
     LOG_FILE_LOC={logfile_location}/{job_file}.log
-    echo "`date +"%Y-%m-%d %H:%M"`  "$JOB_ID"  "$SGE_TASK_ID"  "$RETURN_STATUS"" >> "$LOG_FILE_LOC"
+    echo "`date +"%Y-%m-%d %H:%M"`  "${job_id_var}"  "${{TASK_ID:-${task_id_var}}}"  "$RETURN_STATUS"" >> "$LOG_FILE_LOC"
     """.format(logfile_location=logfile_location,
                job_file=job_file,
-               n_tasks=n_tasks)
+               n_tasks=n_tasks,
+               job_id_var=job_id_var,
+               task_id_var=task_id_var)
     return textwrap.dedent(text)
 
+
+def make_breaker_check_text(logfile_location, job_file, job_id_var="JOB_ID"):
+    """
+    text to run before a task's command, exiting without running it if the
+    circuit breaker has tripped, see `make_breaker_text`
+    """
+    text = """
+    BREAKER_DIR={logfile_location}/{job_file}.breaker
+    LOG_FILE_LOC={logfile_location}/{job_file}.log
+    if [[ -e "$BREAKER_DIR/TRIPPED" ]]; then
+        echo "`date +"%Y-%m-%d %H:%M"`  "${job_id_var}"  "$TASK_ID"  "{skipped}"" >> "$LOG_FILE_LOC"
+        exit 0
+    fi
+    """.format(logfile_location=logfile_location,
+               job_file=job_file,
+               job_id_var=job_id_var,
+               skipped=status.SKIPPED)
+    return textwrap.dedent(text)
+
+
+def make_breaker_text(logfile_location, job_file, failures, window=None,
+                      hook=None, job_id_var="JOB_ID"):
+    """
+    text to run after a task's command and status line, recording whether
+    it failed and tripping the circuit breaker if `failures` of the last
+    `window` finished tasks failed.
+
+    Outcomes are kept in `logfile_location`/`job_file`.breaker/outcomes, as
+    a string of S and F, updated under a lock directory (mkdir is atomic,
+    also on NFS) and replaced by a rename so it is never read half written.
+    Once tripped a TRIPPED file is created there, which stops later tasks
+    from starting their command, the trip is written to the status log and
+    `hook` is run once, e.g "qdel $JOB_ID".
+
+    Parameters:
+    -----------
+    logfile_location: string
+    job_file: string
+        name of the job's log files
+    failures: int
+        number of failures which trips the breaker
+    window: int (optional)
+        number of the most recent tasks to count failures in, defaults to
+        `failures`, i.e consecutive failures
+    hook: string (optional)
+        shell command run by the task which trips the breaker
+    job_id_var: string
+        environment variable containing the job ID
+    """
+    window = failures if window is None else window
+    text = """
+    BREAKER_DIR={logfile_location}/{job_file}.breaker
+    mkdir -p "$BREAKER_DIR"
+    BREAKER_WAIT=0
+    until mkdir "$BREAKER_DIR/lock" 2>/dev/null; do
+        BREAKER_WAIT=$((BREAKER_WAIT + 1))
+        if [[ $BREAKER_WAIT -ge 60 ]]; then
+            # the task holding the lock has died, take it over
+            break
+        fi
+        sleep 1
+    done
+    if [[ $RETURN_VAL == 0 ]]; then
+        OUTCOME=S
+    else
+        OUTCOME=F
+    fi
+    OUTCOMES=$(printf '%s%s' "$(cat "$BREAKER_DIR/outcomes" 2>/dev/null)" "$OUTCOME" | tail -c {window})
+    printf '%s\n' "$OUTCOMES" > "$BREAKER_DIR/outcomes.$$"
+    mv "$BREAKER_DIR/outcomes.$$" "$BREAKER_DIR/outcomes"
+    N_FAILURES=$(printf '%s' "$OUTCOMES" | tr -cd F | wc -c)
+    BREAKER_TRIPPED=""
+    if [[ $N_FAILURES -ge {failures} && ! -e "$BREAKER_DIR/TRIPPED" ]]; then
+        BREAKER_TRIPPED=1
+        echo "$N_FAILURES of the last {window} tasks failed" > "$BREAKER_DIR/TRIPPED"
+    fi
+    rmdir "$BREAKER_DIR/lock" 2>/dev/null
+    if [[ -n "$BREAKER_TRIPPED" ]]; then
+        echo "`date +"%Y-%m-%d %H:%M"`  "${job_id_var}"  "$TASK_ID"  "{tripped}: $N_FAILURES of the last {window} tasks failed"" >> "$LOG_FILE_LOC"
+        {hook}
+    fi
+    """.format(logfile_location=logfile_location,
+               job_file=job_file,
+               window=window,
+               failures=failures,
+               job_id_var=job_id_var,
+               tripped=status.TRIPPED,
+               hook=hook if hook else ":")
+    return textwrap.dedent(text)
+
+
+def make_canary_exit_text(scheduler="sge"):
+    """
+    text to end a canary task with, exiting with an error if its command
+    failed so jobs held on the canary tasks don't start.
+
+    On SGE exit code 100 puts the task into an error state, which keeps
+    jobs waiting on it with `-hold_jid` held until it is deleted. On SLURM
+    any non-zero exit code fails the `afterok` dependency.
+    """
+    exit_code = 100 if scheduler == "sge" else "$RETURN_VAL"
+    text = """
+    if [[ $RETURN_VAL != 0 ]]; then
+        exit {exit_code}
+    fi
+    """.format(exit_code=exit_code)
+    return textwrap.dedent(text)
+
+
+def make_runtime_setup_text():
+    """
+    text to run before a task's command, recording the start time and
+    setting $TASK_TIMER to measure the command's peak memory with
+    /usr/bin/time if it's available
+    """
+    text = """
+    TASK_START=$(date +%s)
+    TASK_TIME_FILE=$(mktemp)
+    if [[ -x /usr/bin/time ]]; then
+        TASK_TIMER="/usr/bin/time -f %M -o $TASK_TIME_FILE"
+    else
+        TASK_TIMER=""
+    fi
+    """
+    return textwrap.dedent(text)
+
+
+def make_runtime_text(logfile_location, job_file, job_id_var="JOB_ID"):
+    """
+    text to run after a task's command and status line, appending a JSON
+    record of the task's runtime, peak memory, host and input size to
+    `logfile_location`/`job_file`.runtime.jsonl, see `runtime`
+
+    Peak memory is taken from /usr/bin/time, falling back to the cgroup's
+    peak memory usage. Input bytes is the total size of the images in the
+    task's LoadData file.
+    """
+    text = """
+    TASK_END=$(date +%s)
+    MAX_RSS_KB=$(tail -n 1 "$TASK_TIME_FILE" 2>/dev/null | tr -cd '0-9')
+    rm -f "$TASK_TIME_FILE"
+    if [[ -z "$MAX_RSS_KB" ]]; then
+        for CGROUP_PEAK in /sys/fs/cgroup/memory.peak /sys/fs/cgroup/memory/memory.max_usage_in_bytes; do
+            if [[ -r "$CGROUP_PEAK" ]]; then
+                MAX_RSS_KB=$(( $(cat "$CGROUP_PEAK") / 1024 ))
+                break
+            fi
+        done
+    fi
+    TASK_NAME=$(printf '%s\\n' "$TASK_LINE" | cut -f {name_field})
+    N_IMAGESETS=$(printf '%s\\n' "$TASK_LINE" | cut -f {n_imagesets_field})
+    TASK_LOADDATA=$(printf '%s\\n' "$TASK_LINE" | cut -f {loaddata_field})
+    INPUT_BYTES=$(awk -F, 'NR == 1 {{
+            for (i = 1; i <= NF; i++) {{
+                if ($i ~ /^FileName_/) filename[substr($i, 10)] = i
+                if ($i ~ /^PathName_/) pathname[substr($i, 10)] = i
+            }}
+            next
+        }}
+        {{for (c in filename) if (c in pathname) print $pathname[c] "/" $filename[c]}}' "$TASK_LOADDATA" 2>/dev/null |
+        tr '\\n' '\\0' | xargs -0 -r stat -c %s 2>/dev/null | awk '{{s += $1}} END {{print s + 0}}')
+    RUNTIME_LOG={logfile_location}/{job_file}{runtime_suffix}
+    printf '{{"job_id": "%s", "task_id": %d, "name": "%s", "hostname": "%s", "start": %d, "end": %d, "return_code": %d, "max_rss_kb": %s, "n_imagesets": %d, "input_bytes": %d}}\\n' \\
+        "${job_id_var}" "$TASK_ID" "$TASK_NAME" "$(hostname)" "$TASK_START" "$TASK_END" \\
+        "$RETURN_VAL" "${{MAX_RSS_KB:-null}}" "$N_IMAGESETS" "$INPUT_BYTES" >> "$RUNTIME_LOG"
+    """.format(logfile_location=logfile_location,
+               job_file=job_file,
+               runtime_suffix=runtime.RUNTIME_SUFFIX,
+               job_id_var=job_id_var,
+               name_field=manifest.FIELDS.index("name") + 1,
+               n_imagesets_field=manifest.FIELDS.index("n_imagesets") + 1,
+               loaddata_field=manifest.FIELDS.index("loaddata") + 1)
+    return textwrap.dedent(text)
@@ -1,29 +1,110 @@
 """
-TODO: module docstring
+Collect the images of a job's plates and turn them into tasks.
+
+A Job lists the images of each plate in an experiment, or of plates added
+one at a time, filtering channels, plates, wells and sites as they're
+listed. The images are chunked into tasks of a number of imagesets, the
+LoadData dataframes are created a plate at a time, and `create_commands`
+writes the tasks through a `plan.Plan`.
+
+    jobber = make_job(config)
+    jobber.chunk(config.chunk)
+    jobber.create_commands(**config.create_command_args())
 """
 
 import os
 
-from cptools2 import colours, commands, filelist, loaddata, splitter, utils
+from cptools2 import colours, filelist, loaddata, profiling, splitter, utils
 from cptools2.colours import pretty_print
 
 
+# how tasks can be ordered in cp_commands.txt and the task manifest,
+# "plate" keeps plate name then chunk order, the others put the most
+# expensive tasks first
+TASK_ORDERS = ["plate", "imagesets", "planes", "bytes"]
+
+
+def task_cost(dataframe, task_order, plate_dir=None):
+    """
+    estimated cost of running a task, from its LoadData dataframe
+
+    Parameters:
+    -----------
+    dataframe: pandas DataFrame
+        LoadData dataframe for a task
+    task_order: string
+        "imagesets": number of rows
+        "planes": number of rows times the number of channels
+        "bytes": total size of the task's images
+    plate_dir: string (optional)
+        path to the plate directory, relative image paths (ImageXpress)
+        are relative to its parent directory
+
+    Returns:
+    --------
+    number
+    """
+    if task_order == "imagesets":
+        return dataframe.shape[0]
+    filename_cols = [i for i in dataframe.columns if i.startswith("FileName_")]
+    if task_order == "planes":
+        return dataframe.shape[0] * len(filename_cols)
+    if task_order == "bytes":
+        root = os.path.dirname(plate_dir) if plate_dir is not None else ""
+        total = 0
+        for path in loaddata.image_paths(dataframe, root):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                # missing images are caught later, by LoadData
+                pass
+        return total
+    raise ValueError("unknown task order '{}', options = {}".format(task_order, TASK_ORDERS))
+
+
 class Job(object):
     """
     class to generate staging, analysis and
     de-stating commands for an SGE array job.
     """
 
-    def __init__(self, microscope="imagexpress"):
+    def __init__(self, microscope="imagexpress", filelister=None, channels=None,
+                 image_filter=None):
         self.exp_dir = None
         self.chunked = False
         self.plate_store = dict()
         self.loaddata_store = dict()
         self.has_loaddata = False
+        # imagesets left out of the loaddata as they're missing a channel
+        self.incomplete = []
         self.microscope = microscope
-        self.filelister = filelist.Filelist(microscope)
+        # anything with the same methods as a filelist.Filelist, so
+        # scans can be shared between jobs, see batch.ScanCache
+        if filelister is None:
+            filelister = filelist.Filelist(microscope)
+        self.filelister = filelister
+        # channel numbers to keep when listing files, None keeps all
+        self.channels = channels
+        # plate, well and site filters, a filelist.ImageFilter
+        if image_filter is None:
+            image_filter = filelist.ImageFilter()
+        self.image_filter = image_filter
+
+    def files_from_plate(self, plate_dir):
+        """
+        list a plate's images, keeping only `self.channels` and those
+        passing `self.image_filter`
+        """
+        img_files = self.filelister.files_from_plate(plate_dir)
+        if self.channels is not None:
+            img_files = filelist.filter_channels(
+                img_files, self.microscope, self.channels, plate_dir
+            )
+        return filelist.filter_images(
+            img_files, self.microscope, self.image_filter, plate_dir
+        )
 
-    def add_experiment(self, exp_dir):
+    def add_experiment(self, exp_dir, exclude=None):
         """
         add all plates in an experiment to the platestore
 
@@ -31,11 +112,18 @@ class Job(object):
         -----------
         exp_dir : string
             path to imageXpress experiment that contains plate sub-directories
+        exclude : list of strings (optional)
+            plate names to leave out, e.g the config's `remove plate`
         """
         self.exp_dir = exp_dir
+        exclude = set(exclude or [])
         plate_paths = self.filelister.paths_to_plates(exp_dir)
+        # filtered before the plates are scanned
+        plate_paths = [i for i in plate_paths
+                       if i.split(os.sep)[-1] not in exclude
+                       and self.image_filter.keep_plate(i.split(os.sep)[-1])]
         plate_names = [i.split(os.sep)[-1] for i in plate_paths]
-        img_files = [self.filelister.files_from_plate(p) for p in plate_paths]
+        img_files = [self.files_from_plate(p) for p in plate_paths]
         for idx, plate in enumerate(plate_names):
             self.plate_store[plate] = [plate_paths[idx], img_files[idx]]
 
@@ -49,6 +137,8 @@ class Job(object):
         if adding plates from multiple experiments, then use multiple add_plate
         methods
 
+        plates not passing the plate filters are skipped
+
         Parameters:
         -----------
         plates : string or list of strings
@@ -56,13 +146,17 @@ class Job(object):
         exp_dir : string
             path to experiment directory that contains the plates
         """
+        if isinstance(plates, list):
+            plates = [i for i in plates if self.image_filter.keep_plate(i)]
+        elif isinstance(plates, str) and not self.image_filter.keep_plate(plates):
+            return
         if isinstance(plates, str):
             full_path = os.path.join(exp_dir, plates)
-            img_files = self.filelister.files_from_plate(full_path)
+            img_files = self.files_from_plate(full_path)
             self.plate_store[plates] = [full_path, img_files]
         elif isinstance(plates, list):
             full_path = [os.path.join(exp_dir, i) for i in plates]
-            img_files = [self.filelister.files_from_plate(plate) for plate in full_path]
+            img_files = [self.files_from_plate(plate) for plate in full_path]
             for idx, plate in enumerate(plates):
                 self.plate_store[plate] = [full_path[idx], img_files[idx]]
         else:
@@ -95,9 +189,12 @@ class Job(object):
             number of imagesets per job
         """
         # for each image_list in the platestore, split into chunks of job_size
-        for key in self.plate_store:
-            chunks = splitter.split(self.plate_store[key][1], job_size, self.microscope)
-            self.plate_store[key][1] = chunks
+        with profiling.stage("job.chunk") as record:
+            record.n_items = 0
+            for key in self.plate_store:
+                chunks = splitter.split(self.plate_store[key][1], job_size, self.microscope)
+                self.plate_store[key][1] = chunks
+                record.n_items += len(chunks)
         self.chunked = True
 
     def _create_loaddata(self, channel_dict, job_size=None):
@@ -105,38 +202,87 @@ class Job(object):
         create dictionary store of loaddata modules
         pretty much mirroring self.plate_store but dataframes instead of
         list of lists
+
+        The metadata of a plate's images is parsed in one go, so imagesets
+        missing a channel can be found across the whole plate. These are
+        left out of the loaddata and recorded in self.incomplete.
         """
+        self.incomplete = []
         for key in self.plate_store:
-            self.loaddata_store[key] = []
-            img_list = self.plate_store[key][1]
+            dataframes, incomplete = self.plate_loaddata(key, channel_dict, job_size)
+            self.incomplete.extend(incomplete)
             if self.chunked is True:
-                # create a dataframe for each chunk in the imagelist
-                for index, chunk in enumerate(img_list, 1):
-                    # unnest channel groupings
-                    # only there before chunking to keep images together
-                    unnested = list(utils.flatten(chunk))
-                    df_loaddata = loaddata.create_loaddata(
-                        unnested, self.microscope, channel_dict
-                    )
-                    if index < len(img_list):
-                        loaddata.check_dataframe_size(df_loaddata, job_size)
-                    self.loaddata_store[key].append(df_loaddata)
-            elif self.chunked is False:
-                # still nested by channels and wells
-                # flatten these nested lists
-                unnested = list(utils.flatten(img_list))
+                self.loaddata_store[key] = dataframes
+            elif dataframes:
                 # just a single dataframe for the whole imagelist
-                df_loaddata = loaddata.create_loaddata(
-                    unnested, self.microscope, channel_dict
-                )
-                self.loaddata_store[key] = df_loaddata
+                self.loaddata_store[key] = dataframes[0]
+            else:
+                self.loaddata_store[key] = []
         self.has_loaddata = True
 
-    def create_commands(self, pipeline, location, commands_location, job_size, channel_dict):
+    def plate_loaddata(self, key, channel_dict, job_size=None):
         """
-        bit of a beast, TODO: refactor
+        create the loaddata dataframes of a single plate, a dataframe per
+        chunk
 
-        create stage, analysis and destage commands and write to disk
+        Returns:
+        --------
+        tuple of (list of pandas DataFrames, list of
+        loaddata.IncompleteImageset left out of them)
+        """
+        img_list = self.plate_store[key][1]
+        # still nested by channels and wells before chunking, and
+        # chunks are nested to keep images together
+        chunks = img_list if self.chunked is True else [img_list]
+        unnested = [list(utils.flatten(chunk)) for chunk in chunks]
+        with profiling.stage("loaddata.create_long_loaddata") as record:
+            df_long = loaddata.create_long_loaddata(
+                [path for chunk in unnested for path in chunk], self.microscope
+            )
+            df_long["chunk"] = [i for i, chunk in enumerate(unnested) for _ in chunk]
+            record.n_items = df_long.shape[0]
+        with profiling.stage("loaddata.find_incomplete") as record:
+            rows, incomplete = loaddata.find_incomplete(df_long)
+            record.n_items = df_long.shape[0]
+        dropped_chunks = set(df_long["chunk"][rows])
+        dataframes = []
+        for index, chunk_df in df_long[~rows].groupby("chunk", sort=True):
+            with profiling.stage("loaddata.cast_dataframe") as record:
+                df_loaddata = loaddata.cast_dataframe(
+                    chunk_df.drop("chunk", axis=1), channel_dict
+                )
+                record.n_items = df_loaddata.shape[0]
+            if self.chunked is True and index < len(chunks) - 1 and index not in dropped_chunks:
+                loaddata.check_dataframe_size(df_loaddata, job_size)
+            dataframes.append(df_loaddata)
+        return dataframes, incomplete
+
+    def _report_incomplete(self, commands_location, incomplete="fail"):
+        """
+        write the incomplete imagesets to disk, raising a LoadDataError if
+        `incomplete` is "fail"
+        """
+        utils.make_dir(commands_location)
+        report = loaddata.write_incomplete_report(commands_location, self.incomplete)
+        msg = "{} imageset(s) are missing images, listed in {}".format(
+            len(self.incomplete), report
+        )
+        if incomplete == "fail":
+            examples = ["plate {}, well {}, site {}, z {}: channel(s) {}".format(
+                i.plate, i.well, i.site, i.z, ", ".join(str(j) for j in i.missing)
+            ) for i in self.incomplete[:10]]
+            raise loaddata.LoadDataError("\n".join([msg] + examples))
+        pretty_print(colours.red(msg + ", leaving them out"))
+
+    def create_commands(self, pipeline, location, commands_location, job_size, channel_dict,
+                        task_order="plate", layout="flat", incomplete="fail"):
+        """
+        create the LoadData dataframes, report any incomplete imagesets,
+        and write the LoadData csv files, cellprofiler commands and task
+        manifest through a `plan.Plan` and `plan.FileSink`
+
+        The dataframes are kept in `loaddata_store` for the resource
+        estimate, image validation and result cache.
 
         Parameters:
         ------------
@@ -146,15 +292,41 @@ class Job(object):
             file path to location in which the loaddata, images and results
             will be stored
         commands_location: string
-            file path to location in which to store the stage, analysis and
-            destage commands.
+            file path to location in which to store the commands and the
+            task manifest
+        job_size: int
+            number of imagesets per task, to check the chunks against
+        channel_dict: dict or None
+            mapping of channel numbers to names, from the config's
+            `channels`
+        task_order: string (default = "plate")
+            one of TASK_ORDERS, the order of the tasks in the array job.
+            As the scheduler starts tasks in order, putting the most
+            expensive tasks first stops them holding up the end of the job.
+        layout: string (default = "flat")
+            one of commands.LAYOUTS, how the loaddata, raw_data and
+            img_data directories are split into sub-directories
+        incomplete: string (default = "fail")
+            one of loaddata.INCOMPLETE_POLICIES, what to do with imagesets
+            missing a channel. Either way they're written to
+            `commands_location`/incomplete_imagesets.txt
         """
+        # imported here as plan imports this module
+        from cptools2 import plan
+        job_plan = plan.Plan(
+            self, pipeline=pipeline, location=location, job_size=job_size,
+            channel_dict=channel_dict, task_order=task_order, layout=layout,
+            incomplete=incomplete
+        )
         pretty_print("creating image list")
+        # kept on the job rather than built by the plan as the tasks are
+        # written, as the resource estimate and validation use them
         if self.has_loaddata is False:
-            self._create_loaddata(channel_dict, job_size)
-        cp_commands = []
+            with profiling.stage("job.create_loaddata"):
+                self._create_loaddata(channel_dict, job_size)
+        if self.incomplete:
+            self._report_incomplete(commands_location, incomplete)
         pretty_print("creating output directories at {}".format(colours.yellow(location)))
-        commands.make_output_directories(location=location)
         # for each job per plate, create loaddata and commands
         platenames = sorted(self.plate_store.keys())
         pretty_print("detected {} {}".format(
@@ -163,24 +335,48 @@ class Job(object):
         )
         for i, plate in enumerate(platenames, 1):
             print(colours.purple("\t {}.".format(i)), colours.yellow("{}".format(plate)))
-            for job_num, dataframe in enumerate(self.loaddata_store[plate]):
-                name = "{}_{}".format(plate, str(job_num))
-                output_loc = os.path.join(location, "raw_data", name)
-                # append cp commands
-                cp_cmnd = commands.make_cp_cmnd(
-                    name=name, pipeline=pipeline,
-                    location=location,
-                    output_loc=output_loc
-                )
-                cp_commands.append(cp_cmnd)
-                # write loaddata csv to disk
-                commands.write_loaddata(
-                    name=name,
-                    location=location,
-                    dataframe=dataframe
-                )
-        # write commands to disk as a txt file
-        pretty_print("creating image filelist")
+        if task_order != "plate":
+            pretty_print("ordering tasks by {}".format(colours.yellow(task_order)))
         pretty_print("creating csv files for LoadData")
         pretty_print("creating Cellprofiler commands")
-        commands._write_single(commands_location, cp_commands, "cp_commands")
+        pretty_print("creating task manifest")
+        with profiling.stage("job.write_tasks") as record:
+            record.n_items = job_plan.write(
+                plan.FileSink(location, commands_location, layout)
+            )
+
+
+def make_job(config, filelister=None, channels=None):
+    """
+    create a Job with the plates from a config added, before the images are
+    chunked
+
+    Parameters:
+    -----------
+    config: parse_config.Config
+    filelister: filelist.Filelist (optional)
+        passed to the Job, to share directory scans between jobs
+    channels: list of ints (optional)
+        channel numbers to keep, defaults to `config.get_used_channels()`
+
+    Returns:
+    --------
+    Job
+    """
+    if channels is None:
+        channels = config.get_used_channels()
+    # plates, wells and sites are filtered as the files are listed
+    image_filter = filelist.ImageFilter(**config.image_filter_args())
+    jobber = Job(
+        config.microscope, filelister=filelister, channels=channels,
+        image_filter=image_filter
+    )
+    # some of the optional arguments might be none if that option was not present in the
+    # configuration file, in which case don't pass them as arguments to the methods
+    if config.experiment is not None:
+        # removed plates are never scanned
+        jobber.add_experiment(config.experiment, exclude=config.removed_plates())
+    if config.add_plate is not None:
+        for add_plate in config.add_plate:
+            jobber.add_plate(**add_plate)
+    return jobber
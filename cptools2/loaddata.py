@@ -2,11 +2,33 @@
 Create dataframes/csv-files for CellProfiler's LoadData module
 """
 
+import os
+from collections import namedtuple
 import pandas as _pd
+from cptools2 import profiling
 from cptools2 import utils
 from cptools2 import parse_metadata
 
 
+# metadata columns shared by every channel of an imageset, a row of the
+# LoadData dataframe
+IMAGESET_COLUMNS = [
+    "Metadata_well",
+    "Metadata_row",
+    "Metadata_column",
+    "Metadata_site",
+    "Metadata_plate",
+    "Metadata_z",
+    "path"
+]
+# what to do with imagesets missing a channel, "fail" raises a LoadDataError
+# listing them, "drop" leaves them out of the LoadData
+INCOMPLETE_POLICIES = ["fail", "drop"]
+INCOMPLETE_REPORT = "incomplete_imagesets.txt"
+
+IncompleteImageset = namedtuple("IncompleteImageset", ["plate", "well", "site", "z", "missing"])
+
+
 def create_loaddata(img_list, microscope, channel_dict=None):
     """
     create a dataframe suitable for cellprofilers LoadData module
@@ -20,8 +42,13 @@ def create_loaddata(img_list, microscope, channel_dict=None):
     --------
     pandas DataFrame
     """
-    df_long = create_long_loaddata(img_list, microscope)
-    return cast_dataframe(df_long, channel_dict)
+    with profiling.stage("loaddata.create_long_loaddata") as record:
+        df_long = create_long_loaddata(img_list, microscope)
+        record.n_items = len(img_list)
+    with profiling.stage("loaddata.cast_dataframe") as record:
+        wide_df = cast_dataframe(df_long, channel_dict)
+        record.n_items = wide_df.shape[0]
+    return wide_df
 
 
 def create_long_loaddata(img_list, microscope):
@@ -65,15 +92,7 @@ def cast_dataframe(dataframe, channel_dict=None, check_nan=True):
     """
     channels = sorted(list(set(dataframe.Metadata_channel)))
     wide_df = dataframe.pivot_table(
-        index=[
-            "Metadata_well",
-            "Metadata_row",
-            "Metadata_column",
-            "Metadata_site",
-            "Metadata_plate",
-            "Metadata_z",
-            "path"
-        ],
+        index=IMAGESET_COLUMNS,
         columns="Metadata_channel",
         values="URL",
         aggfunc="first").reset_index()
@@ -100,6 +119,90 @@ def cast_dataframe(dataframe, channel_dict=None, check_nan=True):
     return wide_df
 
 
+def find_incomplete(dataframe, channels=None):
+    """
+    find the imagesets missing an image from one or more channels
+
+    Every (imageset, channel) pair is counted at once, rather than looping
+    through the imagesets.
+
+    Parameters:
+    -----------
+    dataframe: pandas DataFrame
+        from `create_long_loaddata`
+    channels: list (optional)
+        channel numbers every imageset should have, defaults to every
+        channel in `dataframe`
+
+    Returns:
+    --------
+    tuple of (boolean pandas Series, True for the rows of `dataframe` in an
+    incomplete imageset, list of IncompleteImageset)
+    """
+    if channels is None:
+        channels = sorted(set(dataframe.Metadata_channel))
+    counts = (dataframe.groupby(IMAGESET_COLUMNS + ["Metadata_channel"])
+              .size()
+              .unstack("Metadata_channel", fill_value=0)
+              .reindex(columns=channels, fill_value=0))
+    missing = counts.eq(0)
+    incomplete = missing[missing.any(axis=1)]
+    rows = _pd.MultiIndex.from_arrays(
+        [dataframe[i] for i in IMAGESET_COLUMNS]
+    ).isin(incomplete.index)
+    report = []
+    for key, row in zip(incomplete.index, incomplete.values):
+        imageset = dict(zip(IMAGESET_COLUMNS, key))
+        report.append(IncompleteImageset(
+            plate=imageset["Metadata_plate"],
+            well=imageset["Metadata_well"],
+            site=imageset["Metadata_site"],
+            z=imageset["Metadata_z"],
+            missing=[channel for channel, gap in zip(channels, row) if gap]
+        ))
+    return _pd.Series(rows, index=dataframe.index), report
+
+
+def write_incomplete_report(commands_location, incomplete):
+    """
+    write the incomplete imagesets as a tab-separated file
+
+    Returns:
+    --------
+    string, path to the report
+    """
+    path = os.path.join(commands_location, INCOMPLETE_REPORT)
+    with open(path, "w") as f:
+        f.write("plate\twell\tsite\tz\tmissing channels\n")
+        for i in incomplete:
+            f.write("{}\t{}\t{}\t{}\t{}\n".format(
+                i.plate, i.well, i.site, i.z, ",".join(str(j) for j in i.missing)
+            ))
+    return path
+
+
+def image_paths(dataframe, root=""):
+    """
+    generator of the image paths in a LoadData dataframe, row by row
+
+    Parameters:
+    -----------
+    dataframe: pandas DataFrame
+        with FileName_<name> and PathName_<name> columns
+    root: string (optional)
+        directory relative PathNames are relative to
+
+    Returns:
+    --------
+    generator of strings
+    """
+    names = [i[len("FileName_"):] for i in dataframe.columns if i.startswith("FileName_")]
+    columns = [(dataframe["PathName_" + i], dataframe["FileName_" + i]) for i in names]
+    for row in range(dataframe.shape[0]):
+        for pathnames, filenames in columns:
+            yield os.path.join(root, pathnames.iat[row], filenames.iat[row])
+
+
 def check_dataframe_size(dataframe, expected_rows):
     """
     docstring
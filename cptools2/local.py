@@ -0,0 +1,264 @@
+"""
+Run the cellprofiler commands from the task manifest on the local machine,
+for workstations and single-node runs, rather than submitting an array job.
+
+Tasks are run as subprocesses from an asyncio pool. A task is only started
+once there is enough memory for it, so that not every worker loads its
+images at once, and each task appends to the status log in the same format
+as the array job script.
+"""
+
+import asyncio
+import os
+import shlex
+import signal
+import time
+from collections import deque, namedtuple
+
+from cptools2 import colours, cookiecutter, manifest, status, utils
+from cptools2.colours import pretty_print
+
+
+# memory (MB) reserved for each task if not told otherwise
+DEFAULT_TASK_MEMORY = 2048
+# return code recorded for a task which ran past its timeout, as in `timeout`
+TIMEOUT_RETURN_CODE = 124
+LOCAL_JOB_ID = "local"
+
+Summary = namedtuple("Summary", ["n_tasks", "n_finished", "n_failed", "n_imagesets", "elapsed"])
+
+
+def total_memory():
+    """total physical memory in MB, or None if it can't be determined"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024 ** 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def available_memory():
+    """currently available memory in MB from /proc/meminfo, or None"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class MemoryBudget(object):
+    """
+    Admit tasks while their combined memory reservations fit within a budget,
+    and the system reports enough memory available.
+
+    Parameters:
+    -----------
+    total: int
+        memory budget in MB
+    poll_interval: float (default = 1.0)
+        how often to re-check available memory while waiting, in seconds
+    check_available: Boolean (default = True)
+        whether to also check the system's available memory before admitting
+        a task, as other processes may be using it
+    """
+
+    def __init__(self, total, poll_interval=1.0, check_available=True):
+        self.total = total
+        self.reserved = 0
+        self.poll_interval = poll_interval
+        self.check_available = check_available
+        self._condition = None
+
+    def _fits(self, amount):
+        if self.reserved == 0:
+            # always admit a task if nothing else is running, otherwise a
+            # task bigger than the budget would never start
+            return True
+        if self.reserved + amount > self.total:
+            return False
+        if self.check_available:
+            available = available_memory()
+            if available is not None and available < amount:
+                return False
+        return True
+
+    async def acquire(self, amount):
+        """wait until `amount` MB can be reserved, then reserve it"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while not self._fits(amount):
+                try:
+                    await asyncio.wait_for(self._condition.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self.reserved += amount
+
+    async def release(self, amount):
+        """release a reservation made with `acquire`"""
+        async with self._condition:
+            self.reserved -= amount
+            self._condition.notify_all()
+
+
+class LocalExecutor(object):
+    """
+    Run tasks from the manifest in a pool of subprocesses.
+
+    Parameters:
+    -----------
+    tasks: list of manifest.Task
+    logfile_location: string
+        directory for the status log and each task's stdout/stderr
+    workers: int (default = 1)
+        maximum number of tasks to run at once
+    timeout: float (optional)
+        seconds before a task is killed and recorded as failed
+    memory: int (optional)
+        memory budget in MB for all running tasks, defaults to the
+        machine's total memory
+    task_memory: int (default = DEFAULT_TASK_MEMORY)
+        memory in MB reserved for each task
+    report_interval: float (default = 30)
+        seconds between progress reports, None to disable
+    """
+
+    def __init__(self, tasks, logfile_location, workers=1, timeout=None,
+                 memory=None, task_memory=DEFAULT_TASK_MEMORY, report_interval=30):
+        self.tasks = list(tasks)
+        self.logfile_location = logfile_location
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        if memory is None:
+            memory = total_memory() or task_memory * self.workers
+        self.budget = MemoryBudget(memory)
+        self.task_memory = task_memory
+        self.report_interval = report_interval
+        self.job_hex = cookiecutter.generate_random_hex()
+        self.log_path = os.path.join(logfile_location, "{}.log".format(self.job_hex))
+        self.output_dir = os.path.join(logfile_location, "analysis")
+        self.n_finished = 0
+        self.n_failed = 0
+        self.n_imagesets = 0
+        self.start_time = None
+
+    async def _run_task(self, task):
+        """run a single task, returning its return code"""
+        output_path = os.path.join(self.output_dir, "{}.o{}".format(task.name, task.task_id))
+        with open(output_path, "w") as output:
+            # split the same way as $CP_COMMAND in the array job script
+            # in its own session so the whole process group can be killed
+            proc = await asyncio.create_subprocess_exec(
+                *shlex.split(task.command), stdout=output, stderr=output,
+                start_new_session=True
+            )
+            try:
+                return await asyncio.wait_for(proc.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    proc.kill()
+                await proc.wait()
+                return TIMEOUT_RETURN_CODE
+
+    async def _worker(self, queue):
+        while queue:
+            task = queue.popleft()
+            await self.budget.acquire(self.task_memory)
+            try:
+                try:
+                    return_code = await self._run_task(task)
+                except OSError as err:
+                    pretty_print(colours.red("task {} failed to start: {}".format(task.task_id, err)))
+                    return_code = 127
+            finally:
+                await self.budget.release(self.task_memory)
+            if return_code == 0:
+                task_status = status.FINISHED
+                self.n_finished += 1
+                self.n_imagesets += task.n_imagesets
+            else:
+                task_status = "Failed with error code: {}".format(return_code)
+                self.n_failed += 1
+            status.append_status_line(
+                self.log_path,
+                status.format_status_line(LOCAL_JOB_ID, task.task_id, task_status)
+            )
+
+    def report(self):
+        """print the progress and throughput so far"""
+        elapsed = time.time() - self.start_time
+        n_done = self.n_finished + self.n_failed
+        rate = self.n_imagesets / elapsed if elapsed > 0 else 0.0
+        msg = "{}/{} tasks done, {} failed, {:.2f} imagesets/s".format(
+            n_done, len(self.tasks), self.n_failed, rate
+        )
+        if 0 < n_done < len(self.tasks):
+            eta = elapsed / n_done * (len(self.tasks) - n_done)
+            msg += ", ~{:.0f}s remaining".format(eta)
+        pretty_print(msg)
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report()
+
+    async def run(self):
+        """run all tasks, returning a Summary"""
+        self.start_time = time.time()
+        queue = deque(self.tasks)
+        utils.make_dir(self.output_dir)
+        reporter = None
+        if self.report_interval:
+            reporter = asyncio.ensure_future(self._reporter())
+        try:
+            await asyncio.gather(*[self._worker(queue) for _ in range(self.workers)])
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+        self.report()
+        return Summary(
+            n_tasks=len(self.tasks),
+            n_finished=self.n_finished,
+            n_failed=self.n_failed,
+            n_imagesets=self.n_imagesets,
+            elapsed=time.time() - self.start_time
+        )
+
+
+def run_local(commands_location, logfile_location, task_ids=None, **kwargs):
+    """
+    run the tasks in the manifest on the local machine
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the task manifest
+    logfile_location: string
+        directory for the status log and task output
+    task_ids: list of ints (optional)
+        only run these tasks from the manifest
+    **kwargs:
+        passed to LocalExecutor
+
+    Returns:
+    --------
+    Summary
+    """
+    tasks = manifest.read_manifest(commands_location)
+    if task_ids is not None:
+        task_ids = set(task_ids)
+        tasks = [task for task in tasks if task.task_id in task_ids]
+    executor = LocalExecutor(tasks, logfile_location, **kwargs)
+    manifest.add_job(commands_location, executor.job_hex)
+    loop = asyncio.new_event_loop()
+    # the child watcher for subprocesses needs the loop set as current
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(executor.run())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
@@ -0,0 +1,232 @@
+"""
+Task manifest written alongside the commands.
+
+The manifest is a tab-separated file with a line per task, describing the
+task's name, plate, number of imagesets, LoadData path, output location and
+cellprofiler command. Next to it is a fixed-width index containing the byte
+offset of each task's line, so a single task can be looked up without reading
+the manifest from the start, either from python or from the array job script.
+"""
+
+import os
+from collections import namedtuple
+
+
+MANIFEST_NAME = "task_manifest.txt"
+INDEX_NAME = "task_manifest.idx"
+# names of the status logs of the jobs run from the manifest
+JOBS_NAME = "task_manifest.jobs"
+# each index entry is a right-aligned byte offset followed by a newline,
+# padded with spaces rather than zeros so bash doesn't read it as octal
+INDEX_WIDTH = 16
+# the command is always the final column so it can be extracted with
+# `cut -f N-` even if it contains tabs
+FIELDS = ["task_id", "name", "plate", "n_imagesets", "loaddata", "output", "command"]
+INT_FIELDS = ["task_id", "n_imagesets"]
+
+Task = namedtuple("Task", FIELDS)
+
+
+def make_manifest_paths(commands_location):
+    """
+    create the paths to the manifest and its index
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the commands
+
+    Returns:
+    --------
+    Dictionary, {"manifest": path, "index": path}
+    """
+    return {
+        "manifest": os.path.join(commands_location, MANIFEST_NAME),
+        "index": os.path.join(commands_location, INDEX_NAME)
+    }
+
+
+def has_manifest(commands_location):
+    """whether `commands_location` contains a manifest and index"""
+    paths = make_manifest_paths(commands_location)
+    return all(os.path.isfile(i) for i in paths.values())
+
+
+def command_field():
+    """1-based column number of the command in the manifest, used by `cut`"""
+    return FIELDS.index("command") + 1
+
+
+def _format_offset(offset):
+    return "{:>{width}d}\n".format(offset, width=INDEX_WIDTH - 1)
+
+
+def _task_to_line(task):
+    values = [str(getattr(task, field)) for field in FIELDS]
+    for value in values[:-1]:
+        if "\t" in value or "\n" in value:
+            raise ManifestError("manifest values cannot contain tabs or newlines: '{}'".format(value))
+    return "\t".join(values) + "\n"
+
+
+def _line_to_task(line):
+    values = line.rstrip("\n").split("\t", len(FIELDS) - 1)
+    if len(values) != len(FIELDS):
+        raise ManifestError("malformed manifest line: '{}'".format(line))
+    task = Task(*values)
+    return task._replace(**{i: int(getattr(task, i)) for i in INT_FIELDS})
+
+
+def write_manifest(commands_location, tasks):
+    """
+    write the task manifest and byte-offset index to `commands_location`
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory in which to save the manifest
+    tasks: iterable of manifest.Task
+        tasks in the order they are run in the array job, task_id should
+        run from 1
+
+    Returns:
+    --------
+    int, number of tasks written
+    """
+    paths = make_manifest_paths(commands_location)
+    n_tasks = 0
+    # the jobs of an earlier manifest ran different tasks
+    jobs_path = os.path.join(commands_location, JOBS_NAME)
+    if os.path.isfile(jobs_path):
+        os.remove(jobs_path)
+    # write in binary so the offsets are in bytes, not characters
+    with open(paths["manifest"], "wb") as manifest, \
+            open(paths["index"], "wb") as index:
+        manifest.write(("#" + "\t".join(FIELDS) + "\n").encode("utf-8"))
+        for n_tasks, task in enumerate(tasks, 1):
+            if task.task_id != n_tasks:
+                err_msg = "task_id {} out of order, expected {}"
+                raise ManifestError(err_msg.format(task.task_id, n_tasks))
+            index.write(_format_offset(manifest.tell()).encode("utf-8"))
+            manifest.write(_task_to_line(task).encode("utf-8"))
+    return n_tasks
+
+
+def count_tasks(commands_location):
+    """number of tasks in the manifest, from the size of the index"""
+    index_path = make_manifest_paths(commands_location)["index"]
+    return os.path.getsize(index_path) // INDEX_WIDTH
+
+
+def read_task(commands_location, task_id):
+    """
+    look up a single task from the manifest
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the manifest
+    task_id: int
+        1-based task number, matching $SGE_TASK_ID
+
+    Returns:
+    --------
+    manifest.Task
+    """
+    paths = make_manifest_paths(commands_location)
+    if task_id < 1 or task_id > count_tasks(commands_location):
+        raise ManifestError("task_id {} not in manifest".format(task_id))
+    with open(paths["index"], "rb") as index:
+        index.seek((task_id - 1) * INDEX_WIDTH)
+        offset = int(index.read(INDEX_WIDTH))
+    with open(paths["manifest"], "rb") as manifest:
+        manifest.seek(offset)
+        line = manifest.readline().decode("utf-8")
+    return _line_to_task(line)
+
+
+def read_manifest(commands_location):
+    """
+    iterate through all tasks in the manifest
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the manifest
+
+    Returns:
+    --------
+    generator of manifest.Task
+    """
+    manifest_path = make_manifest_paths(commands_location)["manifest"]
+    with open(manifest_path, "r") as manifest:
+        for line in manifest:
+            if line.startswith("#") or line == "\n":
+                continue
+            yield _line_to_task(line)
+
+
+def add_job(commands_location, job_file):
+    """
+    record that a job runs tasks from the manifest
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the manifest
+    job_file: string
+        name of the job's status log, without the .log extension
+    """
+    with open(os.path.join(commands_location, JOBS_NAME), "a") as f:
+        f.write(job_file + "\n")
+
+
+def read_jobs(commands_location):
+    """
+    names of the status logs of the jobs recorded by `add_job`
+
+    Returns:
+    --------
+    list of strings, or None if no jobs have been recorded, for a manifest
+    written before jobs were recorded
+    """
+    path = os.path.join(commands_location, JOBS_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def write_task_list(path, task_ids):
+    """
+    write a task list, mapping array task numbers to task_ids in the manifest
+
+    The task list uses the same fixed-width format as the index, so the
+    array job can look up the task_id for $SGE_TASK_ID directly.
+
+    Parameters:
+    -----------
+    path: string
+        where to save the task list
+    task_ids: iterable of ints
+        task_ids from the manifest, in the order they should be run
+
+    Returns:
+    --------
+    int, number of tasks written
+    """
+    n_tasks = 0
+    with open(path, "w") as task_list:
+        for n_tasks, task_id in enumerate(task_ids, 1):
+            task_list.write(_format_offset(task_id))
+    return n_tasks
+
+
+def read_task_list(path):
+    """read the task_ids from a task list file"""
+    with open(path, "r") as task_list:
+        return [int(line) for line in task_list if line.strip()]
+
+
+class ManifestError(Exception):
+    pass
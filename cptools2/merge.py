@@ -0,0 +1,402 @@
+"""
+Merge the per-task CellProfiler spreadsheets into a Parquet file per plate
+for each object table (Image, Cells, Nuclei, ...).
+
+Each task's output is streamed through in chunks and appended to the plate's
+Parquet file, so memory use is bounded by the chunk size rather than by the
+size of the plate. Column types are decided from the column names where
+CellProfiler's naming gives them away, and from the first rows of each task
+otherwise, so every task and plate ends up with the same schema regardless
+of missing values, and text columns such as Experiment's Key and Value are
+kept as text. A numeric column with text further down is written again as
+text, rather than losing the values.
+
+Requires pyarrow.
+"""
+
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import pandas as _pd
+
+from cptools2 import commands, manifest, utils
+
+
+# columns with these prefixes hold text, everything else is numeric
+STRING_PREFIXES = ("Metadata_", "FileName_", "PathName_", "URL_", "MD5Digest_",
+                   "ObjectsFileName_", "ObjectsPathName_", "ObjectsURL_")
+INTEGER_COLUMNS = ("ImageNumber", "ObjectNumber", "Number_Object_Number")
+INTEGER_PREFIXES = ("Parent_", "Children_")
+# added to every table, as ImageNumber restarts from 1 in each task
+TASK_COLUMN = "task"
+DEFAULT_CHUNKSIZE = 100000
+# rows of each task read to decide the type of columns not known by name
+INFER_ROWS = 1000
+
+TaskOutput = namedtuple("TaskOutput", ["name", "plate", "output"])
+
+
+class NotNumericError(Exception):
+    """
+    a value of a column typed as numeric isn't a number, raised rather
+    than losing it
+    """
+
+    def __init__(self, column, value):
+        # kept as args so it can be raised from a worker process
+        super(NotNumericError, self).__init__(column, value)
+        self.column = column
+        self.value = value
+
+    def __str__(self):
+        return "column '{}' has a value which isn't a number: '{}'".format(
+            self.column, self.value
+        )
+
+
+def import_pyarrow():
+    """import pyarrow, with a helpful error message if it's not installed"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("merging to Parquet requires pyarrow: `pip install pyarrow`")
+    return pyarrow
+
+
+def discover_tasks(location, commands_location=None, layout="flat"):
+    """
+    find each task's plate and output directory
+
+    Uses the task manifest if there is one, otherwise the directories in
+    `location`/raw_data are matched against the job naming scheme from
+    `commands.task_name`.
+
+    Parameters:
+    -----------
+    location: string
+        location from the config, containing raw_data
+    commands_location: string (optional)
+        directory containing the task manifest
+    layout: string (default = "flat")
+        one of commands.LAYOUTS, how raw_data is split into
+        sub-directories, only used without a manifest
+
+    Returns:
+    --------
+    list of TaskOutput
+    """
+    if commands_location is not None and manifest.has_manifest(commands_location):
+        return [TaskOutput(i.name, i.plate, i.output)
+                for i in manifest.read_manifest(commands_location)]
+    raw_data = os.path.join(location, "raw_data")
+    return [TaskOutput(name, commands.split_task_name(name)[0], path)
+            for name, path in commands.find_task_directories(raw_data, layout)]
+
+
+def find_tables(tasks):
+    """
+    find the names of the tables written by the tasks, i.e the names of the
+    csv files in each task's output directory
+
+    Parameters:
+    -----------
+    tasks: list of TaskOutput
+
+    Returns:
+    --------
+    sorted list of table names, e.g ["Cells", "Image", "Nuclei"]
+    """
+    tables = set()
+    for task in tasks:
+        if os.path.isdir(task.output):
+            tables.update(
+                os.path.splitext(i)[0] for i in os.listdir(task.output) if i.endswith(".csv")
+            )
+    return sorted(tables)
+
+
+def table_path(task, table):
+    """path to a task's csv file for `table`"""
+    return os.path.join(task.output, table + ".csv")
+
+
+def column_type(column):
+    """
+    type of a CellProfiler output column, from its name
+
+    Returns:
+    --------
+    string, one of "string", "int", "float"
+    """
+    if column == TASK_COLUMN or column.startswith(STRING_PREFIXES):
+        return "string"
+    if column in INTEGER_COLUMNS or column.startswith(INTEGER_PREFIXES):
+        return "int"
+    return "float"
+
+
+def read_header(path):
+    """column names of a csv file, without reading the rest of the file"""
+    return list(_pd.read_csv(path, nrows=0).columns)
+
+
+def table_columns(tasks, table):
+    """
+    union of the columns in every task's csv file for `table`, in the order
+    they are first seen
+
+    Returns:
+    --------
+    list of column names, starting with TASK_COLUMN
+    """
+    columns = [TASK_COLUMN]
+    seen = set(columns)
+    for task in tasks:
+        path = table_path(task, table)
+        if os.path.isfile(path):
+            for column in read_header(path):
+                if column not in seen:
+                    seen.add(column)
+                    columns.append(column)
+    return columns
+
+
+def is_numeric(values):
+    """whether every non-missing value of a series can be read as a number"""
+    values = values.dropna()
+    return _pd.to_numeric(values, errors="coerce").notnull().all()
+
+
+def table_types(tasks, table, columns, nrows=INFER_ROWS):
+    """
+    type of each of a table's columns
+
+    Columns whose type isn't known from their name are numeric unless a
+    value in the first `nrows` rows of a task's csv file isn't a number, in
+    which case they are kept as text.
+
+    Returns:
+    --------
+    dictionary of column: one of "string", "int", "float"
+    """
+    types = {i: column_type(i) for i in columns}
+    unknown = set(i for i in columns if types[i] == "float")
+    for task in tasks:
+        path = table_path(task, table)
+        if not unknown or not os.path.isfile(path):
+            continue
+        usecols = [i for i in read_header(path) if i in unknown]
+        if not usecols:
+            continue
+        sample = _pd.read_csv(path, usecols=usecols, dtype=str, nrows=nrows)
+        for column in usecols:
+            if not is_numeric(sample[column]):
+                types[column] = "string"
+                unknown.discard(column)
+    return types
+
+
+def make_schema(columns, float32=False, types=None):
+    """pyarrow schema for the merged table, `types` from `table_types`"""
+    pyarrow = import_pyarrow()
+    if types is None:
+        types = {i: column_type(i) for i in columns}
+    pa_types = {
+        "string": pyarrow.string(),
+        "int": pyarrow.int64(),
+        "float": pyarrow.float32() if float32 else pyarrow.float64(),
+    }
+    return pyarrow.schema([(i, pa_types[types[i]]) for i in columns])
+
+
+def harmonise(dataframe, columns, float32=False, types=None):
+    """
+    conform a chunk of a task's output to the merged table's columns and types
+
+    Parameters:
+    -----------
+    dataframe: pandas.DataFrame
+    columns: list
+        columns of the merged table, missing columns are filled with nulls
+    float32: Boolean (default = False)
+        whether to downcast float columns to float32
+    types: dict (optional)
+        column: type, from `table_types`, defaults to `column_type` of
+        each column
+
+    Returns:
+    --------
+    pandas.DataFrame, raises a NotNumericError if a value of a numeric
+    column isn't a number
+    """
+    if types is None:
+        types = {i: column_type(i) for i in columns}
+    dataframe = dataframe.reindex(columns=columns)
+    float_dtype = "float32" if float32 else "float64"
+    for column in columns:
+        col_type = types[column]
+        if col_type == "string":
+            values = dataframe[column].astype(object)
+            dataframe[column] = values.where(values.isnull(), values.astype(str))
+            continue
+        numbers = _pd.to_numeric(dataframe[column], errors="coerce")
+        lost = numbers.isnull() & dataframe[column].notnull()
+        if lost.any():
+            raise NotNumericError(column, dataframe[column][lost].iloc[0])
+        if col_type == "int":
+            dataframe[column] = numbers.astype("Int64")
+        else:
+            dataframe[column] = numbers.astype(float_dtype)
+    return dataframe
+
+
+def iter_task_chunks(task, table, columns, float32=False, chunksize=DEFAULT_CHUNKSIZE,
+                     types=None):
+    """
+    read a task's csv file for `table` in chunks, harmonised to `columns`
+    and `types`
+
+    Returns:
+    --------
+    generator of pandas.DataFrame, nothing if the task has no such table
+    """
+    path = table_path(task, table)
+    if not os.path.isfile(path):
+        return
+    if types is None:
+        types = {i: column_type(i) for i in columns}
+    # read text columns as text, so values don't depend on missing values
+    string_cols = {i: str for i in columns if types[i] == "string"}
+    for chunk in _pd.read_csv(path, dtype=string_cols, chunksize=chunksize):
+        chunk[TASK_COLUMN] = task.name
+        yield harmonise(chunk, columns, float32, types)
+
+
+def write_parquet(tasks, table, columns, path, float32=False, chunksize=DEFAULT_CHUNKSIZE,
+                  types=None):
+    """
+    stream tasks' csv files for `table` into a single Parquet file, with
+    column types from `table_types` of the tasks unless given
+
+    The file is written to a temporary path and moved into place once
+    complete, so a partially written file is never left at `path`.
+
+    Returns:
+    --------
+    int, number of rows written. If `types` are given a NotNumericError is
+    raised for a numeric column with text in it, otherwise the file is
+    written again with that column as text.
+    """
+    pyarrow = import_pyarrow()
+    inferred = types is None
+    if inferred:
+        types = table_types(tasks, table, columns)
+    tmp_path = path + ".tmp"
+    while True:
+        schema = make_schema(columns, float32, types)
+        n_rows = 0
+        writer = pyarrow.parquet.ParquetWriter(tmp_path, schema)
+        try:
+            for task in tasks:
+                for chunk in iter_task_chunks(task, table, columns, float32, chunksize, types):
+                    writer.write_table(
+                        pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                    )
+                    n_rows += chunk.shape[0]
+        except NotNumericError as err:
+            writer.close()
+            os.remove(tmp_path)
+            if not inferred:
+                raise
+            types = dict(types, **{err.column: "string"})
+            continue
+        except BaseException:
+            writer.close()
+            raise
+        writer.close()
+        break
+    os.replace(tmp_path, path)
+    return n_rows
+
+
+def plate_partition(out_dir, table, plate):
+    """directory for a plate's Parquet files, hive-partitioned by plate"""
+    return os.path.join(out_dir, table, "plate={}".format(plate))
+
+
+def _merge_plate(args):
+    """merge one table for one plate, run in a worker process"""
+    table, plate, tasks, columns, types, out_dir, float32, chunksize = args
+    partition = plate_partition(out_dir, table, plate)
+    utils.make_dir(partition)
+    path = os.path.join(partition, "{}.parquet".format(plate))
+    n_rows = write_parquet(tasks, table, columns, path, float32, chunksize, types)
+    return table, plate, n_rows
+
+
+def group_by_plate(tasks):
+    """dictionary of plate: [tasks], in task order"""
+    plates = dict()
+    for task in tasks:
+        plates.setdefault(task.plate, []).append(task)
+    return plates
+
+
+def merge(tasks, out_dir, tables=None, workers=None, float32=False,
+          chunksize=DEFAULT_CHUNKSIZE):
+    """
+    merge the tasks' csv files into a Parquet file per table per plate
+
+    Output is written to `out_dir`/<table>/plate=<plate>/<plate>.parquet
+
+    Parameters:
+    -----------
+    tasks: list of TaskOutput
+    out_dir: string
+        directory to write the Parquet files to
+    tables: list of strings (optional)
+        names of tables to merge, defaults to every table found
+    workers: int (optional)
+        number of processes, defaults to the number of cpus
+    float32: Boolean (default = False)
+        whether to downcast float columns to float32
+    chunksize: int
+        number of rows to read from a csv file at a time
+
+    Returns:
+    --------
+    list of (table, plate, number of rows)
+    """
+    import_pyarrow()
+    if tables is None:
+        tables = find_tables(tasks)
+    plates = group_by_plate(tasks)
+
+    def submit(executor, table, columns, types):
+        return [executor.submit(_merge_plate, (table, plate, plates[plate], columns, types,
+                                               out_dir, float32, chunksize))
+                for plate in sorted(plates)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for table in tables:
+            # the same columns and types for every plate so they can be read
+            # as one dataset
+            columns = table_columns(tasks, table)
+            types = table_types(tasks, table, columns)
+            pending.append((table, columns, types, submit(executor, table, columns, types)))
+        while pending:
+            table, columns, types, futures = pending.pop(0)
+            # every plate is finished with before any is written again
+            wait(futures)
+            try:
+                results.extend([future.result() for future in futures])
+            except NotNumericError as err:
+                # text past the rows types were inferred from, every plate
+                # is written again with the column as text
+                types = dict(types, **{err.column: "string"})
+                pending.append((table, columns, types, submit(executor, table, columns, types)))
+    return results
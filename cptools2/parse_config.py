@@ -2,6 +2,11 @@ import os
 import collections
 import yaml
 
+from cptools2 import commands
+from cptools2 import cookiecutter
+from cptools2 import cppipe
+from cptools2 import job
+
 
 class Config:
     """class for cptools2 configuration"""
@@ -15,8 +20,23 @@ class Config:
         self.chunk = self.get_chunk()
         self.add_plate = self.get_add_plate()
         self.remove_plate = self.get_remove_plate()
+        self.plates = self.get_filter("plates")
+        self.wells = self.get_filter("wells")
+        self.sites = self.get_filter("sites")
         self.microscope = self.get_microscope()
         self.channels = self.get_channels()
+        self.prune_channels = self.get_prune_channels()
+        self.task_order = self.get_task_order()
+        self.layout = self.get_layout()
+        self.incomplete = self.get_incomplete()
+        self.canary = self.get_canary()
+        self.circuit_breaker = self.get_circuit_breaker()
+        self.resources = self.get_resources()
+        self.validate = self.get_validate()
+        self.result_cache = self.get_result_cache()
+        self.distributed_scan = self.get_distributed_scan()
+        self.scheduler = self.get_scheduler()
+        self.max_running = self.get_max_running()
 
     def open_yaml(self):
         with open(self.yaml_path, "r") as f:
@@ -36,8 +56,23 @@ class Config:
             "commands location",
             "remove plate",
             "add plate",
+            "plates",
+            "wells",
+            "sites",
             "microscope",
             "channels",
+            "prune channels",
+            "task order",
+            "layout",
+            "incomplete imagesets",
+            "canary",
+            "circuit breaker",
+            "resources",
+            "validate",
+            "result cache",
+            "distributed scan",
+            "scheduler",
+            "max running tasks",
         ])
         bad_arguments = []
         for argument in self.config_dict.keys():
@@ -62,27 +97,76 @@ class Config:
             return int(chunk_arg)
 
     def get_add_plate(self):
+        """
+        list of {"exp_dir": experiment, "plates": [plates]}, one for each
+        experiment in `add plate`, in the order they are listed.
+
+        Each `experiment` starts a new entry, and the `plates` after it
+        belong to that experiment.
+        """
         if "add plate" in self.config_dict:
             add_plate_dicts = self.config_dict["add plate"]
-            # returns a list of dictionaries
-            if isinstance(add_plate_dicts, list):
-                for d in add_plate_dicts:
-                    if "experiment" in d.keys():
-                        # is the experiment label
-                        experiment = str(d["experiment"])
-                    if "plates" in d.keys():
-                        # is the plates, either a string or a list
-                        plate_args = d["plates"]
-                        if isinstance(plate_args, str):
-                            plates = [d["plates"]]
-                        if isinstance(plate_args, list):
-                            plates = d["plates"]
-            return {"exp_dir": experiment, "plates": plates}
+            if isinstance(add_plate_dicts, dict):
+                add_plate_dicts = [add_plate_dicts]
+            add_plates = []
+            for d in add_plate_dicts:
+                if "experiment" in d.keys():
+                    # is the experiment label
+                    add_plates.append({"exp_dir": str(d["experiment"]), "plates": []})
+                if "plates" in d.keys():
+                    if len(add_plates) == 0:
+                        raise ValueError("'add plate' has plates before an experiment")
+                    # is the plates, either a string or a list
+                    plate_args = d["plates"]
+                    if isinstance(plate_args, str):
+                        plate_args = [plate_args]
+                    add_plates[-1]["plates"].extend(plate_args)
+            return add_plates
 
     def get_remove_plate(self):
         # can either be a string or a list in Job.remove_plate
         return self.config_dict.get("remove plate")
 
+    def get_filter(self, key):
+        """
+        {"include": list, "exclude": list} for the `plates`, `wells` or
+        `sites` filters, or None. A plain list is an include list.
+        """
+        value = self.config_dict.get(key)
+        if value is None:
+            return None
+        if not isinstance(value, list):
+            value = [value]
+        if all(isinstance(i, dict) for i in value):
+            value = dict(collections.ChainMap(*value))
+        else:
+            value = {"include": value}
+        bad_arguments = set(value.keys()) - set(["include", "exclude"])
+        if len(bad_arguments) > 0:
+            err_msg = "Invalid {} argument(s): {}, options = ['include', 'exclude']"
+            raise ValueError(err_msg.format(key, sorted(bad_arguments)))
+        filters = dict()
+        for name, patterns in value.items():
+            if patterns is None:
+                continue
+            filters[name] = patterns if isinstance(patterns, list) else [patterns]
+        return filters
+
+    def image_filter_args(self):
+        """keyword arguments for filelist.ImageFilter"""
+        return {"plates": self.plates, "wells": self.wells, "sites": self.sites}
+
+    def removed_plates(self):
+        """
+        list of the plate names in `remove plate`, to leave out of
+        `experiment` before they're scanned, but not out of `add plate`
+        """
+        if self.remove_plate is None:
+            return []
+        if isinstance(self.remove_plate, str):
+            return [self.remove_plate]
+        return [str(i) for i in self.remove_plate]
+
     def get_microscope(self):
         return self.config_dict.get("microscope")
 
@@ -97,6 +181,251 @@ class Config:
                 channels = {abs(k):v for k,v in channels.items()}
         return channels
 
+    def get_prune_channels(self):
+        prune_arg = self.config_dict.get("prune channels", False)
+        if isinstance(prune_arg, list):
+            prune_arg = prune_arg[0]
+        if not isinstance(prune_arg, bool):
+            err_msg = "'prune channels' has to be true or false, got '{}'"
+            raise ValueError(err_msg.format(prune_arg))
+        return prune_arg
+
+    def get_task_order(self):
+        task_order = self.config_dict.get("task order", "plate")
+        if isinstance(task_order, list):
+            task_order = task_order[0]
+        task_order = str(task_order).strip().lower()
+        if task_order not in job.TASK_ORDERS:
+            err_msg = "Invalid task order '{}', options = {}"
+            raise ValueError(err_msg.format(task_order, job.TASK_ORDERS))
+        return task_order
+
+    def get_layout(self):
+        """
+        how the loaddata, raw_data and img_data directories are split into
+        sub-directories, one of commands.LAYOUTS
+        """
+        layout = self.config_dict.get("layout", "flat")
+        if isinstance(layout, list):
+            layout = layout[0]
+        layout = str(layout).strip().lower()
+        if layout not in commands.LAYOUTS:
+            err_msg = "Invalid layout '{}', options = {}"
+            raise ValueError(err_msg.format(layout, commands.LAYOUTS))
+        return layout
+
+    def get_incomplete(self):
+        """
+        what to do with imagesets missing an image from a channel, "fail"
+        (default) or "drop"
+        """
+        incomplete = self.config_dict.get("incomplete imagesets", "fail")
+        if isinstance(incomplete, list):
+            incomplete = incomplete[0]
+        incomplete = str(incomplete).strip().lower()
+        valid_policies = ["fail", "drop"]
+        if incomplete not in valid_policies:
+            err_msg = "Invalid incomplete imagesets option '{}', options = {}"
+            raise ValueError(err_msg.format(incomplete, valid_policies))
+        return incomplete
+
+    def get_canary(self):
+        """
+        how to pick canary tasks, "plate" or "layout", or None to not run
+        canary tasks. `canary: true` is the same as "plate".
+        """
+        canary = self.config_dict.get("canary")
+        if isinstance(canary, list):
+            canary = canary[0]
+        if canary is None or canary is False:
+            return None
+        if canary is True:
+            return "plate"
+        canary = str(canary).strip().lower()
+        if canary not in ["plate", "layout"]:
+            err_msg = "Invalid canary option '{}', options = ['plate', 'layout']"
+            raise ValueError(err_msg.format(canary))
+        return canary
+
+    def get_circuit_breaker(self):
+        """
+        {"failures": int, "window": int or None, "hook": string or None}, or
+        None if there's no circuit breaker. `circuit breaker: 10` is the
+        same as `failures: 10`.
+        """
+        breaker = self.config_dict.get("circuit breaker")
+        if breaker is None:
+            return None
+        if isinstance(breaker, int) and not isinstance(breaker, bool):
+            breaker = {"failures": breaker}
+        elif isinstance(breaker, list):
+            breaker = dict(collections.ChainMap(*breaker))
+        if not isinstance(breaker, dict) or "failures" not in breaker:
+            raise ValueError("'circuit breaker' needs a number of 'failures'")
+        bad_arguments = set(breaker.keys()) - set(["failures", "window", "hook"])
+        if len(bad_arguments) > 0:
+            err_msg = "Invalid circuit breaker argument(s): {}"
+            raise ValueError(err_msg.format(sorted(bad_arguments)))
+        failures = int(breaker["failures"])
+        window = breaker.get("window")
+        window = failures if window is None else int(window)
+        if failures < 1 or window < failures:
+            err_msg = "circuit breaker needs 1 <= failures <= window, got {} and {}"
+            raise ValueError(err_msg.format(failures, window))
+        return {"failures": failures, "window": window, "hook": breaker.get("hook")}
+
+    def get_resources(self):
+        """
+        keyword arguments for `resources.estimate_job`, or None to not
+        estimate the memory and run time of the tasks. `resources: true`
+        uses the default estimates.
+        """
+        resources = self.config_dict.get("resources")
+        if resources is None or resources is False:
+            return None
+        if resources is True:
+            return dict()
+        if isinstance(resources, list):
+            resources = dict(collections.ChainMap(*resources))
+        if not isinstance(resources, dict):
+            raise ValueError("'resources' should be true, false or a list of options")
+        valid_args = [
+            "memory headroom", "runtime headroom", "base memory",
+            "image copies", "seconds per megapixel", "startup seconds", "sample"
+        ]
+        bad_arguments = set(resources.keys()) - set(valid_args)
+        if len(bad_arguments) > 0:
+            err_msg = "Invalid resources argument(s): {}"
+            raise ValueError(err_msg.format(sorted(bad_arguments)))
+        kwargs = dict()
+        for key, value in resources.items():
+            cast = int if key == "sample" else float
+            kwargs[key.replace(" ", "_")] = cast(value)
+        return kwargs
+
+    def get_validate(self):
+        """
+        keyword arguments for `validate.validate_job`, or None to not check
+        the images. `validate: true` checks every image.
+        """
+        validate = self.config_dict.get("validate")
+        if validate is None or validate is False:
+            return None
+        if validate is True:
+            return dict()
+        if isinstance(validate, list):
+            validate = dict(collections.ChainMap(*validate))
+        if not isinstance(validate, dict):
+            raise ValueError("'validate' should be true, false or a list of options")
+        bad_arguments = set(validate.keys()) - set(["sample", "workers"])
+        if len(bad_arguments) > 0:
+            err_msg = "Invalid validate argument(s): {}"
+            raise ValueError(err_msg.format(sorted(bad_arguments)))
+        kwargs = dict()
+        if "sample" in validate:
+            kwargs["sample"] = float(validate["sample"])
+            if not 0 < kwargs["sample"] <= 1:
+                raise ValueError("validate sample should be a fraction between 0 and 1")
+        if "workers" in validate:
+            kwargs["workers"] = int(validate["workers"])
+        return kwargs
+
+    def get_result_cache(self):
+        """
+        keyword arguments for `result_cache.mark_cached_tasks`, or None to
+        run every task. `result cache: true` skips the tasks with cached
+        results.
+        """
+        cache = self.config_dict.get("result cache")
+        if cache is None or cache is False:
+            return None
+        if cache is True:
+            return dict()
+        if isinstance(cache, list):
+            cache = dict(collections.ChainMap(*cache))
+        if not isinstance(cache, dict):
+            raise ValueError("'result cache' should be true, false or a list of options")
+        bad_arguments = set(cache.keys()) - set(["workers"])
+        if len(bad_arguments) > 0:
+            err_msg = "Invalid result cache argument(s): {}"
+            raise ValueError(err_msg.format(sorted(bad_arguments)))
+        kwargs = dict()
+        if "workers" in cache:
+            kwargs["workers"] = int(cache["workers"])
+        return kwargs
+
+    def get_distributed_scan(self):
+        """
+        keyword arguments for `scan.make_scan_scripts`, or None to list the
+        images from this machine. `distributed scan: true` uses
+        scan.DEFAULT_TASKS scan tasks, and a number sets the number of
+        tasks.
+        """
+        scan_arg = self.config_dict.get("distributed scan")
+        if scan_arg is None or scan_arg is False:
+            return None
+        if scan_arg is True:
+            scan_arg = dict()
+        elif isinstance(scan_arg, int):
+            scan_arg = {"tasks": scan_arg}
+        elif isinstance(scan_arg, list):
+            scan_arg = dict(collections.ChainMap(*scan_arg))
+        if not isinstance(scan_arg, dict):
+            raise ValueError("'distributed scan' should be true, false, a number or a list of options")
+        valid_args = [
+            "tasks", "max running tasks", "runtime", "memory", "reduce runtime",
+            "reduce memory"
+        ]
+        bad_arguments = set(scan_arg.keys()) - set(valid_args)
+        if len(bad_arguments) > 0:
+            err_msg = "Invalid distributed scan argument(s): {}"
+            raise ValueError(err_msg.format(sorted(bad_arguments)))
+        from cptools2 import scan
+        kwargs = {"n_tasks": int(scan_arg.get("tasks", scan.DEFAULT_TASKS))}
+        if kwargs["n_tasks"] < 1:
+            raise ValueError("distributed scan tasks should be at least 1")
+        if "max running tasks" in scan_arg:
+            kwargs["max_running"] = int(scan_arg["max running tasks"])
+        for key in ["runtime", "memory", "reduce runtime", "reduce memory"]:
+            if key in scan_arg:
+                kwargs[key.replace(" ", "_")] = str(scan_arg[key])
+        return kwargs
+
+    def get_used_channels(self):
+        """
+        channel numbers used by the pipeline, so the images of other
+        channels can be dropped when listing files.
+
+        None if `prune channels` is false, or the channels used can't be
+        worked out from the pipeline, in which case every channel is kept.
+        """
+        if not self.prune_channels:
+            return None
+        pipeline = self.get_pipeline()
+        if pipeline is None:
+            return None
+        try:
+            return cppipe.used_channels(pipeline, self.channels)
+        except cppipe.PipelineError:
+            return None
+
+    def get_scheduler(self):
+        scheduler = self.config_dict.get("scheduler", "sge")
+        if isinstance(scheduler, list):
+            scheduler = scheduler[0]
+        scheduler = str(scheduler).strip().lower()
+        if scheduler not in cookiecutter.SCRIPT_CLASSES:
+            err_msg = "Invalid scheduler '{}', options = {}"
+            raise ValueError(err_msg.format(scheduler, sorted(cookiecutter.SCRIPT_CLASSES)))
+        return scheduler
+
+    def get_max_running(self):
+        if "max running tasks" in self.config_dict:
+            max_running_arg = self.config_dict["max running tasks"]
+            if isinstance(max_running_arg, list):
+                max_running_arg = max_running_arg[0]
+            return int(max_running_arg)
+
     def get_pipeline(self):
         if "pipeline" in self.config_dict:
             pipeline_arg = self.config_dict["pipeline"]
@@ -132,7 +461,10 @@ class Config:
             "location": location,
             "commands_location": commands_location,
             "job_size": job_size,
-            "channel_dict": channel_dict
+            "channel_dict": channel_dict,
+            "task_order": self.task_order,
+            "layout": self.layout,
+            "incomplete": self.incomplete
         }
         return command_args
 
@@ -88,6 +88,28 @@ class MetadataParser(object):
         else:
             raise RuntimeError()
 
+    def parse_well_site(self, x):
+        """
+        just the well and site of a filepath, cheaper than parsing all of
+        the metadata for filtering images
+
+        Returns:
+        --------
+        tuple of (well: string, site: int)
+        """
+        final_path = os.path.basename(x)
+        if self.microscope == "imagexpress":
+            parts = final_path.split("_")
+            return parts[1], int("".join(i for i in parts[2] if i.isdigit()))
+        elif self.microscope == "yokogawa":
+            plate, well, rest = final_path.split("_")
+            return well, int(rest[6:9])
+        elif self.microscope == "opera":
+            well = self.row_column_to_well(int(final_path[1:3]), int(final_path[4:6]))
+            return well, int(final_path.split("-")[1])
+        else:
+            raise RuntimeError()
+
     def parse_ix(self, x):
         """parse metadata from an MolDev Imagexpress filepath"""
         final_path = os.path.basename(x)
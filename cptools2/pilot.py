@@ -0,0 +1,223 @@
+"""
+Pilot runs, to measure what a pipeline costs per imageset before the full
+run.
+
+A stratified random sample of imagesets is taken from every plate, spread
+over as many wells as possible, and run as a small array job of its own in
+`location`/pilot. Once it has finished the runtime records of its tasks (see
+`runtime`) are read back to recommend a chunk size, `h_rt` and memory
+request for the full run.
+"""
+
+import json
+import math
+import os
+import random
+from collections import namedtuple
+
+from cptools2 import runtime
+from cptools2 import splitter
+from cptools2 import utils
+
+
+PILOT_DIR = "pilot"
+PILOT_INFO = "pilot.json"
+# how long a task of the full run should take
+DEFAULT_TARGET_SECONDS = 3600
+# head room on top of the slowest / largest pilot task
+RUNTIME_MARGIN = 1.5
+MEMORY_MARGIN = 1.25
+# memory is requested in multiples of this many MB
+MEMORY_STEP = 512
+
+Recommendation = namedtuple("Recommendation", [
+    "n_tasks", "overhead_seconds", "seconds_per_imageset", "chunk", "h_rt",
+    "memory_mb", "total_imagesets", "cpu_hours"
+])
+
+
+def pilot_locations(location, commands_location):
+    """
+    where a pilot job is written, alongside the full job
+
+    Returns:
+    --------
+    tuple of (location, commands_location, logfile_location)
+    """
+    pilot_location = os.path.join(location, PILOT_DIR)
+    return (
+        pilot_location,
+        os.path.join(commands_location, PILOT_DIR),
+        os.path.join(pilot_location, "logfiles")
+    )
+
+
+def sample_imagesets(img_list, microscope, fraction, rng):
+    """
+    stratified random sample of the imagesets in a plate
+
+    Sites are taken a well at a time in a random order, the first site of
+    every well before a second site of any, so the sample covers as many
+    wells as possible.
+
+    Parameters:
+    -----------
+    img_list: list
+        image paths from a plate
+    microscope: string
+    fraction: float
+        fraction of imagesets (well and site) to keep, at least one is kept
+    rng: random.Random
+
+    Returns:
+    --------
+    tuple of (list of the image paths of the sampled imagesets, number of
+    imagesets sampled, number of imagesets in the plate)
+    """
+    df_img = splitter._well_site_table(img_list, microscope)
+    sites = dict()
+    for well, site in df_img[["Metadata_well", "Metadata_site"]].drop_duplicates().itertuples(index=False):
+        sites.setdefault(well, []).append(site)
+    n_imagesets = sum(len(i) for i in sites.values())
+    n_sample = min(n_imagesets, max(1, int(math.ceil(fraction * n_imagesets))))
+    wells = sorted(sites)
+    rng.shuffle(wells)
+    for well in wells:
+        sites[well] = sorted(sites[well])
+        rng.shuffle(sites[well])
+    sample = set()
+    depth = 0
+    while len(sample) < n_sample:
+        for well in wells:
+            if depth < len(sites[well]) and len(sample) < n_sample:
+                sample.add((well, sites[well][depth]))
+        depth += 1
+    keep = [(well, site) in sample for well, site in
+            zip(df_img["Metadata_well"], df_img["Metadata_site"])]
+    return list(df_img["path"][keep]), n_sample, n_imagesets
+
+
+def sample_job(jobber, fraction, seed=None):
+    """
+    replace the images of each plate in a job with a sample of its
+    imagesets, before the job is chunked
+
+    Parameters:
+    -----------
+    jobber: job.Job
+    fraction: float
+    seed: int (optional)
+
+    Returns:
+    --------
+    tuple of (number of imagesets sampled, total number of imagesets)
+    """
+    rng = random.Random(seed)
+    n_sampled = 0
+    n_total = 0
+    # sorted so the sample only depends on the seed
+    for plate in sorted(jobber.plate_store):
+        img_list = jobber.plate_store[plate][1]
+        sampled, n_sample, n_imagesets = sample_imagesets(
+            img_list, jobber.microscope, fraction, rng
+        )
+        jobber.plate_store[plate][1] = sampled
+        n_sampled += n_sample
+        n_total += n_imagesets
+    return n_sampled, n_total
+
+
+def write_pilot_info(commands_location, fraction, n_sampled, n_total):
+    """record what was sampled, so the recommendation can estimate the full run"""
+    info = {"fraction": fraction, "n_sampled": n_sampled, "n_total": n_total}
+    with open(os.path.join(commands_location, PILOT_INFO), "w") as f:
+        json.dump(info, f)
+
+
+def read_pilot_info(commands_location):
+    """the dictionary written by `write_pilot_info`, or None"""
+    path = os.path.join(commands_location, PILOT_INFO)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def fit_task_seconds(records):
+    """
+    fit task seconds = overhead + seconds_per_imageset * imagesets by least
+    squares, falling back to no overhead if the tasks are all the same size
+    or the fit isn't physical
+
+    Returns:
+    --------
+    tuple of (overhead_seconds, seconds_per_imageset)
+    """
+    sizes = [i["n_imagesets"] for i in records]
+    seconds = [runtime.task_seconds(i) for i in records]
+    n = float(len(records))
+    mean_size = sum(sizes) / n
+    mean_seconds = sum(seconds) / n
+    var_size = sum((i - mean_size) ** 2 for i in sizes)
+    if var_size > 0:
+        covar = sum((i - mean_size) * (j - mean_seconds) for i, j in zip(sizes, seconds))
+        slope = covar / var_size
+        overhead = mean_seconds - slope * mean_size
+        if slope > 0 and overhead >= 0:
+            return overhead, slope
+    return 0.0, runtime.percentile([j / float(i) for i, j in zip(sizes, seconds)], 50)
+
+
+def recommend(records, target_seconds=DEFAULT_TARGET_SECONDS, total_imagesets=None):
+    """
+    recommend a chunk size, runtime and memory request for the full run
+    from the runtime records of a pilot run
+
+    The chunk is sized so a task at the 90th percentile of seconds per
+    imageset takes `target_seconds`. `h_rt` allows the slowest pilot
+    imageset rate across the whole chunk, with RUNTIME_MARGIN on top, and
+    memory is the largest pilot task's peak with MEMORY_MARGIN on top.
+
+    Parameters:
+    -----------
+    records: list of dictionaries
+        from `runtime.read_runtime_records`
+    target_seconds: number
+        how long each task of the full run should take
+    total_imagesets: int (optional)
+        imagesets in the full run, to estimate its cpu hours
+
+    Returns:
+    --------
+    Recommendation, or None if no pilot tasks finished
+    """
+    finished = [i for i in runtime.latest_records(records)
+                if i["return_code"] == 0 and i["n_imagesets"] > 0]
+    if not finished:
+        return None
+    overhead, per_imageset = fit_task_seconds(finished)
+    rates = [max(runtime.task_seconds(i) - overhead, 0) / float(i["n_imagesets"])
+             for i in finished]
+    rate_p90 = max(runtime.percentile(rates, 90), per_imageset)
+    chunk = max(1, int((target_seconds - overhead) / rate_p90)) if rate_p90 > 0 else None
+    h_rt = None
+    if chunk is not None:
+        h_rt = utils.format_h_rt((overhead + chunk * max(rates)) * RUNTIME_MARGIN)
+    memory = [i["max_rss_kb"] / 1024.0 for i in finished if i.get("max_rss_kb") is not None]
+    memory_mb = None
+    if memory:
+        memory_mb = int(math.ceil(max(memory) * MEMORY_MARGIN / MEMORY_STEP)) * MEMORY_STEP
+    cpu_hours = None
+    if total_imagesets is not None and chunk is not None:
+        n_tasks = int(math.ceil(total_imagesets / float(chunk)))
+        cpu_hours = (n_tasks * overhead + total_imagesets * per_imageset) / 3600.0
+    return Recommendation(
+        n_tasks=len(finished),
+        overhead_seconds=overhead,
+        seconds_per_imageset=per_imageset,
+        chunk=chunk,
+        h_rt=h_rt,
+        memory_mb=memory_mb,
+        total_imagesets=total_imagesets,
+        cpu_hours=cpu_hours
+    )
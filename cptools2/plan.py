@@ -0,0 +1,346 @@
+"""
+Plan a job's tasks without writing anything to disk.
+
+A Plan iterates over the tasks of a job.Job, building each plate's LoadData
+dataframes only when its tasks are reached, and yields each task's manifest
+entry and command along with its LoadData rows on demand. Where the tasks go
+is up to the caller: a sink such as FileSink (what `Job.create_commands`
+writes), BufferSink (in memory) or SQLiteSink (a database), or the caller's
+own object with the same `open`, `add` and `close` methods.
+
+    >>> jobber = job.Job("yokogawa")
+    >>> jobber.add_experiment("/path/to/experiment")
+    >>> jobber.chunk(96)
+    >>> job_plan = plan.Plan(jobber, "pipeline.cppipe", "/scratch/location")
+    >>> for task in job_plan:
+    ...     print(task.task.command)
+    ...     rows = list(task.rows())
+    >>> job_plan.write(plan.SQLiteSink("plan.sqlite"))
+
+Nothing is printed, and no directories are created until a FileSink is
+used.
+"""
+
+import sqlite3
+
+from cptools2 import commands
+from cptools2 import job
+from cptools2 import loaddata
+from cptools2 import manifest
+from cptools2 import profiling
+from cptools2 import utils
+
+
+class PlannedTask(object):
+    """
+    A task of a Plan.
+
+    Attributes:
+    -----------
+    task: manifest.Task
+        the task's manifest entry, including its command
+    """
+
+    def __init__(self, task, dataframe, location, layout="flat"):
+        self.task = task
+        self._dataframe = dataframe
+        self._location = location
+        self._layout = layout
+
+    def loaddata(self):
+        """
+        the task's LoadData dataframe, with the paths pointing to where the
+        images are staged, as written to the LoadData csv file
+        """
+        return utils.prefix_filepaths(
+            self._dataframe.copy(),
+            commands.task_relpath(self.task.name, self._layout),
+            self._location
+        )
+
+    def rows(self):
+        """generator of the task's LoadData rows, as dictionaries"""
+        dataframe = self.loaddata()
+        columns = list(dataframe.columns)
+        for row in dataframe.itertuples(index=False, name=None):
+            yield dict(zip(columns, row))
+
+    def __repr__(self):
+        return "PlannedTask: task_id={}, name={}".format(self.task.task_id, self.task.name)
+
+
+class Plan(object):
+    """
+    Lazy plan of the tasks of a job.
+
+    Parameters:
+    -----------
+    jobber: job.Job
+        with plates added, and chunked. If the LoadData dataframes haven't
+        been created yet, each plate's are created as its tasks are
+        reached and not kept.
+    pipeline: string
+        path to the cellprofiler pipeline
+    location: string
+        where the loaddata, images and results will be stored
+    job_size: int (optional)
+        the chunk size, to check the dataframes have the expected number of
+        rows
+    channel_dict: dictionary (optional)
+        channel number: name, see `loaddata.cast_dataframe`
+    task_order: string (default = "plate")
+        one of job.TASK_ORDERS. Anything other than "plate" needs every
+        task's cost, so the whole plan is built before the first task.
+    layout: string (default = "flat")
+        one of commands.LAYOUTS
+    incomplete: string (default = "fail")
+        one of loaddata.INCOMPLETE_POLICIES, imagesets missing a channel
+        either raise a LoadDataError when their plate is reached or are
+        left out, and are kept in `self.incomplete` either way
+    """
+
+    def __init__(self, jobber, pipeline, location, job_size=None, channel_dict=None,
+                 task_order="plate", layout="flat", incomplete="fail"):
+        if task_order not in job.TASK_ORDERS:
+            err_msg = "unknown task order '{}', options = {}"
+            raise ValueError(err_msg.format(task_order, job.TASK_ORDERS))
+        commands.check_layout(layout)
+        if incomplete not in loaddata.INCOMPLETE_POLICIES:
+            err_msg = "unknown incomplete imageset policy '{}', options = {}"
+            raise ValueError(err_msg.format(incomplete, loaddata.INCOMPLETE_POLICIES))
+        self.jobber = jobber
+        self.pipeline = pipeline
+        self.location = location
+        self.job_size = job_size
+        self.channel_dict = channel_dict
+        self.task_order = task_order
+        self.layout = layout
+        self.incomplete_policy = incomplete
+        self.incomplete = []
+
+    def _plate_dataframes(self, plate):
+        """a plate's LoadData dataframes, from the job or created now"""
+        if self.jobber.has_loaddata:
+            dataframes = self.jobber.loaddata_store[plate]
+            return dataframes if isinstance(dataframes, list) else [dataframes]
+        dataframes, incomplete = self.jobber.plate_loaddata(
+            plate, self.channel_dict, self.job_size
+        )
+        if incomplete and self.incomplete_policy == "fail":
+            err_msg = "{} imageset(s) in plate {} are missing images"
+            raise loaddata.LoadDataError(err_msg.format(len(incomplete), plate))
+        self.incomplete.extend(incomplete)
+        return dataframes
+
+    def _make_task(self, task_id, plate, job_num, dataframe):
+        name = commands.task_name(plate, job_num)
+        output_loc = commands.output_path(name, self.location, self.layout)
+        task = manifest.Task(
+            task_id=task_id,
+            name=name,
+            plate=plate,
+            n_imagesets=dataframe.shape[0],
+            loaddata=commands.loaddata_path(name, self.location, self.layout),
+            output=output_loc,
+            command=commands.make_cp_cmnd(
+                name=name, pipeline=self.pipeline, location=self.location,
+                output_loc=output_loc, layout=self.layout
+            )
+        )
+        return PlannedTask(task, dataframe, self.location, self.layout)
+
+    def _plate_ordered(self):
+        task_id = 0
+        for plate in sorted(self.jobber.plate_store):
+            for job_num, dataframe in enumerate(self._plate_dataframes(plate)):
+                task_id += 1
+                yield self._make_task(task_id, plate, job_num, dataframe)
+
+    def tasks(self):
+        """
+        generator of PlannedTask, in the order of the array job
+
+        Returns:
+        --------
+        generator of PlannedTask
+        """
+        if self.task_order == "plate":
+            for task in self._plate_ordered():
+                yield task
+            return
+        tasks = list(self._plate_ordered())
+        costs = [job.task_cost(i._dataframe, self.task_order,
+                               self.jobber.plate_store[i.task.plate][0])
+                 for i in tasks]
+        # stable, so tasks of equal cost stay in plate order
+        order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+        for task_id, i in enumerate(order, 1):
+            tasks[i].task = tasks[i].task._replace(task_id=task_id)
+            yield tasks[i]
+
+    def __iter__(self):
+        return self.tasks()
+
+    def write(self, sink):
+        """
+        send every task to a sink
+
+        Parameters:
+        -----------
+        sink: FileSink, BufferSink, SQLiteSink or similar
+            anything with `open()`, `add(task, dataframe)` and `close()`
+            methods, `add` is given a manifest.Task and its LoadData
+            dataframe
+
+        Returns:
+        --------
+        int, number of tasks
+        """
+        sink.open()
+        n_tasks = 0
+        for planned in self.tasks():
+            sink.add(planned.task, planned.loaddata())
+            n_tasks += 1
+        sink.close()
+        return n_tasks
+
+
+class FileSink(object):
+    """
+    Write the LoadData csv files, cp_commands.txt and the task manifest, as
+    `Job.create_commands` does.
+
+    Parameters:
+    -----------
+    location: string
+        the Plan's location
+    commands_location: string
+        where to write the commands and manifest
+    layout: string (default = "flat")
+        the Plan's layout
+    """
+
+    def __init__(self, location, commands_location, layout="flat"):
+        self.location = location
+        self.commands_location = commands_location
+        self.layout = layout
+        self.tasks = []
+        self._shards = set()
+
+    def open(self):
+        commands.make_output_directories(location=self.location)
+        self.tasks = []
+        self._shards = set()
+
+    def add(self, task, dataframe):
+        shard = commands.shard(task.name, self.layout)
+        if shard not in self._shards:
+            commands.make_shard_directories(self.location, shard)
+            self._shards.add(shard)
+        commands.write_loaddata(
+            name=task.name, location=self.location, dataframe=dataframe,
+            fix_paths=False, layout=self.layout
+        )
+        self.tasks.append(task)
+
+    def close(self):
+        commands._write_single(
+            self.commands_location, [task.command for task in self.tasks], "cp_commands"
+        )
+        with profiling.stage("manifest.write_manifest") as record:
+            manifest.write_manifest(self.commands_location, self.tasks)
+            record.n_items = len(self.tasks)
+
+
+class BufferSink(object):
+    """
+    Keep the tasks in memory.
+
+    Attributes:
+    -----------
+    tasks: list of manifest.Task
+    loaddata: dictionary of task name: LoadData csv text
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self.loaddata = dict()
+
+    def open(self):
+        self.tasks = []
+        self.loaddata = dict()
+
+    def add(self, task, dataframe):
+        self.tasks.append(task)
+        self.loaddata[task.name] = dataframe.to_csv(index=False)
+
+    def close(self):
+        pass
+
+    @property
+    def commands(self):
+        """the cellprofiler commands, in task order"""
+        return [task.command for task in self.tasks]
+
+
+class SQLiteSink(object):
+    """
+    Write the tasks to an SQLite database, a `tasks` table with a row per
+    task and the manifest's columns, and a `loaddata` table of each task's
+    LoadData csv text.
+
+    Parameters:
+    -----------
+    database: string
+        path to the database file, existing tables are replaced
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.connection = None
+
+    def open(self):
+        self.connection = sqlite3.connect(self.database)
+        self.connection.execute("DROP TABLE IF EXISTS tasks")
+        self.connection.execute("DROP TABLE IF EXISTS loaddata")
+        self.connection.execute(
+            "CREATE TABLE tasks (task_id INTEGER PRIMARY KEY, name TEXT, plate TEXT, "
+            "n_imagesets INTEGER, loaddata TEXT, output TEXT, command TEXT)"
+        )
+        self.connection.execute("CREATE TABLE loaddata (name TEXT PRIMARY KEY, csv TEXT)")
+
+    def add(self, task, dataframe):
+        self.connection.execute(
+            "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)", tuple(task)
+        )
+        self.connection.execute(
+            "INSERT INTO loaddata VALUES (?, ?)", (task.name, dataframe.to_csv(index=False))
+        )
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+        self.connection = None
+
+
+def make_plan(config, filelister=None):
+    """
+    plan the job described by a config, as `cptools2 config.yml` would,
+    without printing anything or writing to disk
+
+    Parameters:
+    -----------
+    config: parse_config.Config
+    filelister: filelist.Filelist (optional)
+        passed to job.Job
+
+    Returns:
+    --------
+    Plan
+    """
+    jobber = job.make_job(config, filelister)
+    if config.chunk is not None:
+        jobber.chunk(config.chunk)
+    args = config.create_command_args()
+    args.pop("commands_location")
+    return Plan(jobber, **args)
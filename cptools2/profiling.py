@@ -0,0 +1,260 @@
+"""
+Timing and memory profiling of the stages of generating a job.
+
+Stages are marked with the `stage` context manager, which does nothing until
+a Profiler is enabled with `enable`, e.g by `cptools2 config.yml --profile`.
+Repeated stages, such as reading the files from each plate, are summed under
+the stage's name.
+
+    with profiling.stage("filelist.files_from_plate") as record:
+        files = ...
+        record.n_items = len(files)
+
+The peak resident memory of the process is always recorded. The peak memory
+allocated within each stage is only recorded with `trace_memory`, as
+tracemalloc slows python down several times over, and only from python 3.9,
+as before then tracemalloc's peak can't be reset at the start of a stage.
+"""
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from cptools2 import colours
+from cptools2.colours import pretty_print
+
+
+PROFILE_NAME = "cptools2_profile.json"
+CPROFILE_NAME = "cptools2_profile.prof"
+
+_PROFILER = None
+# tracemalloc.reset_peak() is new in python 3.9
+CAN_RESET_PEAK = hasattr(tracemalloc, "reset_peak")
+
+
+def max_rss():
+    """peak resident set size of this process in MB, or None"""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    if sys.platform == "darwin":
+        return maxrss / 1024 ** 2
+    return maxrss / 1024
+
+
+class StageRecord(object):
+    """a single run of a stage, set n_items to record throughput"""
+
+    def __init__(self, name):
+        self.name = name
+        self.n_items = None
+        self.seconds = 0.0
+        self.peak_traced = 0
+
+
+class _NullStage(object):
+    """stand-in for a stage while profiling is disabled"""
+
+    def __enter__(self):
+        return StageRecord(None)
+
+    def __exit__(self, *args):
+        return False
+
+
+class Profiler(object):
+    """
+    Collect the wall time, item counts and memory use of each stage.
+
+    Parameters:
+    -----------
+    trace_memory: Boolean (default = False)
+        whether to track the peak memory allocated by python during each
+        stage with tracemalloc, which slows things down. Needs python 3.9,
+        on earlier versions each stage's peak is left as None.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = dict()
+        self.order = []
+        self._stack = []
+        self.start_time = None
+        # peak since tracing started, in MB
+        self.peak_traced_mb = None
+
+    def start(self):
+        self.start_time = time.time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.peak_traced_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+
+    def tracing_stages(self):
+        """whether the peak memory of each stage can be traced"""
+        return CAN_RESET_PEAK and tracemalloc.is_tracing()
+
+    def _reset_peak(self):
+        """reset the traced peak, keeping it for any enclosing stage"""
+        if not self.tracing_stages():
+            return
+        if self._stack:
+            parent = self._stack[-1]
+            parent.peak_traced = max(parent.peak_traced, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    def enter(self, name):
+        self._reset_peak()
+        record = StageRecord(name)
+        record.start = time.perf_counter()
+        self._stack.append(record)
+        return record
+
+    def exit(self, record):
+        record.seconds = time.perf_counter() - record.start
+        self._stack.pop()
+        if self.tracing_stages():
+            record.peak_traced = max(record.peak_traced, tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                parent = self._stack[-1]
+                parent.peak_traced = max(parent.peak_traced, record.peak_traced)
+        self._add(record)
+
+    def _add(self, record):
+        if record.name not in self.stages:
+            self.order.append(record.name)
+            self.stages[record.name] = {
+                "name": record.name,
+                "calls": 0,
+                "seconds": 0.0,
+                "items": None,
+                "peak_traced_mb": None,
+                "max_rss_mb": None,
+            }
+        summary = self.stages[record.name]
+        summary["calls"] += 1
+        summary["seconds"] += record.seconds
+        if record.n_items is not None:
+            summary["items"] = (summary["items"] or 0) + record.n_items
+        if self.tracing_stages():
+            peak = record.peak_traced / 1024 ** 2
+            summary["peak_traced_mb"] = max(summary["peak_traced_mb"] or 0, peak)
+        summary["max_rss_mb"] = max_rss()
+
+    def summary(self):
+        """
+        Returns:
+        --------
+        dictionary of the total time, peak memory, and a list of stage
+        summaries in the order each stage was first run. Each stage's
+        peak_traced_mb is None unless memory is traced on python 3.9+.
+        """
+        stages = []
+        for name in self.order:
+            stage_summary = dict(self.stages[name])
+            items, seconds = stage_summary["items"], stage_summary["seconds"]
+            stage_summary["items_per_second"] = (
+                items / seconds if items is not None and seconds > 0 else None
+            )
+            stages.append(stage_summary)
+        return {
+            "total_seconds": time.time() - self.start_time,
+            "max_rss_mb": max_rss(),
+            "peak_traced_mb": (tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                               if tracemalloc.is_tracing() else self.peak_traced_mb),
+            "stages": stages,
+        }
+
+    def write(self, path):
+        """write the summary as JSON to `path`"""
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def report(self):
+        """print the time taken by each stage"""
+        summary = self.summary()
+        pretty_print("profile: {:.2f}s in total".format(summary["total_seconds"]))
+        if self.trace_memory and not CAN_RESET_PEAK:
+            pretty_print("the peak memory of each stage needs python 3.9, "
+                         "only the overall peak is recorded")
+        for stage_summary in summary["stages"]:
+            msg = "{:.3f}s {} call(s)".format(stage_summary["seconds"], stage_summary["calls"])
+            if stage_summary["items_per_second"] is not None:
+                msg += ", {} items, {:.0f} items/s".format(
+                    stage_summary["items"], stage_summary["items_per_second"]
+                )
+            if stage_summary["peak_traced_mb"] is not None:
+                msg += ", peak {:.1f} MB".format(stage_summary["peak_traced_mb"])
+            print(colours.purple("\t {}".format(stage_summary["name"])), msg)
+
+
+class _Stage(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        self.record = self.profiler.enter(self.name)
+        return self.record
+
+    def __exit__(self, *args):
+        self.profiler.exit(self.record)
+        return False
+
+
+def stage(name):
+    """
+    context manager to time a stage, if profiling is enabled
+
+    Parameters:
+    -----------
+    name: string
+        name of the stage, e.g "splitter.split"
+
+    Returns:
+    --------
+    context manager giving a StageRecord, set its `n_items` to record the
+    number of items processed
+    """
+    if _PROFILER is None:
+        return _NullStage()
+    return _Stage(_PROFILER, name)
+
+
+def enable(trace_memory=False):
+    """start profiling stages, returning the Profiler"""
+    global _PROFILER
+    _PROFILER = Profiler(trace_memory)
+    _PROFILER.start()
+    return _PROFILER
+
+
+def disable():
+    """stop profiling, returning the Profiler or None if not enabled"""
+    global _PROFILER
+    profiler = _PROFILER
+    if profiler is not None:
+        profiler.stop()
+    _PROFILER = None
+    return profiler
+
+
+def profile_path(commands_location):
+    return os.path.join(commands_location, PROFILE_NAME)
+
+
+def cprofile_path(commands_location):
+    return os.path.join(commands_location, CPROFILE_NAME)
@@ -0,0 +1,201 @@
+"""
+Estimate the memory and run time each task needs from the image headers,
+so the array job can request them (`-l h_vmem` and `-l h_rt` on SGE,
+`--mem` and `--time` on SLURM) rather than over-requesting to be safe.
+
+The headers of a few images from each plate are read in parallel (see
+`tiff`) for their dimensions, bit depth and pages. Combined with the number
+of channels and rows (imagesets or z-planes) in each task's LoadData this
+gives:
+
+    memory = base memory + image copies * channels * pixels * 8 bytes
+    seconds = startup seconds + rows * channels * megapixels * seconds per megapixel
+
+as CellProfiler holds each image as float64. The largest task sets the
+request, which is then multiplied by a headroom factor.
+"""
+
+import json
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from cptools2 import loaddata
+from cptools2 import tiff
+from cptools2 import utils
+
+
+DEFAULTS = {
+    "memory_headroom": 1.5,
+    "runtime_headroom": 2.0,
+    # MB for CellProfiler, python and the JVM before any images are loaded
+    "base_memory": 1024,
+    # float64 copies of each channel held at once by a typical pipeline
+    "image_copies": 10,
+    "seconds_per_megapixel": 0.5,
+    "startup_seconds": 60,
+    # images per plate to read headers from
+    "sample": 4,
+    "workers": 16,
+}
+# memory is requested in multiples of this many MB
+MEMORY_STEP = 256
+ESTIMATE_NAME = "resources.json"
+
+Estimate = namedtuple("Estimate", ["memory_mb", "seconds", "memory", "runtime", "n_images"])
+
+
+def read_headers(paths, workers=DEFAULTS["workers"]):
+    """
+    read TIFF headers in parallel, skipping images which can't be read
+
+    Returns:
+    --------
+    dictionary of path: tiff.TiffHeader
+    """
+    def read(path):
+        try:
+            return path, tiff.read_header(path)
+        except (IOError, OSError, tiff.TiffError):
+            return path, None
+
+    if not paths:
+        return dict()
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+        return {path: header for path, header in executor.map(read, paths)
+                if header is not None}
+
+
+def _dataframes(loaddata_store, plate):
+    dataframes = loaddata_store[plate]
+    return dataframes if isinstance(dataframes, list) else [dataframes]
+
+
+def sample_paths(jobber, n_per_plate=DEFAULTS["sample"]):
+    """
+    the first `n_per_plate` image paths of each plate in a job, after
+    `Job.create_commands` has created the LoadData dataframes
+
+    Returns:
+    --------
+    dictionary of plate: list of paths
+    """
+    samples = dict()
+    for plate in sorted(jobber.loaddata_store):
+        # relative (ImageXpress) paths are relative to the experiment
+        root = os.path.dirname(jobber.plate_store[plate][0])
+        paths = []
+        for dataframe in _dataframes(jobber.loaddata_store, plate):
+            for path in loaddata.image_paths(dataframe, root):
+                if len(paths) == n_per_plate:
+                    break
+                paths.append(path)
+            if len(paths) == n_per_plate:
+                break
+        samples[plate] = paths
+    return samples
+
+
+def estimate_task(headers, n_channels, n_rows, base_memory=DEFAULTS["base_memory"],
+                  image_copies=DEFAULTS["image_copies"],
+                  seconds_per_megapixel=DEFAULTS["seconds_per_megapixel"],
+                  startup_seconds=DEFAULTS["startup_seconds"]):
+    """
+    estimate the peak memory and run time of a task, without headroom
+
+    Parameters:
+    -----------
+    headers: list of tiff.TiffHeader
+        sampled from the task's plate, the largest image is used
+    n_channels: int
+        images per row of the LoadData
+    n_rows: int
+        rows in the LoadData
+
+    Returns:
+    --------
+    tuple of (memory in MB, seconds)
+    """
+    pixels = max(i.width * i.height * i.samples_per_pixel * i.n_pages for i in headers)
+    memory_mb = base_memory + image_copies * n_channels * pixels * 8 / 1024.0 ** 2
+    seconds = startup_seconds + n_rows * n_channels * pixels / 1e6 * seconds_per_megapixel
+    return memory_mb, seconds
+
+
+def estimate_job(jobber, memory_headroom=DEFAULTS["memory_headroom"],
+                 runtime_headroom=DEFAULTS["runtime_headroom"],
+                 sample=DEFAULTS["sample"], workers=DEFAULTS["workers"], **kwargs):
+    """
+    estimate the memory and run time to request for every task of a job
+
+    Parameters:
+    -----------
+    jobber: job.Job
+        after `create_commands`
+    memory_headroom: float
+        the largest task's estimated memory is multiplied by this
+    runtime_headroom: float
+        the longest task's estimated run time is multiplied by this
+    sample: int
+        images per plate to read headers from
+    workers: int
+        headers to read at once
+    **kwargs:
+        passed to `estimate_task`
+
+    Returns:
+    --------
+    Estimate, or None if none of the sampled images could be read
+    """
+    samples = sample_paths(jobber, sample)
+    # every plate's sample is read in one pool
+    headers = read_headers([path for paths in samples.values() for path in paths], workers)
+    memory_mb = 0
+    seconds = 0
+    n_images = 0
+    for plate, paths in samples.items():
+        plate_headers = [headers[i] for i in paths if i in headers]
+        if not plate_headers:
+            continue
+        n_images += len(plate_headers)
+        for dataframe in _dataframes(jobber.loaddata_store, plate):
+            n_channels = len([i for i in dataframe.columns if i.startswith("FileName_")])
+            task_memory, task_seconds = estimate_task(
+                plate_headers, n_channels, dataframe.shape[0], **kwargs
+            )
+            memory_mb = max(memory_mb, task_memory)
+            seconds = max(seconds, task_seconds)
+    if n_images == 0:
+        return None
+    memory_mb = int(math.ceil(memory_mb * memory_headroom / MEMORY_STEP)) * MEMORY_STEP
+    seconds = seconds * runtime_headroom
+    return Estimate(
+        memory_mb=memory_mb,
+        seconds=seconds,
+        memory="{}M".format(memory_mb),
+        runtime=utils.format_h_rt(seconds),
+        n_images=n_images
+    )
+
+
+def write_estimate(commands_location, estimate):
+    """save an Estimate next to the commands, for when the scripts are made"""
+    with open(os.path.join(commands_location, ESTIMATE_NAME), "w") as f:
+        json.dump(estimate._asdict(), f)
+
+
+def remove_estimate(commands_location):
+    """remove the Estimate of an earlier run, if there is one"""
+    path = os.path.join(commands_location, ESTIMATE_NAME)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def read_estimate(commands_location):
+    """the Estimate saved by `write_estimate`, or None"""
+    path = os.path.join(commands_location, ESTIMATE_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return Estimate(**json.load(f))
@@ -0,0 +1,121 @@
+"""
+Find failed or missing tasks from an array job and create a script to
+re-run just those tasks.
+"""
+
+import os
+from datetime import datetime
+
+from cptools2 import generate_scripts, manifest, status
+
+
+def check_output(output_loc, expected_files=None):
+    """
+    check a task's output directory contains the expected files
+
+    Parameters:
+    -----------
+    output_loc: string
+        path to the task's output directory, e.g raw_data/<name>
+    expected_files: list of strings (optional)
+        filenames which should be in `output_loc`, if not given then
+        `output_loc` just has to contain something.
+
+    Returns:
+    --------
+    Boolean
+    """
+    if not os.path.isdir(output_loc):
+        return False
+    if expected_files:
+        return all(os.path.isfile(os.path.join(output_loc, i)) for i in expected_files)
+    return len(os.listdir(output_loc)) > 0
+
+
+def find_failed_tasks(commands_location, logfile_location, expected_files=None):
+    """
+    find tasks which have not finished successfully
+
+    A task has failed if no line in the status logs reports it as finished,
+    or if its output directory doesn't contain the expected files.
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the task manifest
+    logfile_location: string
+        directory containing the status logs
+    expected_files: list of strings (optional)
+        filenames expected in each task's output directory
+
+    Returns:
+    --------
+    list of task_ids
+    """
+    if not manifest.has_manifest(commands_location):
+        err_msg = "no task manifest found in '{}'".format(commands_location)
+        raise manifest.ManifestError(err_msg)
+    finished = status.finished_tasks(status.read_status_logs(logfile_location))
+    failed = []
+    for task in manifest.read_manifest(commands_location):
+        if task.task_id not in finished:
+            failed.append(task.task_id)
+        elif not check_output(task.output, expected_files):
+            failed.append(task.task_id)
+    return failed
+
+
+def make_resubmit_script(commands_location, logfile_location, task_ids,
+                         scheduler="sge"):
+    """
+    create an array job script which only runs `task_ids`
+
+    The LoadData files and commands are re-used from the original job, the
+    task_ids are written to a task list which maps each task in the new
+    array to a task in the manifest.
+
+    Parameters:
+    -----------
+    commands_location: string
+        directory containing the task manifest
+    logfile_location: string
+        directory containing the status logs
+    task_ids: list of ints
+        task_ids from the manifest to re-run
+    scheduler: string (default = "sge")
+        which scheduler to create the script for
+
+    Returns:
+    --------
+    string, path to the saved script
+    """
+    time_now = str(datetime.now().replace(microsecond=0)).replace(" ", "-")
+    task_list = os.path.join(commands_location, "{}_resubmit_tasks.txt".format(time_now))
+    n_tasks = manifest.write_task_list(task_list, task_ids)
+    return generate_scripts.make_qsub_scripts(
+        commands_location,
+        {"cp_commands": n_tasks},
+        logfile_location=logfile_location,
+        task_list=task_list,
+        script_name="resubmit",
+        scheduler=scheduler
+    )
+
+
+def resubmit(commands_location, logfile_location, expected_files=None,
+             scheduler="sge"):
+    """
+    find failed tasks and create a script to re-run them
+
+    Returns:
+    --------
+    tuple of (list of failed task_ids, path to script or None if there were
+    no failed tasks)
+    """
+    failed = find_failed_tasks(commands_location, logfile_location, expected_files)
+    if len(failed) == 0:
+        return failed, None
+    script = make_resubmit_script(commands_location, logfile_location, failed,
+                                  scheduler=scheduler)
+    return failed, script
+
@@ -0,0 +1,243 @@
+"""
+Skip tasks whose results already exist, when a job is created again with
+plates added or after a partial failure.
+
+Each task is given a key, the sha256 of:
+
+    - the pipeline file's contents
+    - the cptools2 version
+    - the task's LoadData, and the path, size and modification time of each
+      of its images
+
+When a task of the array job succeeds it writes its key to
+`<output>/.cptools2_key`, and records its output directory under the key in
+`location`/result_cache. Creating the job again, a task whose key is in the
+cache, with the key still in its output directory, is done. It stays in the
+task manifest, pointing at the existing output for `merge` and `collate`,
+but is left out of the array job, which runs only the task list in
+`commands_location`/pending_tasks.txt.
+"""
+
+import hashlib
+import os
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+
+import cptools2
+from cptools2 import commands
+from cptools2 import loaddata
+from cptools2 import manifest
+
+
+CACHE_DIR = "result_cache"
+KEY_NAME = ".cptools2_key"
+KEYS_NAME = "task_keys.txt"
+PENDING_NAME = "pending_tasks.txt"
+# hex sha256 and a newline, so the array job can look up a task's key by
+# its byte offset
+KEY_WIDTH = 65
+DEFAULT_WORKERS = 16
+
+
+def file_hash(path):
+    """hex sha256 of a file's contents"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def stat_image(path):
+    """"path size mtime" of an image, or "path missing" if it can't be read"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "{}\tmissing".format(path)
+    return "{}\t{}\t{}".format(path, stat.st_size, int(stat.st_mtime * 1e6))
+
+
+def task_key(pipeline_hash, dataframe, image_stats):
+    """
+    the key of a task
+
+    Parameters:
+    -----------
+    pipeline_hash: string
+        from `file_hash` of the pipeline
+    dataframe: pandas.DataFrame
+        the task's LoadData, before the paths are prefixed for staging
+    image_stats: list of strings
+        from `stat_image` for each of the task's images
+
+    Returns:
+    --------
+    string, hex sha256
+    """
+    sha = hashlib.sha256()
+    for part in [pipeline_hash, cptools2.__version__, dataframe.to_csv(index=False)]:
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+    for line in image_stats:
+        sha.update(line.encode("utf-8"))
+        sha.update(b"\n")
+    return sha.hexdigest()
+
+
+def job_keys(jobber, pipeline, workers=DEFAULT_WORKERS):
+    """
+    the key of every task of a job, after `Job.create_commands` has created
+    the LoadData dataframes
+
+    Parameters:
+    -----------
+    jobber: job.Job
+    pipeline: string
+        path to the pipeline
+    workers: int
+        number of images to stat at once
+
+    Returns:
+    --------
+    dictionary of task name: key
+    """
+    pipeline_hash = file_hash(pipeline)
+    tasks = []
+    for plate in sorted(jobber.loaddata_store):
+        # relative (ImageXpress) paths are relative to the experiment
+        root = os.path.dirname(jobber.plate_store[plate][0])
+        dataframes = jobber.loaddata_store[plate]
+        if not isinstance(dataframes, list):
+            dataframes = [dataframes]
+        for job_num, dataframe in enumerate(dataframes):
+            tasks.append((commands.task_name(plate, job_num), dataframe,
+                          list(loaddata.image_paths(dataframe, root))))
+    paths = [path for _, _, task_paths in tasks for path in task_paths]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        stats = dict(zip(paths, executor.map(stat_image, paths)))
+    return {name: task_key(pipeline_hash, dataframe, [stats[i] for i in task_paths])
+            for name, dataframe, task_paths in tasks}
+
+
+def cache_entry_path(location, key):
+    """where a key's output directory is recorded"""
+    return os.path.join(location, CACHE_DIR, key[:2], key)
+
+
+def cached_output(location, key):
+    """
+    the output directory of a finished task with this key
+
+    Returns:
+    --------
+    string, or None if no finished task had this key, or its output has
+    since been replaced
+    """
+    entry = cache_entry_path(location, key)
+    if not os.path.isfile(entry):
+        return None
+    with open(entry, "r") as f:
+        output = f.read().strip()
+    marker = os.path.join(output, KEY_NAME)
+    if not os.path.isfile(marker):
+        return None
+    with open(marker, "r") as f:
+        if f.read().strip() != key:
+            return None
+    return output
+
+
+def write_keys(commands_location, keys):
+    """
+    write the keys of the tasks in the manifest, the key of task N on line N
+
+    Parameters:
+    -----------
+    commands_location: string
+    keys: list of strings, in task_id order
+    """
+    with open(os.path.join(commands_location, KEYS_NAME), "w") as f:
+        for key in keys:
+            f.write(key + "\n")
+
+
+def read_keys(commands_location):
+    """the keys written by `write_keys`"""
+    with open(os.path.join(commands_location, KEYS_NAME), "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def pending_list_path(commands_location):
+    """path to the task list of the tasks still to run"""
+    return os.path.join(commands_location, PENDING_NAME)
+
+
+def mark_cached_tasks(jobber, location, commands_location, pipeline,
+                      workers=DEFAULT_WORKERS):
+    """
+    find the tasks of a job with cached results, after `Job.create_commands`
+
+    The manifest is rewritten with the done tasks pointing at their cached
+    output, the keys and the task list of the pending tasks are written to
+    `commands_location`, and a stale key is removed from each pending
+    task's output directory so it can't be mistaken for a finished one.
+
+    Parameters:
+    -----------
+    jobber: job.Job
+    location: string
+    commands_location: string
+    pipeline: string
+    workers: int
+        number of images to stat at once
+
+    Returns:
+    --------
+    tuple of (list of done task_ids, list of pending task_ids)
+    """
+    keys = job_keys(jobber, pipeline, workers)
+    tasks = list(manifest.read_manifest(commands_location))
+    task_keys = [keys[task.name] for task in tasks]
+    done = []
+    pending = []
+    for i, (task, key) in enumerate(zip(tasks, task_keys)):
+        output = cached_output(location, key)
+        if output is not None:
+            done.append(task.task_id)
+            tasks[i] = task._replace(output=output)
+            continue
+        pending.append(task.task_id)
+        marker = os.path.join(task.output, KEY_NAME)
+        if os.path.isfile(marker):
+            os.remove(marker)
+    if done:
+        manifest.write_manifest(commands_location, tasks)
+    write_keys(commands_location, task_keys)
+    manifest.write_task_list(pending_list_path(commands_location), pending)
+    return done, pending
+
+
+def make_cache_text(location, commands_location):
+    """
+    text for an array job script recording a successful task's key in its
+    output directory and the result cache, after $RETURN_VAL is set by
+    `generate_scripts.make_logfile_text`
+    """
+    text = """
+    if [[ $RETURN_VAL == 0 ]]; then
+        TASK_KEY=$(dd if="{keys}" bs={key_width} skip=$((TASK_ID - 1)) count=1 2>/dev/null | tr -d '\\n')
+        TASK_OUTPUT=$(printf '%s\\n' "$TASK_LINE" | cut -f {output_field})
+        if [[ -n "$TASK_KEY" && -d "$TASK_OUTPUT" ]]; then
+            printf '%s\\n' "$TASK_KEY" > "$TASK_OUTPUT/{key_name}"
+            mkdir -p "{cache}/${{TASK_KEY:0:2}}"
+            printf '%s\\n' "$TASK_OUTPUT" > "{cache}/${{TASK_KEY:0:2}}/$TASK_KEY"
+        fi
+    fi
+    """.format(
+        keys=os.path.join(commands_location, KEYS_NAME),
+        key_width=KEY_WIDTH,
+        output_field=manifest.FIELDS.index("output") + 1,
+        key_name=KEY_NAME,
+        cache=os.path.join(location, CACHE_DIR)
+    )
+    return textwrap.dedent(text)
@@ -0,0 +1,164 @@
+"""
+Read and summarise the runtime records written by each task of the array
+job, see `generate_scripts.make_runtime_text`.
+
+Each task appends a JSON line to `logfiles`/<job>.runtime.jsonl:
+
+    {"job_id": "1234567", "task_id": 12, "name": "plate_3", "hostname": "node1",
+     "start": 1580132700, "end": 1580133600, "return_code": 0,
+     "max_rss_kb": 1843200, "n_imagesets": 96, "input_bytes": 1006632960}
+"""
+
+import glob
+import json
+import os
+from collections import namedtuple
+
+
+RUNTIME_SUFFIX = ".runtime.jsonl"
+# robust z-score above which a task is an outlier
+OUTLIER_THRESHOLD = 3.5
+
+Summary = namedtuple("Summary", [
+    "n_tasks", "n_failed", "n_hosts", "n_imagesets", "input_bytes", "total_seconds",
+    "imagesets_per_second", "task_seconds", "memory_mb", "outliers"
+])
+Outlier = namedtuple("Outlier", ["task_id", "name", "hostname", "reason", "value", "median"])
+
+
+def find_runtime_logs(logfile_location):
+    """paths to the runtime logs in `logfile_location`, oldest first"""
+    logs = glob.glob(os.path.join(logfile_location, "*" + RUNTIME_SUFFIX))
+    return sorted(logs, key=os.path.getmtime)
+
+
+def read_runtime_records(logfile_location):
+    """
+    read every runtime record, skipping any malformed or partially written
+    lines
+
+    Returns:
+    --------
+    list of dictionaries, in the order they were written
+    """
+    records = []
+    for log in find_runtime_logs(logfile_location):
+        with open(log, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "task_id" in record:
+                    records.append(record)
+    return records
+
+
+def latest_records(records):
+    """the last record for each task, so resubmitted tasks are only counted once"""
+    latest = dict()
+    for record in records:
+        latest[record["task_id"]] = record
+    return [latest[i] for i in sorted(latest)]
+
+
+def percentile(values, q):
+    """
+    q-th percentile of values with linear interpolation, None if empty
+
+    Parameters:
+    -----------
+    values: list of numbers
+    q: number between 0 and 100
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def percentiles(values, qs=(50, 90, 99, 100)):
+    """dictionary of q: percentile"""
+    return {q: percentile(values, q) for q in qs}
+
+
+def robust_outliers(values, threshold=OUTLIER_THRESHOLD):
+    """
+    indices of values more than `threshold` robust z-scores above the
+    median, using the median absolute deviation
+
+    Returns:
+    --------
+    tuple of (list of indices, median)
+    """
+    median = percentile(values, 50)
+    if median is None:
+        return [], None
+    mad = percentile([abs(i - median) for i in values], 50)
+    if not mad:
+        return [], median
+    return [i for i, value in enumerate(values)
+            if 0.6745 * (value - median) / mad > threshold], median
+
+
+def task_seconds(record):
+    return record["end"] - record["start"]
+
+
+def summarise(records, threshold=OUTLIER_THRESHOLD):
+    """
+    summarise the runtime records of an array job
+
+    Only the latest record of each task is used. Throughput and outliers
+    are from successful tasks only.
+
+    Parameters:
+    -----------
+    records: list of dictionaries
+        from `read_runtime_records`
+    threshold: float
+        robust z-score above which a task's seconds per imageset or memory
+        is an outlier
+
+    Returns:
+    --------
+    Summary, with `task_seconds` and `memory_mb` as dictionaries of
+    percentile: value, and `outliers` a list of Outlier
+    """
+    records = latest_records(records)
+    finished = [i for i in records if i["return_code"] == 0]
+    seconds = [task_seconds(i) for i in finished]
+    n_imagesets = sum(i["n_imagesets"] for i in finished)
+    # throughput of the tasks' own time, rather than the wall time of the
+    # whole array which depends on queueing
+    total_seconds = sum(seconds)
+    with_memory = [i for i in finished if i.get("max_rss_kb") is not None]
+    memory_mb = [i["max_rss_kb"] / 1024 for i in with_memory]
+    outliers = []
+    with_imagesets = [i for i in finished if i["n_imagesets"] > 0]
+    per_imageset = [task_seconds(i) / i["n_imagesets"] for i in with_imagesets]
+    indices, median = robust_outliers(per_imageset, threshold)
+    for index in indices:
+        record = with_imagesets[index]
+        outliers.append(Outlier(record["task_id"], record.get("name"), record.get("hostname"),
+                                "seconds per imageset", per_imageset[index], median))
+    indices, median = robust_outliers(memory_mb, threshold)
+    for index in indices:
+        record = with_memory[index]
+        outliers.append(Outlier(record["task_id"], record.get("name"), record.get("hostname"),
+                                "memory (MB)", memory_mb[index], median))
+    return Summary(
+        n_tasks=len(records),
+        n_failed=len(records) - len(finished),
+        n_hosts=len(set(i.get("hostname") for i in records)),
+        n_imagesets=n_imagesets,
+        input_bytes=sum(i.get("input_bytes", 0) for i in finished),
+        total_seconds=total_seconds,
+        imagesets_per_second=n_imagesets / total_seconds if total_seconds > 0 else None,
+        task_seconds=percentiles(seconds),
+        memory_mb=percentiles(memory_mb),
+        outliers=sorted(outliers, key=lambda x: x.task_id),
+    )
@@ -0,0 +1,279 @@
+"""
+Scan the plates of a very large job as an array job on the cluster, rather
+than from the login node.
+
+The plate directories are listed on the login node, which only reads the
+top of each experiment, and split into shards. Each task of the scan array
+job lists the images of its shard's plates, keeps the channels, wells and
+sites the config asks for, and writes them to a gzipped partial image table
+in `commands_location`/scan. A reduce job held on the scan job reads every
+partial table back through a ScanFilelist, which stands in for
+filelist.Filelist, and creates the job as normal.
+
+    $ cptools2 big_experiment.yml         # with `distributed scan` set
+    $ ./YYYY-MM-DD-h:m:s_SUBMIT_SCAN.sh   # scan tasks, then the reduce job
+    $ ./YYYY-MM-DD-h:m:s_analysis_script.sh
+"""
+
+import glob
+import gzip
+import os
+import sys
+from datetime import datetime
+
+from cptools2 import canary
+from cptools2 import cookiecutter
+from cptools2 import filelist
+from cptools2 import utils
+
+
+SCAN_DIR = "scan"
+PLATES_NAME = "plates.txt"
+COMMANDS_NAME = "scan_commands.txt"
+PART_NAME = "part_{:05d}.tsv.gz"
+DEFAULT_TASKS = 100
+
+
+class ScanError(Exception):
+    pass
+
+
+def scan_paths(commands_location):
+    """paths to the scan directory, plate list and scan commands"""
+    scan_dir = os.path.join(commands_location, SCAN_DIR)
+    return {
+        "scan": scan_dir,
+        "plates": os.path.join(scan_dir, PLATES_NAME),
+        "commands": os.path.join(scan_dir, COMMANDS_NAME),
+    }
+
+
+def part_path(commands_location, task_id):
+    """path to a scan task's partial image table"""
+    return os.path.join(commands_location, SCAN_DIR, PART_NAME.format(task_id))
+
+
+def list_plates(config, filelister=None):
+    """
+    the plate directories of a config passing its plate filters, without
+    listing any images
+
+    Parameters:
+    -----------
+    config: parse_config.Config
+    filelister: filelist.Filelist (optional)
+
+    Returns:
+    --------
+    list of (experiment directory, plate directory) tuples
+    """
+    if filelister is None:
+        filelister = filelist.Filelist(config.microscope)
+    image_filter = filelist.ImageFilter(**config.image_filter_args())
+    # as job.Job, removed plates are only left out of the experiment
+    removed = set(config.removed_plates())
+    plates = []
+    if config.experiment is not None:
+        for plate_dir in filelister.paths_to_plates(config.experiment):
+            plate = plate_dir.split(os.sep)[-1]
+            if plate not in removed and image_filter.keep_plate(plate):
+                plates.append((config.experiment, plate_dir))
+    for add_plate in config.add_plate or []:
+        for plate in add_plate["plates"]:
+            if image_filter.keep_plate(plate):
+                plates.append((add_plate["exp_dir"], os.path.join(add_plate["exp_dir"], plate)))
+    return plates
+
+
+def assign_shards(plates, n_tasks):
+    """
+    deal the plates out to at most `n_tasks` scan tasks
+
+    Returns:
+    --------
+    list of (task_id, experiment directory, plate directory) tuples
+    """
+    n_tasks = max(1, min(n_tasks, len(plates)))
+    return [(i % n_tasks + 1, exp_dir, plate_dir)
+            for i, (exp_dir, plate_dir) in enumerate(plates)]
+
+
+def write_plates(commands_location, shards):
+    """
+    write the plate list, removing the partial tables of an earlier scan
+
+    Returns:
+    --------
+    int, number of scan tasks
+    """
+    paths = scan_paths(commands_location)
+    utils.make_dir(paths["scan"])
+    for old_part in glob.glob(os.path.join(paths["scan"], "part_*.tsv.gz")):
+        os.remove(old_part)
+    with open(paths["plates"], "w") as f:
+        for task_id, exp_dir, plate_dir in shards:
+            f.write("{}\t{}\t{}\n".format(task_id, exp_dir, plate_dir))
+    return len(set(i[0] for i in shards))
+
+
+def read_plates(commands_location):
+    """the (task_id, experiment directory, plate directory) tuples of `write_plates`"""
+    shards = []
+    with open(scan_paths(commands_location)["plates"], "r") as f:
+        for line in f:
+            task_id, exp_dir, plate_dir = line.rstrip("\n").split("\t")
+            shards.append((int(task_id), exp_dir, plate_dir))
+    return shards
+
+
+def scan_task(jobber, commands_location, task_id):
+    """
+    list a scan task's plates and write its partial image table
+
+    Parameters:
+    -----------
+    jobber: job.Job
+        with the config's channels and image filter, used to list and
+        filter each plate's images
+    commands_location: string
+    task_id: int
+
+    Returns:
+    --------
+    tuple of (number of plates, number of images)
+    """
+    plate_dirs = [plate_dir for i, _, plate_dir in read_plates(commands_location) if i == task_id]
+    if not plate_dirs:
+        raise ScanError("scan task {} has no plates".format(task_id))
+    path = part_path(commands_location, task_id)
+    n_images = 0
+    # written under a temporary name, so the table only exists once complete
+    with gzip.open(path + ".tmp", "wt") as f:
+        for plate_dir in plate_dirs:
+            # written as listed, ImageXpress paths are relative to the
+            # experiment rather than the plate
+            for image in jobber.files_from_plate(plate_dir):
+                f.write("{}\t{}\n".format(plate_dir, image))
+                n_images += 1
+    os.replace(path + ".tmp", path)
+    return len(plate_dirs), n_images
+
+
+def read_scan(commands_location):
+    """
+    merge the partial image tables of a finished scan
+
+    Returns:
+    --------
+    tuple of (dictionary of experiment directory: list of plate directories,
+    dictionary of plate directory: list of image paths), raises a ScanError
+    listing the tasks without a partial table
+    """
+    shards = read_plates(commands_location)
+    task_ids = sorted(set(i[0] for i in shards))
+    missing = [i for i in task_ids if not os.path.isfile(part_path(commands_location, i))]
+    if missing:
+        err_msg = "{} scan task(s) have not finished: {}"
+        raise ScanError(err_msg.format(len(missing), utils.compact_ranges(missing)))
+    plates = dict()
+    images = dict()
+    for _, exp_dir, plate_dir in shards:
+        plates.setdefault(exp_dir, []).append(plate_dir)
+        images[plate_dir] = []
+    for task_id in task_ids:
+        with gzip.open(part_path(commands_location, task_id), "rt") as f:
+            for line in f:
+                plate_dir, image = line.rstrip("\n").split("\t")
+                images[plate_dir].append(image)
+    return plates, images
+
+
+class ScanFilelist(object):
+    """
+    Stand-in for filelist.Filelist, answering from the partial image tables
+    of a finished scan.
+
+    Parameters:
+    -----------
+    microscope: string
+    commands_location: string
+    """
+
+    def __init__(self, microscope, commands_location):
+        self.microscope = microscope
+        self.plates, self.images = read_scan(commands_location)
+
+    def paths_to_plates(self, exp_dir):
+        return list(self.plates.get(exp_dir, []))
+
+    def files_from_plate(self, plate_dir):
+        if plate_dir not in self.images:
+            raise ScanError("'{}' was not part of the scan".format(plate_dir))
+        return list(self.images[plate_dir])
+
+    def clean_filelist(self, files):
+        return filelist.Filelist(self.microscope).clean_filelist(files)
+
+
+def make_scan_scripts(commands_location, logfile_location, config_path, n_tasks,
+                      scheduler="sge", max_running=None, runtime=None, memory=None,
+                      reduce_runtime=None, reduce_memory=None):
+    """
+    create the scan array job, the reduce job held on it, and a script
+    submitting both
+
+    Parameters:
+    -----------
+    commands_location: string
+    logfile_location: string
+        the scan's log files are written to a `scan` sub-directory
+    config_path: string
+        config file the scan and reduce commands are run with
+    n_tasks: int
+        number of scan tasks
+    scheduler: string (default = "sge")
+    max_running: int (optional)
+        maximum number of scan tasks to run at once
+    runtime, memory: string (optional)
+        limits for each scan task
+    reduce_runtime, reduce_memory: string (optional)
+        limits for the reduce job
+
+    Returns:
+    --------
+    dictionary of paths to the "scan", "reduce" and "submit" scripts
+    """
+    paths = scan_paths(commands_location)
+    output = os.path.join(logfile_location, SCAN_DIR)
+    utils.make_dir(output)
+    config_path = os.path.abspath(config_path)
+    # the python cptools2 is running from, rather than whatever is on the
+    # compute nodes' path
+    with open(paths["commands"], "w") as f:
+        for task_id in range(1, n_tasks + 1):
+            f.write("{} -m cptools2 scan {} --task {}\n".format(
+                sys.executable, config_path, task_id
+            ))
+    time_now = str(datetime.now().replace(microsecond=0)).replace(" ", "-")
+    job_hex = cookiecutter.generate_random_hex()
+    script_class = cookiecutter.get_script_class(scheduler)
+    scan_script = script_class(
+        name="scan_{}".format(job_hex), tasks=n_tasks, output=output,
+        max_running=max_running, runtime=runtime, memory=memory
+    )
+    scan_script.loop_through_file(paths["commands"])
+    scan_path = os.path.join(commands_location, "{}_scan_script.sh".format(time_now))
+    scan_script.save(scan_path)
+    reduce_script = script_class(
+        name="reduce_{}".format(job_hex), output=output,
+        runtime=reduce_runtime, memory=reduce_memory,
+        # SGE holds on the job name, SLURM on the job ID set by the submit script
+        hold_jid="scan_{}".format(job_hex) if scheduler == "sge" else False
+    )
+    reduce_script += "{} -m cptools2 scan {} --reduce".format(sys.executable, config_path)
+    reduce_path = os.path.join(commands_location, "{}_reduce_script.sh".format(time_now))
+    reduce_script.save(reduce_path)
+    submit_path = canary.make_submit_script(
+        commands_location, scan_path, reduce_path, scheduler, name="SUBMIT_SCAN"
+    )
+    return {"scan": scan_path, "reduce": reduce_path, "submit": submit_path}
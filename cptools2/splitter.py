@@ -1,5 +1,6 @@
 import pandas as _pd
 from cptools2 import parse_metadata
+from cptools2 import profiling
 
 
 def _well_site_table(img_list, microscope="imagexpress"):
@@ -90,6 +91,10 @@ def split(img_list, job_size=96, microscope="imagexpress"):
     --------
     list of dataframes
     """
-    df_img = _well_site_table(img_list, microscope)
-    grouped_list = _group_images(df_img, microscope)
+    with profiling.stage("splitter.well_site_table") as record:
+        df_img = _well_site_table(img_list, microscope)
+        record.n_items = len(img_list)
+    with profiling.stage("splitter.group_images") as record:
+        grouped_list = _group_images(df_img, microscope)
+        record.n_items = len(grouped_list)
     return [chunk for chunk in chunks(grouped_list, job_size)]
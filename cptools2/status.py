@@ -0,0 +1,107 @@
+"""
+Read and write the status logs appended to by each task of the array job.
+
+Each line of a status log is written by `generate_scripts.make_logfile_text`
+in the form:
+
+    2020-01-27 13:45  1234567  12  Finished
+
+i.e date, job ID, task ID and the return status, separated by two spaces.
+"""
+
+import glob
+import os
+from collections import namedtuple
+from datetime import datetime
+
+
+FINISHED = "Finished"
+# written by the circuit breaker, see `generate_scripts.make_breaker_text`
+TRIPPED = "Circuit breaker tripped"
+SKIPPED = "Skipped, circuit breaker tripped"
+SEP = "  "
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+StatusLine = namedtuple("StatusLine", ["date", "job_id", "task_id", "status"])
+
+
+def format_status_line(job_id, task_id, status, date=None):
+    """
+    create a status log line in the same format as the array job script
+
+    Parameters:
+    -----------
+    job_id: string
+    task_id: int
+    status: string
+    date: datetime.datetime (optional)
+        defaults to now
+
+    Returns:
+    --------
+    string, without a trailing newline
+    """
+    date = datetime.now() if date is None else date
+    values = [date.strftime(DATE_FORMAT), str(job_id), str(task_id), status]
+    return SEP.join(values)
+
+
+def parse_status_line(line):
+    """
+    parse a line from a status log
+
+    Parameters:
+    -----------
+    line: string
+
+    Returns:
+    --------
+    StatusLine, or None if the line could not be parsed
+    """
+    values = line.rstrip("\n").split(SEP, 3)
+    if len(values) != 4:
+        return None
+    date, job_id, task_id, status = values
+    try:
+        task_id = int(task_id)
+    except ValueError:
+        return None
+    return StatusLine(date, job_id.strip(), task_id, status.strip())
+
+
+def find_status_logs(logfile_location):
+    """all status logs in `logfile_location`, oldest first"""
+    logs = glob.glob(os.path.join(logfile_location, "*.log"))
+    return sorted(logs, key=os.path.getmtime)
+
+
+def read_status_logs(logfile_location):
+    """
+    read all status logs in `logfile_location`
+
+    Parameters:
+    -----------
+    logfile_location: string
+        directory containing the status logs
+
+    Returns:
+    --------
+    generator of StatusLine, in the order they were written per log
+    """
+    for log in find_status_logs(logfile_location):
+        with open(log, "r") as f:
+            for line in f:
+                status_line = parse_status_line(line)
+                if status_line is not None:
+                    yield status_line
+
+
+def finished_tasks(status_lines):
+    """set of task_ids which have finished successfully at least once"""
+    return set(i.task_id for i in status_lines if i.status == FINISHED)
+
+
+def append_status_line(log_path, line):
+    """append a single status line to a log, as `echo >>` would"""
+    with open(log_path, "a") as f:
+        f.write(line + "\n")
@@ -14,7 +14,45 @@ def print_template():
 
         chunk: # how many images per task
 
+        plates:
+            - include: # plate name glob patterns, or regular expressions starting with re:
+            - exclude: # as above
+
+        wells: # wells or ranges of wells to include, e.g [A01-H12]
+
+        sites: # sites or ranges of sites to include, e.g [1-4]
+
+        scheduler: # sge or slurm
+
+        task order: # plate (default), imagesets, planes or bytes
+
+        incomplete imagesets: # fail (default) or drop imagesets missing a channel
+
+        layout: # flat (default), plate or hash sub-directories for loaddata and raw_data
+
+        canary: # run a task per plate or per channel layout first (plate, layout or false)
+
+        circuit breaker:
+            - failures: # stop starting tasks after this many failures
+            - window: # out of this many of the most recent tasks (default = failures)
+            - hook: # command to run when tripped, e.g qdel $JOB_ID
+
+        resources:
+            - memory headroom: # multiply the estimated memory by this (default 1.5)
+            - runtime headroom: # multiply the estimated run time by this (default 2)
+
+        validate:
+            - sample: # fraction of images to check before submitting (default 1)
+
+        result cache: # skip tasks whose pipeline, LoadData and images haven't changed (true or false)
+
+        distributed scan:
+            - tasks: # list the images in this many cluster tasks instead of here
+            - reduce memory: # memory for the job merging their results, e.g 16G
+
         channels:
             - 1: # name of channel number 1
             - 2: # name of channel number 2
+
+        prune channels: # drop channels the pipeline doesn't use (default false)
     """))
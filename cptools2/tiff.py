@@ -0,0 +1,107 @@
+"""
+Read the dimensions of a TIFF image from its header, without reading or
+decoding the pixel data.
+
+Only the image file directories (IFDs) are read: the first for the image
+width, height, bit depth and samples per pixel, then the chain of IFD
+offsets to count the pages, e.g z-planes in a multi-page TIFF.
+"""
+
+import struct
+from collections import namedtuple
+
+
+TiffHeader = namedtuple("TiffHeader", [
+    "width", "height", "bits_per_sample", "samples_per_pixel", "n_pages"
+])
+
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+SAMPLES_PER_PIXEL = 277
+# tag type: (struct format, size in bytes)
+TAG_TYPES = {1: ("B", 1), 3: ("H", 2), 4: ("I", 4), 16: ("Q", 8)}
+# stop following IFD offsets after this many pages, in case of a loop
+MAX_PAGES = 100000
+
+
+class TiffError(Exception):
+    pass
+
+
+def _read(f, fmt, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise TiffError("unexpected end of file")
+    return struct.unpack(fmt, data)
+
+
+def read_header(path):
+    """
+    read the dimensions of a TIFF image
+
+    Parameters:
+    -----------
+    path: string
+        path to a .tif/.tiff file, either classic TIFF or BigTIFF
+
+    Returns:
+    --------
+    TiffHeader, raises TiffError if it isn't a readable TIFF
+    """
+    with open(path, "rb") as f:
+        byte_order = f.read(2)
+        if byte_order == b"II":
+            endian = "<"
+        elif byte_order == b"MM":
+            endian = ">"
+        else:
+            raise TiffError("'{}' is not a TIFF file".format(path))
+        version, = _read(f, endian + "H", 2)
+        if version == 42:
+            offset_fmt, offset_size, count_fmt, count_size, entry_size = "I", 4, "H", 2, 12
+        elif version == 43:
+            # BigTIFF, 8 byte offsets
+            _read(f, endian + "HH", 4)
+            offset_fmt, offset_size, count_fmt, count_size, entry_size = "Q", 8, "Q", 8, 20
+        else:
+            raise TiffError("'{}' is not a TIFF file".format(path))
+        ifd_offset, = _read(f, endian + offset_fmt, offset_size)
+        tags = dict()
+        n_pages = 0
+        seen = set()
+        while ifd_offset != 0 and ifd_offset not in seen and n_pages < MAX_PAGES:
+            seen.add(ifd_offset)
+            f.seek(ifd_offset)
+            n_entries, = _read(f, endian + count_fmt, count_size)
+            if n_pages == 0:
+                for _ in range(n_entries):
+                    entry = f.read(entry_size)
+                    if len(entry) != entry_size:
+                        raise TiffError("unexpected end of file")
+                    tag, tag_type = struct.unpack(endian + "HH", entry[:4])
+                    if tag_type in TAG_TYPES:
+                        fmt, size = TAG_TYPES[tag_type]
+                        count, = struct.unpack(endian + offset_fmt, entry[4:4 + offset_size])
+                        value = entry[4 + offset_size:]
+                        if count * size > offset_size:
+                            # values which don't fit in the entry are stored
+                            # at an offset, e.g BitsPerSample of an RGB image
+                            position = f.tell()
+                            f.seek(struct.unpack(endian + offset_fmt, value)[0])
+                            value = f.read(size)
+                            f.seek(position)
+                        tags[tag], = struct.unpack(endian + fmt, value[:size])
+            else:
+                f.seek(n_entries * entry_size, 1)
+            n_pages += 1
+            ifd_offset, = _read(f, endian + offset_fmt, offset_size)
+    if IMAGE_WIDTH not in tags or IMAGE_LENGTH not in tags:
+        raise TiffError("'{}' has no image dimensions".format(path))
+    return TiffHeader(
+        width=tags[IMAGE_WIDTH],
+        height=tags[IMAGE_LENGTH],
+        bits_per_sample=tags.get(BITS_PER_SAMPLE, 1),
+        samples_per_pixel=tags.get(SAMPLES_PER_PIXEL, 1),
+        n_pages=n_pages
+    )
@@ -1,5 +1,6 @@
 import os
 import collections
+import math
 
 
 def make_dir(directory):
@@ -57,7 +58,8 @@ def prefix_filepaths(dataframe, name, location):
     dataframe: pandas.DataFrame
         a loaddata dataframe
     name: string
-        name of individual job
+        name of individual job, or its path relative to img_data in a
+        sharded layout, see `commands.task_relpath`
     location: string
         path prefix to where the images will be stored after staging
 
@@ -129,3 +131,32 @@ def make_executable(filepath):
     st = os.stat(filepath)
     os.chmod(filepath, st.st_mode | 0o111)
 
+
+def compact_ranges(integers):
+    """
+    summarise integers as a compact string of ranges, e.g [1, 2, 3, 7] -> "1-3,7"
+
+    Parameters:
+    -----------
+    integers: iterable of ints
+
+    Returns:
+    --------
+    string
+    """
+    ranges = []
+    for i in sorted(set(integers)):
+        if ranges and i == ranges[-1][1] + 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ",".join(
+        str(start) if start == stop else "{}-{}".format(start, stop)
+        for start, stop in ranges
+    )
+
+
+def format_h_rt(seconds):
+    """seconds as a HH:MM:SS runtime request, rounded up to the minute"""
+    minutes = int(math.ceil(seconds / 60.0))
+    return "{:02d}:{:02d}:00".format(minutes // 60, minutes % 60)
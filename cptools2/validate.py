@@ -0,0 +1,239 @@
+"""
+Check the image files of a job before it's submitted, so a corrupt or
+truncated TIFF from an interrupted transfer is found now rather than as a
+CellProfiler crash part way through the run.
+
+Each image (or a random sample of them) is checked in a thread pool:
+
+    - it isn't empty, or much smaller than the most common size of the
+      images in its plate
+    - it starts with the TIFF magic bytes
+    - the offset of its first image file directory is inside the file
+
+Only the first few bytes of each file are read. The results are cached in
+`commands_location`/.validate_cache by path, modification time and size, so
+validating the same images again only costs a `stat` per image.
+"""
+
+import os
+import random
+import struct
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from cptools2 import commands
+from cptools2 import loaddata
+
+
+CACHE_NAME = ".validate_cache"
+REPORT_NAME = "bad_images.txt"
+DEFAULT_WORKERS = 16
+# images smaller than this fraction of their plate's most common size are
+# reported as truncated
+MIN_SIZE_FRACTION = 0.9
+# byte order mark and version: (offset format, header size)
+TIFF_MAGIC = {
+    b"II*\x00": ("<I", 8),
+    b"MM\x00*": (">I", 8),
+    b"II+\x00": ("<Q", 16),
+    b"MM\x00+": (">Q", 16),
+}
+
+ImageCheck = namedtuple("ImageCheck", ["path", "mtime", "size", "problem"])
+BadImage = namedtuple("BadImage", ["path", "plate", "task", "problem"])
+
+
+def check_header(path, size):
+    """
+    check a file looks like a TIFF from its first 16 bytes
+
+    Parameters:
+    -----------
+    path: string
+    size: int
+        size of the file in bytes
+
+    Returns:
+    --------
+    string describing the problem, or None if there isn't one
+    """
+    if size == 0:
+        return "empty file"
+    with open(path, "rb") as f:
+        header = f.read(16)
+    magic = header[:4]
+    if magic not in TIFF_MAGIC:
+        return "not a TIFF file"
+    offset_fmt, header_size = TIFF_MAGIC[magic]
+    offset_start = header_size - struct.calcsize(offset_fmt)
+    if len(header) < header_size:
+        return "truncated header"
+    ifd_offset, = struct.unpack(offset_fmt, header[offset_start:header_size])
+    # the IFD starts with its number of entries, at least 2 bytes
+    if ifd_offset < header_size or ifd_offset + 2 > size:
+        return "IFD offset {} outside of the file".format(ifd_offset)
+    return None
+
+
+def check_image(path, cached=None):
+    """
+    stat an image and check its header, unless `cached` has the same
+    modification time and size
+
+    Parameters:
+    -----------
+    path: string
+    cached: ImageCheck (optional)
+        the previous check of this path
+
+    Returns:
+    --------
+    ImageCheck
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ImageCheck(path, None, None, "missing")
+    mtime = int(stat.st_mtime * 1e6)
+    if cached is not None and cached.mtime == mtime and cached.size == stat.st_size:
+        return cached
+    try:
+        problem = check_header(path, stat.st_size)
+    except (IOError, OSError) as err:
+        problem = "unreadable: {}".format(err)
+    return ImageCheck(path, mtime, stat.st_size, problem)
+
+
+def read_cache(commands_location):
+    """
+    the previous checks saved by `write_cache`
+
+    Returns:
+    --------
+    dictionary of path: ImageCheck
+    """
+    cache = dict()
+    path = os.path.join(commands_location, CACHE_NAME)
+    if not os.path.isfile(path):
+        return cache
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 4:
+                continue
+            image, mtime, size, problem = fields
+            cache[image] = ImageCheck(image, int(mtime), int(size), problem or None)
+    return cache
+
+
+def write_cache(commands_location, checks):
+    """save the checks of the images that exist, for the next validation"""
+    path = os.path.join(commands_location, CACHE_NAME)
+    with open(path + ".tmp", "w") as f:
+        for check in checks:
+            if check.mtime is not None:
+                f.write("{}\t{}\t{}\t{}\n".format(
+                    check.path, check.mtime, check.size, check.problem or ""
+                ))
+    os.replace(path + ".tmp", path)
+
+
+def job_images(jobber):
+    """
+    every image of a job and the task it belongs to, after
+    `Job.create_commands` has created the LoadData dataframes
+
+    Returns:
+    --------
+    dictionary of plate: list of (path, task name) tuples
+    """
+    images = dict()
+    for plate in sorted(jobber.loaddata_store):
+        # relative (ImageXpress) paths are relative to the experiment
+        root = os.path.dirname(jobber.plate_store[plate][0])
+        dataframes = jobber.loaddata_store[plate]
+        if not isinstance(dataframes, list):
+            dataframes = [dataframes]
+        images[plate] = [
+            (path, commands.task_name(plate, job_num))
+            for job_num, dataframe in enumerate(dataframes)
+            for path in loaddata.image_paths(dataframe, root)
+        ]
+    return images
+
+
+def modal_size(checks):
+    """the most common size of the images which exist, or None"""
+    sizes = Counter(i.size for i in checks if i.size is not None)
+    if not sizes:
+        return None
+    return sizes.most_common(1)[0][0]
+
+
+def validate_job(jobber, commands_location, sample=1.0, workers=DEFAULT_WORKERS,
+                 seed=None, min_size_fraction=MIN_SIZE_FRACTION):
+    """
+    check the images of a job
+
+    Parameters:
+    -----------
+    jobber: job.Job
+        after `create_commands`
+    commands_location: string
+        where the cache is kept
+    sample: float (default = 1.0)
+        fraction of each plate's images to check
+    workers: int
+        number of images to check at once
+    seed: int (optional)
+        for the random sample
+    min_size_fraction: float
+        images smaller than this fraction of their plate's most common size
+        are reported as truncated
+
+    Returns:
+    --------
+    tuple of (number of images checked, list of BadImage)
+    """
+    images = job_images(jobber)
+    rng = random.Random(seed)
+    if sample < 1:
+        for plate in sorted(images):
+            n_sample = max(1, int(round(sample * len(images[plate]))))
+            images[plate] = rng.sample(images[plate], min(n_sample, len(images[plate])))
+    cache = read_cache(commands_location)
+    paths = [path for plate in sorted(images) for path, _ in images[plate]]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        checks = list(executor.map(lambda i: check_image(i, cache.get(i)), paths))
+    cache.update((i.path, i) for i in checks)
+    write_cache(commands_location, cache.values())
+    checks = dict((i.path, i) for i in checks)
+    bad_images = []
+    for plate in sorted(images):
+        plate_checks = [checks[path] for path, _ in images[plate]]
+        plate_size = modal_size(plate_checks)
+        for (path, task), check in zip(images[plate], plate_checks):
+            problem = check.problem
+            if problem is None and check.size < plate_size * min_size_fraction:
+                problem = "{} bytes, most images in the plate are {}".format(
+                    check.size, plate_size
+                )
+            if problem is not None:
+                bad_images.append(BadImage(path, plate, task, problem))
+    return len(paths), bad_images
+
+
+def write_report(commands_location, bad_images):
+    """
+    write the bad images as a tab-separated file, one image per line
+
+    Returns:
+    --------
+    string, path to the report
+    """
+    path = os.path.join(commands_location, REPORT_NAME)
+    with open(path, "w") as f:
+        f.write("task\tplate\tpath\tproblem\n")
+        for image in sorted(bad_images, key=lambda i: (i.task, i.path)):
+            f.write("{}\t{}\t{}\t{}\n".format(image.task, image.plate, image.path, image.problem))
+    return path
@@ -1,13 +1,19 @@
+import re
 from setuptools import setup
 
 
+def read_version():
+    with open("cptools2/__init__.py", "r") as f:
+        return re.search(r'^__version__ = "(.+)"$', f.read(), re.M).group(1)
+
+
 def read_requirements():
     with open("requirements.txt", "r") as f:
         return [i.strip() for i in f.readlines()]
 
 
 setup(name="cptools2",
-      version=0.1,
+      version=read_version(),
       url="https://github.com/swarchal/cptools2",
       description="Tools for running CellProfiler on HPC setups",
       author="Scott Warchal",
@@ -18,4 +24,5 @@ setup(name="cptools2",
       entry_points={
           "console_scripts": ["cptools2 = cptools2.__main__:main"]
           },
-      install_requires=read_requirements())
+      install_requires=read_requirements(),
+      extras_require={"merge": ["pyarrow"]})
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pandas as pd
+from cptools2 import aggregate
+from cptools2 import merge
+
+
+def make_outputs(tmpdir, n_cells=50):
+    """
+    fake cellprofiler output for one plate split over two tasks, with well
+    A01 in both tasks
+    """
+    rng = np.random.RandomState(0)
+    tasks = []
+    cells_all = []
+    for job_num, wells in enumerate([["A01", "A02"], ["A01", "B01"]]):
+        name = "plate_a_{}".format(job_num)
+        output = tmpdir.mkdir(name)
+        image = pd.DataFrame({
+            "ImageNumber": [1, 2],
+            "Metadata_plate": ["plate_a", "plate_a"],
+            "Metadata_well": wells,
+            "Count_Cells": [n_cells, n_cells],
+        })
+        image_number = np.repeat([1, 2], n_cells)
+        cells = pd.DataFrame({
+            "ImageNumber": image_number,
+            "ObjectNumber": np.tile(np.arange(1, n_cells + 1), 2),
+            "AreaShape_Area": rng.lognormal(size=2 * n_cells),
+            "Intensity_MeanIntensity_DNA": rng.normal(size=2 * n_cells),
+        })
+        cells.loc[::9, "Intensity_MeanIntensity_DNA"] = np.nan
+        image.to_csv(str(output.join("Image.csv")), index=False)
+        cells.to_csv(str(output.join("Cells.csv")), index=False)
+        cells["Metadata_well"] = image.set_index("ImageNumber").Metadata_well[image_number].values
+        cells_all.append(cells)
+        tasks.append(merge.TaskOutput(name, "plate_a", str(output)))
+    return tasks, pd.concat(cells_all)
+
+
+def test_running_moments_merge():
+    rng = np.random.RandomState(1)
+    values = rng.normal(size=(1000, 3))
+    values[::5, 0] = np.nan
+    a = aggregate.RunningMoments(3)
+    b = aggregate.RunningMoments(3)
+    a.update(values[:300])
+    b.update(values[300:700])
+    b.update(values[700:])
+    a.merge(b)
+    assert np.allclose(a.get_mean(), np.nanmean(values, axis=0))
+    assert np.allclose(a.variance(), np.nanvar(values, axis=0, ddof=1))
+
+
+def test_quantile_sketch():
+    rng = np.random.RandomState(2)
+    values = rng.lognormal(size=(50000, 2))
+    sketch = aggregate.QuantileSketch(2, size=200, seed=0)
+    other = aggregate.QuantileSketch(2, size=200, seed=1)
+    for i in range(0, 30000, 1000):
+        sketch.update(values[i:i + 1000])
+    other.update(values[30000:])
+    sketch.merge(other)
+    # memory is bounded by the sketch size, not the number of values
+    assert sum(i.shape[0] for i in sketch.levels) < 3 * 200
+    for q in [0.1, 0.5, 0.9]:
+        estimate = sketch.quantile(q)
+        # rank of the estimate within the true values
+        rank = (values < estimate).mean(axis=0)
+        assert np.all(np.abs(rank - q) < 0.02)
+    # exact while smaller than the sketch
+    small = aggregate.QuantileSketch(2, size=200)
+    small.update(values[:100])
+    assert np.allclose(small.median(), np.median(values[:100], axis=0))
+
+
+def test_aggregate(tmpdir):
+    tasks, cells = make_outputs(tmpdir)
+    out_dir = str(tmpdir.join("aggregated"))
+    paths = aggregate.aggregate(tasks, out_dir, workers=2, chunksize=17)
+    assert [os.path.basename(i) for i in paths] == [
+        "mean.csv", "variance.csv", "median.csv", "mad.csv"
+    ]
+    features = ["AreaShape_Area", "Intensity_MeanIntensity_DNA"]
+    grouped = cells.groupby("Metadata_well")[features]
+    expected = {
+        "mean": grouped.mean(),
+        "variance": grouped.var(),
+        "median": grouped.median(),
+        "mad": grouped.agg(lambda x: (x - x.median()).abs().median()),
+    }
+    for statistic, path in zip(aggregate.STATISTICS, paths):
+        profiles = pd.read_csv(path).set_index("Metadata_well")
+        assert list(profiles.index) == ["A01", "A02", "B01"]
+        assert list(profiles.Count_Cells) == [100, 50, 50]
+        assert list(profiles.Count_Image) == [2, 1, 1]
+        for feature in features:
+            assert np.allclose(
+                profiles["Cells_" + feature], expected[statistic][feature], rtol=1e-5
+            )
+        assert "Cells_ObjectNumber" not in profiles.columns
@@ -0,0 +1,114 @@
+import os
+import subprocess
+import textwrap
+import pytest
+from benchmarks import synthetic
+from cptools2 import batch
+from cptools2 import filelist
+from cptools2 import job
+from cptools2 import manifest
+from cptools2 import parse_config
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def write_config(tmpdir, name, body):
+    location = str(tmpdir.join(name))
+    config = tmpdir.join(name + ".yml")
+    config.write(textwrap.dedent(body).format(pipeline=PIPELINE, location=location))
+    return str(config), location
+
+
+def make_configs(tmpdir):
+    """two configs using the same experiment, the second also adding plates"""
+    exp_1 = synthetic.make_experiment(
+        str(tmpdir.join("exp_1")), "yokogawa", n_plates=2, n_wells=4, n_sites=2, n_channels=2
+    )
+    exp_2 = synthetic.make_experiment(
+        str(tmpdir.join("exp_2")), "yokogawa", n_plates=3, n_wells=4, n_sites=2, n_channels=2
+    )
+    measurement = "screen-name-batch1_20190101_120000"
+    config_a = write_config(tmpdir, "a", """\
+        experiment: {exp}
+        chunk: 4
+        pipeline: {{pipeline}}
+        location: {{location}}
+        commands location: {{location}}
+        microscope: yokogawa
+        """.format(exp=exp_1))
+    config_b = write_config(tmpdir, "b", """\
+        add plate:
+            - experiment: {exp_1}
+            - plates: A000001-PC
+            - experiment: {exp_2}
+            - plates:
+                - A000002-PC
+                - A000003-PC
+        chunk: 4
+        pipeline: {{pipeline}}
+        location: {{location}}
+        commands location: {{location}}
+        microscope: yokogawa
+        """.format(exp_1=os.path.join(exp_1, measurement), exp_2=os.path.join(exp_2, measurement)))
+    return config_a, config_b
+
+
+def test_run_batch(tmpdir, monkeypatch):
+    (path_a, location_a), (path_b, location_b) = make_configs(tmpdir)
+    scanned = []
+    files_from_plate = filelist.Filelist.files_from_plate
+
+    def counting_files_from_plate(self, plate_dir):
+        scanned.append(os.path.basename(plate_dir))
+        return files_from_plate(self, plate_dir)
+
+    monkeypatch.setattr(filelist.Filelist, "files_from_plate", counting_files_from_plate)
+    configs = [parse_config.Config(path_a), parse_config.Config(path_b)]
+    plate_stores = dict()
+
+    def create_job(config, filelister):
+        jobber = job.Job(config.microscope, filelister=filelister)
+        if config.experiment is not None:
+            jobber.add_experiment(config.experiment)
+        for add_plate in config.add_plate or []:
+            jobber.add_plate(**add_plate)
+        plate_stores[config.yaml_path] = jobber.plate_store
+
+    errors = batch.run_batch(configs, create_job, workers=4)
+    assert errors == [None, None]
+    assert sorted(plate_stores[path_a]) == ["A000001-PC", "A000002-PC"]
+    assert sorted(plate_stores[path_b]) == ["A000001-PC", "A000002-PC", "A000003-PC"]
+    # exp_1/A000001-PC is used by both configs but only scanned once
+    assert sorted(scanned) == ["A000001-PC", "A000002-PC", "A000002-PC", "A000003-PC"]
+
+
+def test_run_batch_same_location(tmpdir):
+    (path_a, _), _ = make_configs(tmpdir)
+    configs = [parse_config.Config(path_a), parse_config.Config(path_a)]
+    with pytest.raises(ValueError):
+        batch.run_batch(configs, lambda config, filelister: None)
+
+
+def test_batch_command(tmpdir):
+    """cptools2 batch a.yml b.yml"""
+    (path_a, location_a), (path_b, location_b) = make_configs(tmpdir)
+    env = dict(os.environ, SGE_CLUSTER_NAME="idrs")
+    return_val = subprocess.call(["cptools2", "batch", path_a, path_b], env=env)
+    assert return_val == 0
+    # 4 wells * 2 sites per plate, in chunks of 4
+    assert manifest.count_tasks(location_a) == 2 * 2
+    assert manifest.count_tasks(location_b) == 3 * 2
+    # a broken config fails without stopping the others
+    path_c, _ = write_config(tmpdir, "c", """\
+        experiment: /does/not/exist
+        chunk: 4
+        pipeline: {pipeline}
+        location: {location}
+        commands location: {location}
+        microscope: yokogawa
+        """)
+    os.remove(os.path.join(location_a, manifest.MANIFEST_NAME))
+    return_val = subprocess.call(["cptools2", "batch", path_a, path_c], env=env)
+    assert return_val == 1
+    assert manifest.count_tasks(location_a) == 2 * 2
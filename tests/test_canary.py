@@ -0,0 +1,103 @@
+import os
+import subprocess
+from cptools2 import canary
+from cptools2 import manifest
+
+
+def make_job(tmpdir):
+    """two plates of 3 tasks, the second plate with a different channel layout"""
+    commands_location = tmpdir.mkdir("commands")
+    loaddata = tmpdir.mkdir("loaddata")
+    tasks = []
+    for i in range(1, 7):
+        plate = "plate_a" if i <= 3 else "plate_b"
+        name = "{}_{}".format(plate, (i - 1) % 3)
+        loaddata_path = loaddata.join(name + ".csv")
+        columns = "FileName_W1,FileName_W2" if i <= 3 else "FileName_W1,FileName_W3"
+        loaddata_path.write("Metadata_well,{}\n".format(columns))
+        tasks.append(manifest.Task(
+            task_id=i, name=name, plate=plate,
+            # the last chunk of each plate is the smallest
+            n_imagesets=2 if i in (3, 6) else 10,
+            loaddata=str(loaddata_path),
+            output=str(tmpdir.join("raw_data", name)),
+            command="false" if i == 3 else "echo {}".format(name)
+        ))
+    manifest.write_manifest(str(commands_location), tasks)
+    return str(commands_location), str(tmpdir.mkdir("logfiles")), tasks
+
+
+def test_select_canary_tasks(tmpdir):
+    _, _, tasks = make_job(tmpdir)
+    assert canary.select_canary_tasks(tasks, "plate") == [3, 6]
+    assert canary.select_canary_tasks(tasks, "layout") == [3, 6]
+    # all one layout
+    assert canary.select_canary_tasks(tasks[:3], "layout") == [3]
+
+
+def test_make_canary_scripts_sge(tmpdir):
+    commands_location, logfile_location, _ = make_job(tmpdir)
+    os.environ["SGE_CLUSTER_NAME"] = "idrs"
+    scripts = canary.make_canary_scripts(commands_location, logfile_location)
+    with open(scripts["canary"]) as f:
+        canary_script = f.read()
+    with open(scripts["analysis"]) as f:
+        analysis_script = f.read()
+    assert "#$ -t 1-2" in canary_script
+    assert "exit 100" in canary_script
+    canary_name = [i for i in canary_script.splitlines() if i.startswith("#$ -N")][0][6:]
+    assert canary_name.startswith("canary_")
+    assert "#$ -t 1-4" in analysis_script
+    assert "#$ -hold_jid {}".format(canary_name) in analysis_script
+    assert manifest.read_task_list(os.path.join(commands_location, "canary_tasks.txt")) == [3, 6]
+    assert manifest.read_task_list(os.path.join(commands_location, "analysis_tasks.txt")) == [1, 2, 4, 5]
+    with open(scripts["submit"]) as f:
+        assert f.read().splitlines()[1:] == [
+            "qsub {}".format(scripts["canary"]), "qsub {}".format(scripts["analysis"])
+        ]
+    # a failing canary task exits with 100, a successful one with 0
+    bin_dir = tmpdir.mkdir("bin")
+    for name, body in [("singularity", 'shift 2\n"$@"'), ("module", "true")]:
+        stub = bin_dir.join(name)
+        stub.write("#!/bin/sh\n" + body + "\n")
+        stub.chmod(0o755)
+    for task_id, expected in [("1", 100), ("2", 0)]:
+        env = dict(os.environ, PATH=str(bin_dir) + os.pathsep + os.environ["PATH"],
+                   SGE_TASK_ID=task_id, JOB_ID="100")
+        assert subprocess.call(["bash", scripts["canary"]], env=env) == expected
+
+
+def test_make_canary_scripts_slurm(tmpdir):
+    commands_location, logfile_location, _ = make_job(tmpdir)
+    scripts = canary.make_canary_scripts(commands_location, logfile_location, scheduler="slurm")
+    with open(scripts["canary"]) as f:
+        assert "exit $RETURN_VAL" in f.read()
+    with open(scripts["analysis"]) as f:
+        assert "--dependency" not in f.read()
+    with open(scripts["submit"]) as f:
+        assert "sbatch --dependency=afterok:$CANARY_JOB {}".format(scripts["analysis"]) in f.read()
+
+
+def test_canary_resources(tmpdir):
+    """the canary tasks get the same limits as the analysis tasks"""
+    commands_location, logfile_location, _ = make_job(tmpdir)
+    os.environ["SGE_CLUSTER_NAME"] = "idrs"
+    scripts = canary.make_canary_scripts(
+        commands_location, logfile_location, max_running=2, runtime="02:00:00", memory="4G"
+    )
+    for name in ["canary", "analysis"]:
+        with open(scripts[name]) as f:
+            text = f.read()
+        for line in ["#$ -l h_rt=02:00:00", "#$ -l h_vmem=4G", "#$ -tc 2"]:
+            assert line in text
+
+
+def test_every_task_a_canary(tmpdir):
+    commands_location, logfile_location, tasks = make_job(tmpdir)
+    manifest.write_manifest(commands_location, [tasks[0]])
+    os.environ["SGE_CLUSTER_NAME"] = "idrs"
+    scripts = canary.make_canary_scripts(commands_location, logfile_location)
+    assert scripts["canary"] is None
+    assert scripts["submit"] is None
+    with open(scripts["analysis"]) as f:
+        assert "hold_jid" not in f.read()
@@ -0,0 +1,146 @@
+import os
+import pytest
+from cptools2 import collate
+from cptools2 import manifest
+from cptools2 import status
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.parquet
+
+
+def make_job(tmpdir):
+    """two plates of two tasks, each task with an Image table"""
+    commands_location = tmpdir.mkdir("commands")
+    logfile_location = tmpdir.mkdir("logfiles")
+    tasks = []
+    for i, (plate, job_num) in enumerate([("p1", 0), ("p1", 1), ("p2", 0), ("p2", 1)], 1):
+        name = "{}_{}".format(plate, job_num)
+        output = tmpdir.join("raw_data", name)
+        output.ensure(dir=True)
+        output.join("Image.csv").write(
+            "ImageNumber,Metadata_well,Intensity\n1,A01,{0}.5\n2,A02,{0}.25\n".format(i)
+        )
+        tasks.append(manifest.Task(
+            task_id=i, name=name, plate=plate, n_imagesets=2,
+            loaddata="{}.csv".format(name), output=str(output), command="true"
+        ))
+    manifest.write_manifest(str(commands_location), tasks)
+    return str(commands_location), str(logfile_location), tasks
+
+
+def finish(logfile_location, task_ids, log="abc123.log"):
+    for task_id in task_ids:
+        status.append_status_line(
+            os.path.join(logfile_location, log),
+            status.format_status_line("99", task_id, status.FINISHED)
+        )
+
+
+def test_status_tail_partial_lines(tmpdir):
+    log = tmpdir.join("abc123.log")
+    tail = collate.StatusTail(str(tmpdir))
+    line = status.format_status_line("99", 1, status.FINISHED)
+    log.write(line + "\n" + line[:10])
+    assert [i.task_id for i in tail.poll()] == [1]
+    assert tail.poll() == []
+    # the rest of the partially written line is picked up on the next poll
+    log.write(line[10:] + "\n", mode="a")
+    assert [i.task_id for i in tail.poll()] == [1]
+
+
+def test_collate(tmpdir):
+    commands_location, logfile_location, tasks = make_job(tmpdir)
+    out_dir = str(tmpdir.join("merged"))
+    collator = collate.Collator(commands_location, logfile_location, out_dir, workers=1)
+    assert collator.poll() == 0
+    # a failed task isn't merged
+    finish(logfile_location, [1, 3])
+    status.append_status_line(
+        os.path.join(logfile_location, "abc123.log"),
+        status.format_status_line("99", 2, "Failed with error code: 1")
+    )
+    assert collator.poll() == 2
+    p1 = os.path.join(out_dir, "Image", "plate=p1")
+    assert sorted(os.listdir(p1)) == ["p1_0.parquet"]
+    # the rest of plate 1 finishes, so its tasks are compacted
+    finish(logfile_location, [2], log="def456.log")
+    assert collator.poll() == 1
+    assert os.listdir(p1) == ["p1.parquet"]
+    table = pyarrow.parquet.read_table(os.path.join(p1, "p1.parquet"))
+    assert table.column("task").to_pylist() == ["p1_0", "p1_0", "p1_1", "p1_1"]
+    assert table.column("Intensity").to_pylist() == [1.5, 1.25, 2.5, 2.25]
+    assert not collator.complete()
+
+
+def test_collate_resume(tmpdir):
+    """a new collator picks up from the state file without re-merging"""
+    commands_location, logfile_location, tasks = make_job(tmpdir)
+    out_dir = str(tmpdir.join("merged"))
+    finish(logfile_location, [1, 2, 3])
+    collate.Collator(commands_location, logfile_location, out_dir, workers=1).poll()
+    finish(logfile_location, [4])
+    collator = collate.Collator(commands_location, logfile_location, out_dir, workers=1)
+    merged = []
+    original_merge_tasks = collator.merge_tasks
+
+    def merge_tasks(to_merge):
+        merged.extend(task.task_id for task in to_merge)
+        original_merge_tasks(to_merge)
+
+    collator.merge_tasks = merge_tasks
+    collator.run(follow=True, poll_interval=0)
+    assert merged == [4]
+    assert collator.complete()
+    for plate in ["p1", "p2"]:
+        partition = os.path.join(out_dir, "Image", "plate={}".format(plate))
+        assert os.listdir(partition) == ["{}.parquet".format(plate)]
+    dataset = pyarrow.parquet.read_table(os.path.join(out_dir, "Image"))
+    assert dataset.num_rows == 8
+
+
+def test_collate_failed(tmpdir):
+    """following stops once every task has finished or failed"""
+    commands_location, logfile_location, tasks = make_job(tmpdir)
+    manifest.add_job(commands_location, "abc123")
+    out_dir = str(tmpdir.join("merged"))
+    # a log from an earlier job isn't read
+    finish(logfile_location, [4], log="old999.log")
+    finish(logfile_location, [1, 2])
+    status.append_status_line(
+        os.path.join(logfile_location, "abc123.log"),
+        status.format_status_line("99", 3, "Failed with error code: 1")
+    )
+    # finished, but without any output
+    os.remove(os.path.join(tasks[3].output, "Image.csv"))
+    finish(logfile_location, [4])
+    collator = collate.Collator(commands_location, logfile_location, out_dir, workers=1)
+    tail = collate.StatusTail(logfile_location, commands_location)
+    assert [os.path.basename(i) for i in tail.find_logs()] == ["abc123.log"]
+    collator.run(follow=True, poll_interval=0)
+    assert collator.job_finished()
+    assert not collator.complete()
+    assert collator.failed() == [3, 4]
+    assert collator.state.merged == {"p1_0", "p1_1"}
+    # the failed task is resubmitted and succeeds
+    manifest.add_job(commands_location, "def456")
+    finish(logfile_location, [3], log="def456.log")
+    collator.poll()
+    assert collator.failed() == [4]
+
+
+def test_compact_mixed_types(tmpdir):
+    """a column inferred as numbers in one task and text in another"""
+    commands_location, logfile_location, tasks = make_job(tmpdir)
+    tmpdir.join("raw_data", "p1_0", "Image.csv").write(
+        "ImageNumber,Metadata_well,Intensity,Treatment\n1,A01,1.5,3\n2,A02,1.25,\n"
+    )
+    tmpdir.join("raw_data", "p1_1", "Image.csv").write(
+        "ImageNumber,Metadata_well,Intensity,Treatment\n1,A01,2.5,DMSO\n2,A02,2.25,\n"
+    )
+    out_dir = str(tmpdir.join("merged"))
+    finish(logfile_location, [1, 2])
+    collate.Collator(commands_location, logfile_location, out_dir, workers=1).poll()
+    table = pyarrow.parquet.read_table(os.path.join(out_dir, "Image", "plate=p1", "p1.parquet"))
+    assert table.schema.field("Treatment").type == pyarrow.string()
+    assert table.column("Treatment").to_pylist() == ["3", None, "DMSO", None]
+    assert table.schema.field("ImageNumber").type == pyarrow.int64()
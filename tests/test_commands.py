@@ -1,4 +1,6 @@
 import os
+import pandas as pd
+import pytest
 from cptools2 import commands
 
 CURRENT_PATH = os.path.dirname(__file__)
@@ -26,3 +28,42 @@ def make_rsync_cmnd():
     cmnd = commands.make_rsync_cmnd(plate_loc, filelist_name, img_location)
     correct = "rsync --files-from=/path/to/filelist /plate_location /path/to/images"
     assert cmnd == correct
+
+
+def test_task_name():
+    """commands.task_name() and commands.split_task_name()"""
+    name = commands.task_name("plate_with_underscores", 12)
+    assert name == "plate_with_underscores_12"
+    assert commands.split_task_name(name) == ("plate_with_underscores", 12)
+    assert commands.split_task_name("not-a-task") is None
+    assert commands.split_task_name("plate_x") is None
+
+
+def test_layouts(tmpdir):
+    name = commands.task_name("plate_1", 3)
+    location = "/path/to/test_location"
+    assert commands.loaddata_path(name, location) == os.path.join(location, "loaddata", "plate_1_3.csv")
+    assert commands.output_path(name, location, "plate") == os.path.join(location, "raw_data", "plate_1", "plate_1_3")
+    shard = commands.shard(name, "hash")
+    assert len(shard.split(os.sep)) == commands.HASH_LEVELS
+    assert shard == commands.shard(name, "hash")
+    assert commands.loaddata_path(name, location, "hash") == os.path.join(location, "loaddata", shard, "plate_1_3.csv")
+    cmnd = commands.make_cp_cmnd(name, "pipeline.cppipe", location, "/output", layout="plate")
+    assert "--data-file={}/loaddata/plate_1/plate_1_3.csv".format(location) in cmnd
+    with pytest.raises(ValueError):
+        commands.shard(name, "nested")
+    # staged image paths are sharded the same way
+    location = str(tmpdir)
+    commands.make_shard_directories(location, "plate_1")
+    dataframe = pd.DataFrame({"FileName_W1": ["a.tif"], "PathName_W1": ["plate_1"]})
+    commands.write_loaddata(name, location, dataframe, layout="plate")
+    written = pd.read_csv(commands.loaddata_path(name, location, "plate"))
+    assert written["PathName_W1"][0] == os.path.join(location, "img_data", "plate_1", name, "plate_1")
+    # plate directories named like tasks aren't mistaken for task output
+    raw_data = tmpdir.join("raw_data")
+    for job_num in range(2):
+        raw_data.join("plate_1", commands.task_name("plate_1", job_num)).ensure(dir=True)
+    found = commands.find_task_directories(str(raw_data), "plate")
+    assert [i[0] for i in found] == ["plate_1_0", "plate_1_1"]
+    assert found[0][1] == str(raw_data.join("plate_1", "plate_1_0"))
+    assert [i[0] for i in commands.find_task_directories(str(raw_data))] == ["plate_1"]
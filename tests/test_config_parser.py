@@ -1,4 +1,5 @@
 import os
+import textwrap
 import pytest
 from cptools2 import parse_config
 
@@ -31,8 +32,30 @@ def test_chunk():
 
 def test_add_plate():
     config = parse_config.Config(TEST_PATH)
-    assert config.add_plate == {"exp_dir" : "/path/to/new/experiment",
-                                "plates" : ["plate_3", "plate_4"]}
+    assert config.add_plate == [{"exp_dir" : "/path/to/new/experiment",
+                                 "plates" : ["plate_3", "plate_4"]}]
+
+
+def test_add_plate_multiple_experiments(tmpdir):
+    config_path = tmpdir.join("config.yml")
+    config_path.write(textwrap.dedent("""\
+        add plate:
+            - experiment: /path/to/experiment_1
+            - plates:
+                - plate_1
+                - plate_2
+            - experiment: /path/to/experiment_2
+              plates: plate_3
+        chunk: 46
+        pipeline: tests/example_pipeline.cppipe
+        location: /example/location
+        commands location: /home/user
+        """))
+    config = parse_config.Config(str(config_path))
+    assert config.add_plate == [
+        {"exp_dir": "/path/to/experiment_1", "plates": ["plate_1", "plate_2"]},
+        {"exp_dir": "/path/to/experiment_2", "plates": ["plate_3"]},
+    ]
 
 
 def test_remove_plate():
@@ -49,6 +72,168 @@ def test_create_commands():
         "commands_location" : "/home/user",
         "job_size": 46,
         "channel_dict": None,
+        "task_order": "plate",
+        "layout": "flat",
+        "incomplete": "fail",
     }
     assert config.create_command_args() == expected
 
+
+
+def test_scheduler():
+    config = parse_config.Config(TEST_PATH)
+    assert config.scheduler == "sge"
+    assert config.max_running is None
+
+
+def test_invalid_scheduler(tmpdir):
+    config_path = tmpdir.join("config.yml")
+    config_path.write("location: /example\ncommands location: /example\nscheduler: pbs\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_task_order(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.task_order == "plate"
+    config_path = tmpdir.join("config.yml")
+    config_path.write("location: /example\ncommands location: /example\ntask order: Bytes\n")
+    assert parse_config.Config(str(config_path)).task_order == "bytes"
+    config_path.write("location: /example\ncommands location: /example\ntask order: size\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_canary(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.canary is None
+    config_path = tmpdir.join("config.yml")
+    for value, expected in [("true", "plate"), ("false", None), ("layout", "layout")]:
+        config_path.write("location: /example\ncommands location: /example\ncanary: {}\n".format(value))
+        assert parse_config.Config(str(config_path)).canary == expected
+    config_path.write("location: /example\ncommands location: /example\ncanary: well\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_circuit_breaker(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.circuit_breaker is None
+    config_path = tmpdir.join("config.yml")
+    config_path.write("location: /example\ncommands location: /example\ncircuit breaker: 10\n")
+    assert parse_config.Config(str(config_path)).circuit_breaker == {
+        "failures": 10, "window": 10, "hook": None
+    }
+    config_path.write(textwrap.dedent("""\
+        location: /example
+        commands location: /example
+        circuit breaker:
+            - failures: 5
+            - window: 20
+            - hook: qdel $JOB_ID
+        """))
+    assert parse_config.Config(str(config_path)).circuit_breaker == {
+        "failures": 5, "window": 20, "hook": "qdel $JOB_ID"
+    }
+    config_path.write(textwrap.dedent("""\
+        location: /example
+        commands location: /example
+        circuit breaker:
+            failures: 5
+            window: 2
+        """))
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_resources(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.resources is None
+    config_path = tmpdir.join("config.yml")
+    config_path.write("location: /example\ncommands location: /example\nresources: true\n")
+    assert parse_config.Config(str(config_path)).resources == {}
+    config_path.write(textwrap.dedent("""\
+        location: /example
+        commands location: /example
+        resources:
+            - memory headroom: 2
+            - sample: 8
+        """))
+    assert parse_config.Config(str(config_path)).resources == {
+        "memory_headroom": 2.0, "sample": 8
+    }
+    config_path.write("location: /example\ncommands location: /example\nresources:\n    - memory: 4G\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_validate(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.validate is None
+    config_path = tmpdir.join("config.yml")
+    config_path.write("location: /example\ncommands location: /example\nvalidate: true\n")
+    assert parse_config.Config(str(config_path)).validate == {}
+    config_path.write("location: /example\ncommands location: /example\nvalidate:\n    - sample: 0.1\n")
+    assert parse_config.Config(str(config_path)).validate == {"sample": 0.1}
+    config_path.write("location: /example\ncommands location: /example\nvalidate:\n    - sample: 2\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_result_cache(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.result_cache is None
+    config_path = tmpdir.join("config.yml")
+    config_path.write("location: /example\ncommands location: /example\nresult cache: true\n")
+    assert parse_config.Config(str(config_path)).result_cache == {}
+    config_path.write("location: /example\ncommands location: /example\nresult cache:\n    - workers: 4\n")
+    assert parse_config.Config(str(config_path)).result_cache == {"workers": 4}
+    config_path.write("location: /example\ncommands location: /example\nresult cache:\n    - size: 4\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_distributed_scan(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.distributed_scan is None
+    config_path = tmpdir.join("config.yml")
+    config_path.write("location: /example\ncommands location: /example\ndistributed scan: 50\n")
+    assert parse_config.Config(str(config_path)).distributed_scan == {"n_tasks": 50}
+    config_path.write(textwrap.dedent("""\
+        location: /example
+        commands location: /example
+        distributed scan:
+            - tasks: 20
+            - reduce memory: 32G
+        """))
+    assert parse_config.Config(str(config_path)).distributed_scan == {
+        "n_tasks": 20, "reduce_memory": "32G"
+    }
+    config_path.write("location: /example\ncommands location: /example\ndistributed scan:\n    - nodes: 2\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
+
+
+def test_filters(tmpdir):
+    config = parse_config.Config(TEST_PATH)
+    assert config.wells is None
+    # remove plate only applies to the experiment, not add plate
+    assert config.image_filter_args()["plates"] is None
+    assert config.removed_plates() == ["plate_1", "plate_2"]
+    config_path = tmpdir.join("config.yml")
+    config_path.write(textwrap.dedent("""\
+        location: /example
+        commands location: /example
+        plates:
+            - include: plate_*
+            - exclude: [plate_3]
+        wells: [A01-B12, C01]
+        sites: 1
+        """))
+    config = parse_config.Config(str(config_path))
+    assert config.plates == {"include": ["plate_*"], "exclude": ["plate_3"]}
+    assert config.wells == {"include": ["A01-B12", "C01"]}
+    assert config.sites == {"include": [1]}
+    config_path.write("location: /example\ncommands location: /example\nwells:\n    - only: A01\n")
+    with pytest.raises(ValueError):
+        parse_config.Config(str(config_path))
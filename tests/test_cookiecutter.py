@@ -4,6 +4,7 @@ module docstring
 
 from cptools2 import cookiecutter
 import os
+import pytest
 
 N_TASKS = 3
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -65,3 +66,85 @@ def test_SGEScript_set_tasks():
     assert task_infer.array is True
     assert task_infer.tasks == "#$ -t 1-{}".format(N_TASKS)
 
+
+
+def test_SlurmScript():
+    """test SLURM directives"""
+    my_script = cookiecutter.SlurmScript(
+        name="test_script", user="test_user", runtime="06:00:00",
+        tasks=[1, 50], max_running=10, hold_jid_ad="1234", queue="standard"
+    )
+    lines = my_script.template.split("\n")
+    # sbatch requires the shebang on the first line
+    assert lines[0] == "#!/bin/bash"
+    assert "#SBATCH --job-name=test_script" in lines
+    assert "#SBATCH --array=1-50%10" in lines
+    assert "#SBATCH --time=06:00:00" in lines
+    assert "#SBATCH --partition=standard" in lines
+    assert "#SBATCH --dependency=aftercorr:1234" in lines
+    after_ok = cookiecutter.SlurmScript(user="test_user", hold_jid="1234")
+    assert "#SBATCH --dependency=afterok:1234" in after_ok.template
+
+
+def test_SlurmScript_default_user(monkeypatch):
+    """SLURM scripts take the username from $USER off the SGE cluster"""
+    monkeypatch.setenv("USER", "slurm_user")
+    monkeypatch.delenv("SGE_CLUSTER_NAME", raising=False)
+    assert cookiecutter.SlurmScript().user == "slurm_user"
+    monkeypatch.delenv("USER")
+    with pytest.raises(cookiecutter.UserError):
+        cookiecutter.SlurmScript()
+
+
+def test_SlurmScript_loop_through_file():
+    """SLURM array jobs use $SLURM_ARRAY_TASK_ID"""
+    script_tasks = cookiecutter.SlurmScript(user="user")
+    script_tasks.loop_through_file(COMMANDS_LOC)
+    output = script_tasks.template.split("\n")
+    assert "#SBATCH --array=1-{}".format(N_TASKS) in output
+    assert 'CP_COMMAND=$(awk "NR==$SLURM_ARRAY_TASK_ID" "$CP_COMMAND_LIST")' in output
+
+
+def test_SlurmScript_submit(tmpdir):
+    """submit to a fake sbatch on the PATH"""
+    bin_dir = tmpdir.mkdir("bin")
+    args_file = tmpdir.join("sbatch_args")
+    fake_sbatch = bin_dir.join("sbatch")
+    fake_sbatch.write(
+        '#!/bin/sh\necho "$@" > {}\necho "4242;cluster"\n'.format(args_file)
+    )
+    fake_sbatch.chmod(0o755)
+    old_path = os.environ["PATH"]
+    os.environ["PATH"] = str(bin_dir) + os.pathsep + old_path
+    try:
+        script = cookiecutter.SlurmScript(user="user", tasks=4)
+        with pytest.raises(cookiecutter.SubmissionError):
+            script.submit()
+        script_path = str(tmpdir.join("script.sh"))
+        script.save(script_path)
+        job_id = script.submit()
+    finally:
+        os.environ["PATH"] = old_path
+    assert job_id == "4242"
+    assert args_file.read().split() == ["--parsable", script_path]
+
+
+def test_SGEScript_submit(tmpdir, monkeypatch):
+    """submit to a fake qsub on the PATH, returning the job ID like SLURM"""
+    bin_dir = tmpdir.mkdir("bin")
+    fake_qsub = bin_dir.join("qsub")
+    fake_qsub.write('#!/bin/sh\necho "4242.1-4:1"\n')
+    fake_qsub.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("SGE_CLUSTER_NAME", "idrs")
+    monkeypatch.setenv("HOSTNAME", "srsu476")
+    script = cookiecutter.SGEScript(user="user", tasks=4)
+    script.save(str(tmpdir.join("script.sh")))
+    assert script.submit() == "4242"
+
+
+def test_get_script_class():
+    assert cookiecutter.get_script_class("sge") is cookiecutter.SGEScript
+    assert cookiecutter.get_script_class("SLURM") is cookiecutter.SlurmScript
+    with pytest.raises(cookiecutter.ScriptError):
+        cookiecutter.get_script_class("pbs")
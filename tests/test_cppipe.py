@@ -0,0 +1,105 @@
+import os
+import textwrap
+import pandas as pd
+import pytest
+from benchmarks import synthetic
+from cptools2 import cppipe
+from cptools2 import filelist
+from cptools2 import job
+from cptools2 import parse_config
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline_channels.cppipe")
+
+
+def test_referenced_names():
+    names = cppipe.referenced_names(PIPELINE)
+    assert set(["W1", "W3", "W4", "Nuclei"]) <= names
+    # only named by the input modules or a disabled module
+    assert "W2" not in names
+    assert "W5" not in names
+
+
+def test_used_channels():
+    assert cppipe.used_channels(PIPELINE) == [1, 3, 4]
+    channel_dict = {1: "W1", 2: "Actin", 3: "W3", 4: "Mito"}
+    assert cppipe.used_channels(PIPELINE, channel_dict) == [1, 3]
+    # the pipeline doesn't reference any image
+    assert cppipe.used_channels(PIPELINE, {1: "DNA"}) is None
+
+
+def test_used_channels_all_images(tmpdir):
+    """a module measuring every loaded image uses every channel"""
+    assert not cppipe.uses_all_images(PIPELINE)
+    pipeline = tmpdir.join("pipeline.cppipe")
+    with open(PIPELINE) as f:
+        text = f.read()
+    pipeline.write(text.rstrip("\n") + textwrap.dedent("""
+
+        MeasureImageQuality:[module_num:20|svn_version:'Unknown'|variable_revision_number:5|show_window:False|notes:[]|batch_state:array([], dtype=uint8)|enabled:True|wants_pause:False]
+            Calculate metrics for which images?:All loaded images
+            Image count:1
+        """))
+    assert cppipe.uses_all_images(str(pipeline))
+    assert cppipe.used_channels(str(pipeline)) is None
+
+
+def test_read_json_pipeline(tmpdir):
+    pipeline = tmpdir.join("pipeline.cppipe")
+    pipeline.write("""{"modules": [
+        {"attributes": {"module_path": "cellprofiler.modules.loaddata.LoadData", "enabled": true},
+         "settings": [{"text": "Name of the file", "value": "W2.csv"}]},
+        {"attributes": {"module_path": "cellprofiler.modules.measureobjectintensity.MeasureObjectIntensity",
+                        "enabled": true},
+         "settings": [{"text": "Select images to measure", "value": "W1, W3"}]}
+    ]}""")
+    assert cppipe.used_channels(str(pipeline)) == [1, 3]
+    pipeline.write("not a pipeline")
+    with pytest.raises(cppipe.PipelineError):
+        cppipe.read_modules(str(pipeline))
+
+
+def test_filter_channels(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_wells=2, n_sites=2, n_channels=5
+    )
+    lister = filelist.Filelist("yokogawa")
+    plate_dir = lister.paths_to_plates(exp_dir)[0]
+    files = lister.files_from_plate(plate_dir)
+    kept = filelist.filter_channels(files, "yokogawa", [1, 3])
+    assert len(kept) == len(files) * 2 // 5
+    with pytest.raises(RuntimeError):
+        filelist.filter_channels(files, "yokogawa", [6], plate_dir)
+
+
+def test_job_pruned_channels(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_wells=4, n_sites=2, n_channels=5
+    )
+    location = str(tmpdir.join("location"))
+    config_path = tmpdir.join("config.yml")
+    config_path.write(textwrap.dedent("""\
+        experiment: {}
+        chunk: 4
+        pipeline: {}
+        location: {}
+        commands location: {}
+        microscope: yokogawa
+        """.format(exp_dir, PIPELINE, location, location)))
+    # off unless asked for
+    assert parse_config.Config(str(config_path)).get_used_channels() is None
+    with open(str(config_path), "a") as f:
+        f.write("prune channels: true\n")
+    config = parse_config.Config(str(config_path))
+    assert config.prune_channels is True
+    channels = config.get_used_channels()
+    assert channels == [1, 3, 4]
+    jobber = job.Job(config.microscope, channels=channels)
+    jobber.add_experiment(config.experiment)
+    jobber.chunk(config.chunk)
+    jobber.create_commands(**config.create_command_args())
+    loaddata_dir = os.path.join(location, "loaddata")
+    loaddata = pd.read_csv(os.path.join(loaddata_dir, sorted(os.listdir(loaddata_dir))[0]))
+    filenames = sorted(i for i in loaddata.columns if i.startswith("FileName_"))
+    assert filenames == ["FileName_W1", "FileName_W3", "FileName_W4"]
+    assert loaddata.shape[0] == 4
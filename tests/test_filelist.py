@@ -1,4 +1,5 @@
 import os
+import pytest
 from cptools2 import filelist
 
 CURRENT_PATH = os.path.dirname(__file__)
@@ -66,3 +67,39 @@ def test_paths_to_plates():
     assert len(output) == len(plate_names)
     for ans in output:
         assert ans in make_own
+
+
+def test_expand_wells_sites():
+    assert filelist.expand_wells(["b3", "A01-B02"]) == {"A01", "A02", "B01", "B02", "B03"}
+    assert len(filelist.expand_wells(["A01-P24"])) == 384
+    assert filelist.expand_sites([1, "3-5"]) == {1, 3, 4, 5}
+
+
+def test_image_filter():
+    image_filter = filelist.ImageFilter(
+        plates={"include": ["plate_*", "re:^other-[0-9]+$"], "exclude": ["plate_2"]},
+        wells={"include": ["A01-B12"], "exclude": ["A01"]},
+        sites={"exclude": [2]}
+    )
+    assert image_filter.keep_plate("plate_1")
+    assert image_filter.keep_plate("other-12")
+    assert not image_filter.keep_plate("plate_2")
+    assert not image_filter.keep_plate("another")
+    assert image_filter.keep_image("B12", 1)
+    assert not image_filter.keep_image("A01", 1)
+    assert not image_filter.keep_image("C01", 1)
+    assert not image_filter.keep_image("B12", 2)
+    assert not filelist.ImageFilter().filters_images()
+
+
+def test_filter_images():
+    plate_path = os.path.join(TEST_PATH_YOKO, "screen-name-batch1_20190213_095340/A000002-PC")
+    files = filelister_yoko.files_from_plate(plate_path)
+    image_filter = filelist.ImageFilter(wells={"include": ["A01-C24"]}, sites={"include": ["1-2"]})
+    kept = filelist.filter_images(files, "yokogawa", image_filter)
+    assert 0 < len(kept) < len(files)
+    for f in kept:
+        well, site = os.path.basename(f).split("_")[1], int(os.path.basename(f).split("_")[2][6:9])
+        assert well[0] in "ABC" and site in (1, 2)
+    with pytest.raises(RuntimeError):
+        filelist.filter_images(files, "yokogawa", filelist.ImageFilter(wells={"include": ["Z01"]}))
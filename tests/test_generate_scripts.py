@@ -3,6 +3,7 @@ module docstring
 """
 
 import os
+import subprocess
 from cptools2 import generate_scripts
 
 CURRENT_PATH = os.path.dirname(__file__)
@@ -32,3 +33,64 @@ def test_lines_in_commnads():
         assert count == expected_count
     for name in expected_names:
         assert name in output
+
+
+def test_make_qsub_scripts_slurm(tmpdir):
+    """cptools2.generate_scripts.make_qsub_scripts(scheduler="slurm")"""
+    commands_location = str(tmpdir)
+    with open(os.path.join(commands_location, "cp_commands.txt"), "w") as f:
+        f.write("cellprofiler 1\ncellprofiler 2\n")
+    script_path = generate_scripts.make_qsub_scripts(
+        commands_location, {"cp_commands": 2},
+        logfile_location=os.path.join(commands_location, "logfiles"),
+        scheduler="slurm", max_running=1
+    )
+    with open(script_path) as f:
+        script = f.read()
+    assert script.startswith("#!/bin/bash\n")
+    assert "#SBATCH --array=1-2%1" in script
+    assert "SGE_TASK_ID" not in script
+    assert '"$SLURM_ARRAY_JOB_ID"  "${TASK_ID:-$SLURM_ARRAY_TASK_ID}"' in script
+
+
+def test_circuit_breaker(tmpdir):
+    """tasks stop running once 2 of the last 3 tasks have failed"""
+    from cptools2 import manifest
+    from cptools2 import status
+    commands_location = str(tmpdir.mkdir("commands"))
+    logfile_location = str(tmpdir.mkdir("logfiles"))
+    outcomes = [False, True, True, False, False, True]
+    tasks = [
+        manifest.Task(task_id=i, name="plate_{}".format(i), plate="plate", n_imagesets=1,
+                      loaddata="/loaddata/plate_{}.csv".format(i), output="/raw_data",
+                      command="echo ran_{}".format(i) if ok else "false")
+        for i, ok in enumerate(outcomes, 1)
+    ]
+    manifest.write_manifest(commands_location, tasks)
+    hook_file = tmpdir.join("hook_ran")
+    os.environ["SGE_CLUSTER_NAME"] = "idrs"
+    script = generate_scripts.make_qsub_scripts(
+        commands_location, {"cp_commands": 6}, logfile_location,
+        circuit_breaker={"failures": 2, "window": 3,
+                         "hook": 'echo "$JOB_ID" > {}'.format(hook_file)}
+    )
+    bin_dir = tmpdir.mkdir("bin")
+    for name, body in [("singularity", 'shift 2\n"$@"'), ("module", "true")]:
+        stub = bin_dir.join(name)
+        stub.write("#!/bin/sh\n" + body + "\n")
+        stub.chmod(0o755)
+    outputs = []
+    for task_id in range(1, 7):
+        env = dict(os.environ, PATH=str(bin_dir) + os.pathsep + os.environ["PATH"],
+                   SGE_TASK_ID=str(task_id), JOB_ID="100")
+        outputs.append(subprocess.check_output(["bash", script], env=env).decode())
+        assert hook_file.check() == (task_id >= 5)
+    # task 6 is never run
+    assert "ran_3" in outputs[2]
+    assert "ran_6" not in outputs[5]
+    assert hook_file.read().strip() == "100"
+    lines = list(status.read_status_logs(logfile_location))
+    assert lines[-2].task_id == 5
+    assert lines[-2].status.startswith(status.TRIPPED)
+    assert lines[-1].task_id == 6
+    assert lines[-1].status == status.SKIPPED
@@ -0,0 +1,144 @@
+import os
+import pytest
+from benchmarks import synthetic
+from cptools2 import commands
+from cptools2 import filelist
+from cptools2 import job
+from cptools2 import loaddata
+from cptools2 import manifest
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def make_job(tmpdir, task_order):
+    """two plates of 5 wells, in chunks of 2 wells"""
+    exp_dir = str(tmpdir.join("exp"))
+    if not os.path.isdir(exp_dir):
+        synthetic.make_experiment(exp_dir, "yokogawa", n_plates=2, n_wells=5, n_sites=1, n_channels=2)
+    location = str(tmpdir.join("location_" + task_order))
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(2)
+    jobber.create_commands(PIPELINE, location, location, 2, None, task_order=task_order)
+    return exp_dir, [task.name for task in manifest.read_manifest(location)], location
+
+
+def test_task_order_plate(tmpdir):
+    _, names, _ = make_job(tmpdir, "plate")
+    plates = sorted(set(name.rsplit("_", 1)[0] for name in names))
+    assert names == ["{}_{}".format(plate, i) for plate in plates for i in range(3)]
+
+
+def test_task_order_imagesets(tmpdir):
+    _, names, location = make_job(tmpdir, "imagesets")
+    # the two trailing chunks of one well go last, otherwise in plate order
+    plates = sorted(set(name.rsplit("_", 1)[0] for name in names))
+    assert names == [
+        "{}_{}".format(plates[0], 0), "{}_{}".format(plates[0], 1),
+        "{}_{}".format(plates[1], 0), "{}_{}".format(plates[1], 1),
+        "{}_{}".format(plates[0], 2), "{}_{}".format(plates[1], 2),
+    ]
+    tasks = list(manifest.read_manifest(location))
+    assert [task.task_id for task in tasks] == list(range(1, 7))
+    assert [task.n_imagesets for task in tasks] == [2, 2, 2, 2, 1, 1]
+    with open(os.path.join(location, "cp_commands.txt")) as f:
+        assert [line.strip() for line in f] == [task.command for task in tasks]
+
+
+def test_task_order_bytes(tmpdir):
+    exp_dir, names, _ = make_job(tmpdir, "plate")
+    # make the images of the last chunk of the last plate the largest
+    last = names[-1]
+    for root, _, files in os.walk(exp_dir):
+        for f in files:
+            if f.startswith(last.rsplit("_", 1)[0] + "_A05_"):
+                with open(os.path.join(root, f), "w") as img:
+                    img.write("x" * 1000)
+    _, names_by_bytes, _ = make_job(tmpdir, "bytes")
+    assert names_by_bytes[0] == last
+    assert sorted(names_by_bytes) == sorted(names)
+
+
+def test_layout_hash(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=2, n_wells=5, n_sites=1, n_channels=2
+    )
+    location = str(tmpdir.join("location"))
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(2)
+    jobber.create_commands(PIPELINE, location, location, 2, None, layout="hash")
+    tasks = list(manifest.read_manifest(location))
+    # no task files directly in loaddata
+    assert not any(i.endswith(".csv") for i in os.listdir(os.path.join(location, "loaddata")))
+    for task in tasks:
+        shard = commands.shard(task.name, "hash")
+        assert task.loaddata == os.path.join(location, "loaddata", shard, task.name + ".csv")
+        assert task.output == os.path.join(location, "raw_data", shard, task.name)
+        assert os.path.isdir(os.path.dirname(task.output))
+        assert "--data-file={}".format(task.loaddata) in task.command
+        assert os.path.isfile(task.loaddata)
+
+
+def test_incomplete_imagesets(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=1, n_wells=5, n_sites=1, n_channels=2
+    )
+    missing = [os.path.join(root, f) for root, _, files in os.walk(exp_dir)
+               for f in files if "_A03_" in f and f.endswith("C02.tif")]
+    os.remove(missing[0])
+    location = str(tmpdir.join("location"))
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(2)
+    with pytest.raises(loaddata.LoadDataError):
+        jobber.create_commands(PIPELINE, location, location, 2, None)
+    with open(os.path.join(location, loaddata.INCOMPLETE_REPORT)) as f:
+        assert f.readlines()[1].split("\t")[1:2] == ["A03"]
+    jobber.create_commands(PIPELINE, location, location, 2, None, incomplete="drop")
+    tasks = list(manifest.read_manifest(location))
+    # the chunk with well A03 is one imageset short
+    assert [task.n_imagesets for task in tasks] == [2, 1, 1]
+
+
+def test_image_filter(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=3, n_wells=6, n_sites=3, n_channels=2
+    )
+    scanned = []
+
+    class Lister(filelist.Filelist):
+        def files_from_plate(self, plate_dir):
+            scanned.append(os.path.basename(plate_dir))
+            return super(Lister, self).files_from_plate(plate_dir)
+
+    image_filter = filelist.ImageFilter(
+        plates={"exclude": ["*2-PC"]}, wells={"include": ["A01-A03"]}, sites={"include": ["1-2"]}
+    )
+    jobber = job.Job("yokogawa", filelister=Lister("yokogawa"), image_filter=image_filter)
+    jobber.add_experiment(exp_dir)
+    # the excluded plate is never scanned
+    assert sorted(scanned) == sorted(jobber.plate_store) == ["A000001-PC", "A000003-PC"]
+    location = str(tmpdir.join("location"))
+    jobber.chunk(100)
+    jobber.create_commands(PIPELINE, location, location, 100, None)
+    # 3 wells and 2 sites per plate
+    assert [task.n_imagesets for task in manifest.read_manifest(location)] == [6, 6]
+
+
+def test_removed_plates(tmpdir):
+    """removed plates are left out of the experiment, but can still be added"""
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=2, n_wells=2, n_sites=1, n_channels=2
+    )
+    reimaged = synthetic.make_experiment(
+        str(tmpdir.join("reimaged")), "yokogawa", n_plates=1, n_wells=2, n_sites=1, n_channels=2
+    )
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir, exclude=["A000001-PC"])
+    assert sorted(jobber.plate_store) == ["A000002-PC"]
+    reimaged_dir = jobber.filelister.paths_to_plates(reimaged)[0]
+    jobber.add_plate(["A000001-PC"], os.path.dirname(reimaged_dir))
+    assert jobber.plate_store["A000001-PC"][0] == reimaged_dir
+    assert len(jobber.plate_store["A000001-PC"][1]) == 2 * 2
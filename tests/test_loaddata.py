@@ -117,6 +117,28 @@ def test_case_dataframe_yoko():
     assert output.equals(wide_df)
 
 
+def test_find_incomplete_yoko():
+    """cptools2.loaddata.find_incomplete(dataframe)"""
+    long_df = loaddata.create_long_loaddata(IMG_LIST_YOKO, microscope="yokogawa")
+    rows, incomplete = loaddata.find_incomplete(long_df)
+    assert not rows.any()
+    assert incomplete == []
+    # remove one image, and every channel 4 image from another imageset
+    first, last = long_df.iloc[0], long_df.iloc[-1]
+    assert first.Metadata_well != last.Metadata_well
+    gaps = long_df.index[0:1].append(long_df.index[
+        (long_df.Metadata_well == last.Metadata_well)
+        & (long_df.Metadata_site == last.Metadata_site)
+        & (long_df.Metadata_channel == 4)
+    ])
+    rows, incomplete = loaddata.find_incomplete(long_df.drop(gaps))
+    assert len(incomplete) == 1 + long_df.Metadata_z.nunique()
+    assert [i.missing for i in incomplete if i.well == first.Metadata_well] == [[first.Metadata_channel]]
+    assert all(i.missing == [4] for i in incomplete if i.well == last.Metadata_well)
+    # the other images of the incomplete imagesets
+    assert rows.sum() == len(incomplete) * 3 - len(gaps)
+
+
 ################################################################################
 # opera
 ################################################################################
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import subprocess
+import textwrap
+from cptools2 import local
+from cptools2 import manifest
+from cptools2 import status
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# stub cellprofiler, writes an Image.csv to the -o directory, fails if the
+# loaddata filename contains "fail" and hangs if it contains "hang"
+STUB_CELLPROFILER = textwrap.dedent("""\
+    #!/bin/sh
+    for arg in "$@"; do
+        case "$arg" in
+            --data-file=*fail*) exit 3 ;;
+            --data-file=*hang*) sleep 30 ;;
+        esac
+    done
+    while [ "$#" -gt 0 ]; do
+        if [ "$1" = "-o" ]; then mkdir -p "$2" && touch "$2/Image.csv"; fi
+        shift
+    done
+    """)
+
+
+def stub_path(tmpdir):
+    """create a stub cellprofiler and return a PATH containing it"""
+    bin_dir = tmpdir.mkdir("bin")
+    stub = bin_dir.join("cellprofiler")
+    stub.write(STUB_CELLPROFILER)
+    stub.chmod(0o755)
+    return str(bin_dir) + os.pathsep + os.environ["PATH"]
+
+
+def make_tasks(tmpdir, names):
+    commands_location = tmpdir.mkdir("commands")
+    tasks = []
+    for i, name in enumerate(names, 1):
+        output = str(tmpdir.join("raw_data", name))
+        tasks.append(manifest.Task(
+            task_id=i, name=name, plate="plate", n_imagesets=5,
+            loaddata="{}.csv".format(name), output=output,
+            command="cellprofiler -r -c -p p.cppipe --data-file={}.csv -o {}".format(name, output)
+        ))
+    manifest.write_manifest(str(commands_location), tasks)
+    return str(commands_location), tasks
+
+
+def test_run_local(tmpdir, monkeypatch):
+    monkeypatch.setenv("PATH", stub_path(tmpdir))
+    commands_location, tasks = make_tasks(tmpdir, ["a_0", "a_1", "fail_0", "hang_0"])
+    logfile_location = str(tmpdir.mkdir("logfiles"))
+    summary = local.run_local(
+        commands_location, logfile_location, workers=4, timeout=2,
+        report_interval=None
+    )
+    assert summary.n_tasks == 4
+    assert summary.n_finished == 2
+    assert summary.n_failed == 2
+    assert summary.n_imagesets == 10
+    for task in tasks[:2]:
+        assert os.path.isfile(os.path.join(task.output, "Image.csv"))
+    # status log is in the same format as the array job script writes
+    lines = {i.task_id: i.status for i in status.read_status_logs(logfile_location)}
+    assert lines == {
+        1: "Finished",
+        2: "Finished",
+        3: "Failed with error code: 3",
+        4: "Failed with error code: {}".format(local.TIMEOUT_RETURN_CODE),
+    }
+
+
+def test_run_local_task_ids(tmpdir, monkeypatch):
+    monkeypatch.setenv("PATH", stub_path(tmpdir))
+    commands_location, tasks = make_tasks(tmpdir, ["a_0", "a_1", "a_2"])
+    logfile_location = str(tmpdir.mkdir("logfiles"))
+    summary = local.run_local(
+        commands_location, logfile_location, task_ids=[2], report_interval=None
+    )
+    assert summary.n_tasks == 1
+    assert [i.task_id for i in status.read_status_logs(logfile_location)] == [2]
+
+
+def test_memory_budget():
+    """tasks wait until there is room in the memory budget"""
+    budget = local.MemoryBudget(100, poll_interval=0.01, check_available=False)
+    events = []
+
+    async def task(name, amount, duration):
+        await budget.acquire(amount)
+        events.append(("start", name))
+        await asyncio.sleep(duration)
+        events.append(("end", name))
+        await budget.release(amount)
+
+    async def run():
+        await asyncio.gather(task("a", 60, 0.05), task("b", 60, 0.01), task("c", 30, 0.01))
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+    # b doesn't fit alongside a, but c does
+    assert events.index(("start", "c")) < events.index(("end", "a"))
+    assert events.index(("start", "b")) > events.index(("end", "a"))
+    assert budget.reserved == 0
+
+
+def test_run_local_command(tmpdir):
+    """cptools2 run-local config.yml"""
+    location = tmpdir.mkdir("location")
+    config = tmpdir.join("config.yml")
+    config.write(textwrap.dedent("""\
+        experiment: {experiment}
+        chunk: 500
+        pipeline: {pipeline}
+        location: {location}
+        commands location: {location}
+        microscope: yokogawa
+        """.format(
+            experiment=os.path.join(CURRENT_PATH, "example_dir_yoko"),
+            pipeline=os.path.join(CURRENT_PATH, "example_pipeline.cppipe"),
+            location=location
+        )))
+    env = dict(os.environ, PATH=stub_path(tmpdir))
+    return_val = subprocess.call(
+        ["cptools2", "run-local", str(config), "--workers", "2"], env=env
+    )
+    assert return_val == 0
+    n_tasks = manifest.count_tasks(str(location))
+    assert n_tasks > 0
+    finished = status.finished_tasks(status.read_status_logs(str(location.join("logfiles"))))
+    assert finished == set(range(1, n_tasks + 1))
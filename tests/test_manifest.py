@@ -0,0 +1,81 @@
+import os
+import subprocess
+import pytest
+from cptools2 import cookiecutter
+from cptools2 import manifest
+
+
+def make_tasks(n):
+    tasks = []
+    for i in range(1, n + 1):
+        name = "plate-1_{}".format(i - 1)
+        tasks.append(manifest.Task(
+            task_id=i,
+            name=name,
+            plate="plate-1",
+            n_imagesets=96,
+            loaddata="/location/loaddata/{}.csv".format(name),
+            output="/location/raw_data/{}".format(name),
+            command="cellprofiler -r -c -p pipe.cppipe --data-file=/location/loaddata/{}.csv".format(name)
+        ))
+    return tasks
+
+
+def test_write_read_manifest(tmpdir):
+    """manifest.write_manifest() and manifest.read_manifest()"""
+    tasks = make_tasks(25)
+    n_written = manifest.write_manifest(str(tmpdir), tasks)
+    assert n_written == 25
+    assert manifest.has_manifest(str(tmpdir))
+    assert manifest.count_tasks(str(tmpdir)) == 25
+    assert list(manifest.read_manifest(str(tmpdir))) == tasks
+
+
+def test_read_task(tmpdir):
+    """manifest.read_task() looks up individual tasks by id"""
+    tasks = make_tasks(120)
+    manifest.write_manifest(str(tmpdir), tasks)
+    for task_id in [1, 2, 57, 120]:
+        assert manifest.read_task(str(tmpdir), task_id) == tasks[task_id - 1]
+    with pytest.raises(manifest.ManifestError):
+        manifest.read_task(str(tmpdir), 121)
+    with pytest.raises(manifest.ManifestError):
+        manifest.read_task(str(tmpdir), 0)
+
+
+def test_write_manifest_out_of_order(tmpdir):
+    tasks = make_tasks(3)[::-1]
+    with pytest.raises(manifest.ManifestError):
+        manifest.write_manifest(str(tmpdir), tasks)
+
+
+def test_script_lookup(tmpdir):
+    """the array job script finds the same command as read_task()"""
+    tasks = make_tasks(12)
+    manifest.write_manifest(str(tmpdir), tasks)
+    paths = manifest.make_manifest_paths(str(tmpdir))
+    script = cookiecutter.SGEScript(user="user")
+    script.loop_through_indexed_file(
+        paths["manifest"], paths["index"],
+        index_width=manifest.INDEX_WIDTH,
+        field=manifest.command_field(),
+        prefix="echo"
+    )
+    assert "#$ -t 1-12" in script.template
+    script_path = os.path.join(str(tmpdir), "script.sh")
+    script.save(script_path)
+    for task_id in [1, 7, 12]:
+        env = dict(os.environ, SGE_TASK_ID=str(task_id))
+        output = subprocess.check_output(["bash", script_path], env=env)
+        assert output.decode().strip() == tasks[task_id - 1].command
+
+
+def test_jobs(tmpdir):
+    manifest.write_manifest(str(tmpdir), make_tasks(2))
+    assert manifest.read_jobs(str(tmpdir)) is None
+    manifest.add_job(str(tmpdir), "abc123")
+    manifest.add_job(str(tmpdir), "def456")
+    assert manifest.read_jobs(str(tmpdir)) == ["abc123", "def456"]
+    # a new manifest starts without any jobs
+    manifest.write_manifest(str(tmpdir), make_tasks(3))
+    assert manifest.read_jobs(str(tmpdir)) is None
@@ -0,0 +1,126 @@
+import os
+import pandas as pd
+import pytest
+from cptools2 import merge
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.parquet
+
+
+def make_outputs(tmpdir):
+    """fake cellprofiler output for two plates"""
+    raw_data = tmpdir.mkdir("raw_data")
+    for plate in ["plate_a", "plate_b"]:
+        for job_num in range(2):
+            output = raw_data.mkdir("{}_{}".format(plate, job_num))
+            image = pd.DataFrame({
+                "ImageNumber": [1, 2],
+                "Metadata_plate": [plate, plate],
+                "Metadata_site": [1, 2],
+                "Count_Cells": [3, 1],
+            })
+            cells = pd.DataFrame({
+                "ImageNumber": [1, 1, 1, 2],
+                "ObjectNumber": [1, 2, 3, 1],
+                "Intensity_MeanIntensity_DNA": [0.1, 0.2, 0.3, 0.4],
+            })
+            if job_num == 1:
+                # a column only in some of the tasks, and all missing
+                # values which pandas would read as float
+                cells["AreaShape_Area"] = [10, 20, 30, 40]
+                image["Metadata_site"] = [None, None]
+            image.to_csv(str(output.join("Image.csv")), index=False)
+            cells.to_csv(str(output.join("Cells.csv")), index=False)
+    # not a task directory
+    raw_data.mkdir("something_else")
+    return str(tmpdir)
+
+
+def test_discover_tasks(tmpdir):
+    location = make_outputs(tmpdir)
+    tasks = merge.discover_tasks(location)
+    assert [i.name for i in tasks] == ["plate_a_0", "plate_a_1", "plate_b_0", "plate_b_1"]
+    assert [i.plate for i in tasks] == ["plate_a", "plate_a", "plate_b", "plate_b"]
+    assert merge.find_tables(tasks) == ["Cells", "Image"]
+
+
+def test_column_type():
+    assert merge.column_type("Metadata_well") == "string"
+    assert merge.column_type("FileName_DNA") == "string"
+    assert merge.column_type("ImageNumber") == "int"
+    assert merge.column_type("Parent_Nuclei") == "int"
+    assert merge.column_type("AreaShape_Area") == "float"
+
+
+def test_merge(tmpdir):
+    location = make_outputs(tmpdir)
+    tasks = merge.discover_tasks(location)
+    out_dir = os.path.join(location, "merged")
+    results = merge.merge(tasks, out_dir, workers=2, float32=True, chunksize=2)
+    assert sorted(results) == [
+        ("Cells", "plate_a", 8), ("Cells", "plate_b", 8),
+        ("Image", "plate_a", 4), ("Image", "plate_b", 4),
+    ]
+    cells = pyarrow.parquet.read_table(
+        os.path.join(out_dir, "Cells", "plate=plate_a", "plate_a.parquet")
+    )
+    assert cells.schema.field("Intensity_MeanIntensity_DNA").type == pyarrow.float32()
+    assert cells.schema.field("ObjectNumber").type == pyarrow.int64()
+    cells = cells.to_pandas()
+    assert cells["task"].tolist() == ["plate_a_0"] * 4 + ["plate_a_1"] * 4
+    assert cells["AreaShape_Area"].isnull().sum() == 4
+    # every plate has the same schema, so they can be read as a dataset
+    image = pyarrow.parquet.read_table(os.path.join(out_dir, "Image")).to_pandas()
+    assert image.shape[0] == 8
+    assert set(image["plate"]) == {"plate_a", "plate_b"}
+    assert image["Metadata_site"].dropna().tolist() == ["1", "2", "1", "2"]
+    assert not any(i.endswith(".tmp") for _, _, files in os.walk(out_dir) for i in files)
+
+
+def test_merge_text_columns(tmpdir):
+    location = make_outputs(tmpdir)
+    tasks = merge.discover_tasks(location)
+    for task in tasks:
+        experiment = pd.DataFrame({
+            "Key": ["CellProfiler_Version", "Run_Timestamp"],
+            "Value": ["3.1.9", "2019-01-01T00:00:00"],
+        })
+        experiment.to_csv(os.path.join(task.output, "Experiment.csv"), index=False)
+    types = merge.table_types(tasks, "Experiment", merge.table_columns(tasks, "Experiment"))
+    assert types == {"task": "string", "Key": "string", "Value": "string"}
+    assert merge.table_types(tasks, "Cells", ["AreaShape_Area"]) == {"AreaShape_Area": "float"}
+    out_dir = os.path.join(location, "merged")
+    merge.merge(tasks, out_dir, tables=["Experiment"], workers=1)
+    experiment = pyarrow.parquet.read_table(os.path.join(out_dir, "Experiment")).to_pandas()
+    assert experiment["Value"].tolist()[:2] == ["3.1.9", "2019-01-01T00:00:00"]
+
+
+def test_merge_late_text(tmpdir):
+    """text past the rows the types are inferred from isn't lost"""
+    location = make_outputs(tmpdir)
+    tasks = merge.discover_tasks(location)
+    n_rows = merge.INFER_ROWS + 10
+    for task in tasks:
+        image = pd.DataFrame({"ImageNumber": range(1, n_rows + 1), "Label": 1.0})
+        if task.name == "plate_b_1":
+            image.loc[n_rows - 1, "Label"] = "control"
+        image.to_csv(os.path.join(task.output, "Image.csv"), index=False)
+    columns = merge.table_columns(tasks, "Image")
+    types = merge.table_types(tasks, "Image", columns)
+    assert types["Label"] == "float"
+    with pytest.raises(merge.NotNumericError):
+        chunk = pd.read_csv(os.path.join(tasks[-1].output, "Image.csv"))
+        merge.harmonise(chunk, columns, types=types)
+    out_dir = os.path.join(location, "merged")
+    merge.merge(tasks, out_dir, tables=["Image"], workers=2)
+    image = pyarrow.parquet.read_table(os.path.join(out_dir, "Image")).to_pandas()
+    assert image.shape[0] == 4 * n_rows
+    assert (image["Label"] == "control").sum() == 1
+    assert image["Label"].isnull().sum() == 0
+    # a single task written on its own falls back to text too
+    path = str(tmpdir.join("task.parquet"))
+    merge.write_parquet(tasks[-1:], "Image", columns, path)
+    assert pyarrow.parquet.read_schema(path).field("Label").type == pyarrow.string()
+    with pytest.raises(merge.NotNumericError):
+        merge.write_parquet(tasks[-1:], "Image", columns, path, types=types)
+    assert not os.path.exists(path + ".tmp")
@@ -0,0 +1,87 @@
+import json
+import os
+import random
+import subprocess
+import textwrap
+from benchmarks import synthetic
+from cptools2 import filelist
+from cptools2 import manifest
+from cptools2 import pilot
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def test_sample_imagesets(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_wells=8, n_sites=4, n_channels=2
+    )
+    lister = filelist.Filelist("yokogawa")
+    img_list = lister.files_from_plate(lister.paths_to_plates(exp_dir)[0])
+    sampled, n_sample, n_imagesets = pilot.sample_imagesets(
+        img_list, "yokogawa", 0.25, random.Random(0)
+    )
+    assert (n_sample, n_imagesets) == (8, 32)
+    # every channel of an imageset is kept
+    assert len(sampled) == 8 * 2
+    # one site from every well
+    wells = set(os.path.basename(i).split("_")[1] for i in sampled)
+    assert len(wells) == 8
+    again, _, _ = pilot.sample_imagesets(img_list, "yokogawa", 0.25, random.Random(0))
+    assert again == sampled
+    # always at least one
+    assert pilot.sample_imagesets(img_list, "yokogawa", 0.0001, random.Random(0))[1] == 1
+
+
+def make_record(task_id, n_imagesets, seconds, max_rss_kb=2 * 1024 ** 2):
+    return {"task_id": task_id, "start": 0, "end": seconds, "return_code": 0,
+            "n_imagesets": n_imagesets, "max_rss_kb": max_rss_kb, "hostname": "node1"}
+
+
+def test_recommend():
+    # 60s startup, 2s per imageset
+    records = [make_record(i, n, 60 + 2 * n) for i, n in enumerate([5, 10, 20, 20], 1)]
+    recommendation = pilot.recommend(records, target_seconds=3600, total_imagesets=3540)
+    assert abs(recommendation.overhead_seconds - 60) < 1e-6
+    assert abs(recommendation.seconds_per_imageset - 2) < 1e-6
+    assert recommendation.chunk == 1770
+    # (60 + 1770 * 2) * 1.5
+    assert recommendation.h_rt == "01:30:00"
+    # 2GB * 1.25, rounded up to 512MB
+    assert recommendation.memory_mb == 2560
+    assert abs(recommendation.cpu_hours - (2 * 60 + 3540 * 2) / 3600.0) < 1e-6
+    assert pilot.recommend([make_record(1, 5, 10)]).overhead_seconds == 0
+    assert pilot.recommend([]) is None
+
+
+def test_pilot_command(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=2, n_wells=10, n_sites=4, n_channels=2
+    )
+    location = str(tmpdir.join("location"))
+    config = tmpdir.join("config.yml")
+    config.write(textwrap.dedent("""\
+        experiment: {}
+        chunk: 2
+        pipeline: {}
+        location: {}
+        commands location: {}
+        microscope: yokogawa
+        """.format(exp_dir, PIPELINE, location, location)))
+    env = dict(os.environ, SGE_CLUSTER_NAME="idrs")
+    subprocess.check_call(["cptools2", "pilot", str(config), "--fraction", "0.1", "--seed", "1"], env=env)
+    pilot_location, commands_location, logfile_location = pilot.pilot_locations(location, location)
+    tasks = list(manifest.read_manifest(commands_location))
+    # 4 of the 40 imagesets from each plate, in chunks of 2
+    assert sum(task.n_imagesets for task in tasks) == 8
+    assert len(tasks) == 4
+    assert all(task.output.startswith(pilot_location) for task in tasks)
+    assert not os.path.exists(os.path.join(location, manifest.MANIFEST_NAME))
+    assert pilot.read_pilot_info(commands_location)["n_total"] == 80
+    report = ["cptools2", "pilot", str(config), "--report"]
+    assert subprocess.call(report, env=env) == 1
+    with open(os.path.join(logfile_location, "abc.runtime.jsonl"), "w") as f:
+        for task in tasks:
+            f.write(json.dumps(make_record(task.task_id, task.n_imagesets, 100)) + "\n")
+    output = subprocess.check_output(report, env=env)
+    assert b"recommended chunk" in output
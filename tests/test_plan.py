@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import textwrap
+import pytest
+from benchmarks import synthetic
+from cptools2 import job
+from cptools2 import loaddata
+from cptools2 import manifest
+from cptools2 import parse_config
+from cptools2 import plan
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def make_jobber(tmpdir):
+    """two plates of 5 wells, in chunks of 2 wells"""
+    exp_dir = str(tmpdir.join("exp"))
+    if not os.path.isdir(exp_dir):
+        synthetic.make_experiment(exp_dir, "yokogawa", n_plates=2, n_wells=5, n_sites=1, n_channels=2)
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(2)
+    return jobber
+
+
+def test_plan_is_lazy(tmpdir):
+    jobber = make_jobber(tmpdir)
+    location = str(tmpdir.join("location"))
+    job_plan = plan.Plan(jobber, PIPELINE, location, job_size=2)
+    tasks = iter(job_plan)
+    first = next(tasks)
+    assert first.task.task_id == 1
+    assert first.task.n_imagesets == 2
+    rows = list(first.rows())
+    assert len(rows) == 2
+    assert rows[0]["FileName_W1"].endswith(".tif")
+    assert first.task.command.startswith("cellprofiler")
+    assert len(list(tasks)) == 5
+    # nothing written, and the dataframes weren't kept on the job
+    assert not os.path.exists(location)
+    assert jobber.has_loaddata is False
+
+
+def test_plan_incomplete(tmpdir):
+    jobber = make_jobber(tmpdir)
+    # remove one channel of one imageset
+    img_list = jobber.plate_store[sorted(jobber.plate_store)[0]][1]
+    img_list[0][0].pop(0)
+    location = str(tmpdir.join("location"))
+    with pytest.raises(loaddata.LoadDataError):
+        list(plan.Plan(jobber, PIPELINE, location, job_size=2))
+    job_plan = plan.Plan(jobber, PIPELINE, location, job_size=2, incomplete="drop")
+    tasks = list(job_plan)
+    assert len(job_plan.incomplete) == 1
+    assert sum(i.task.n_imagesets for i in tasks) == 9
+
+
+def test_buffer_sink(tmpdir):
+    jobber = make_jobber(tmpdir)
+    location = str(tmpdir.join("location"))
+    sink = plan.BufferSink()
+    job_plan = plan.Plan(jobber, PIPELINE, location, job_size=2, task_order="imagesets")
+    assert job_plan.write(sink) == 6
+    assert [i.task_id for i in sink.tasks] == list(range(1, 7))
+    assert [i.n_imagesets for i in sink.tasks] == [2, 2, 2, 2, 1, 1]
+    assert sink.commands == [i.command for i in sink.tasks]
+    assert sorted(sink.loaddata) == sorted(i.name for i in sink.tasks)
+    assert not os.path.exists(location)
+
+
+def test_sqlite_sink(tmpdir):
+    jobber = make_jobber(tmpdir)
+    database = str(tmpdir.join("plan.sqlite"))
+    job_plan = plan.Plan(jobber, PIPELINE, str(tmpdir.join("location")), job_size=2)
+    job_plan.write(plan.SQLiteSink(database))
+    # written twice replaces the tables
+    job_plan.write(plan.SQLiteSink(database))
+    connection = sqlite3.connect(database)
+    tasks = [manifest.Task(*i) for i in
+             connection.execute("SELECT * FROM tasks ORDER BY task_id")]
+    assert [i.task_id for i in tasks] == list(range(1, 7))
+    n_loaddata, = connection.execute("SELECT COUNT(*) FROM loaddata").fetchone()
+    assert n_loaddata == 6
+    connection.close()
+
+
+def test_file_sink_matches_create_commands(tmpdir):
+    location = str(tmpdir.join("location"))
+    make_jobber(tmpdir).create_commands(PIPELINE, location, location, 2, None, layout="hash")
+    planned = str(tmpdir.join("planned"))
+    job_plan = plan.Plan(make_jobber(tmpdir), PIPELINE, planned, job_size=2, layout="hash")
+    job_plan.write(plan.FileSink(planned, planned, layout="hash"))
+    expected = list(manifest.read_manifest(location))
+    tasks = list(manifest.read_manifest(planned))
+    assert [i.command.replace(location, planned) for i in expected] == [i.command for i in tasks]
+    for old, new in zip(expected, tasks):
+        with open(old.loaddata) as f:
+            old_csv = f.read().replace(location, planned)
+        with open(new.loaddata) as f:
+            assert f.read() == old_csv
+
+
+def test_make_plan(tmpdir):
+    exp_dir = make_jobber(tmpdir).exp_dir
+    location = str(tmpdir.join("location"))
+    config_path = tmpdir.join("config.yml")
+    config_path.write(textwrap.dedent("""\
+        experiment: {}
+        remove plate: A000002-PC
+        chunk: 2
+        pipeline: {}
+        location: {}
+        commands location: {}
+        microscope: yokogawa
+        """.format(exp_dir, PIPELINE, location, location)))
+    job_plan = plan.make_plan(parse_config.Config(str(config_path)))
+    assert [i.task.name for i in job_plan] == ["A000001-PC_0", "A000001-PC_1", "A000001-PC_2"]
+    assert not os.path.exists(location)
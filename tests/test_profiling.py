@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import textwrap
+import pytest
+from cptools2 import profiling
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_stage_disabled():
+    with profiling.stage("nothing") as record:
+        record.n_items = 10
+    assert profiling.disable() is None
+
+
+@pytest.mark.skipif(not profiling.CAN_RESET_PEAK, reason="needs python 3.9")
+def test_profiler():
+    profiler = profiling.enable(trace_memory=True)
+    try:
+        with profiling.stage("outer") as outer:
+            for _ in range(3):
+                with profiling.stage("inner") as record:
+                    data = list(range(100000))
+                    record.n_items = len(data)
+            outer.n_items = 1
+    finally:
+        assert profiling.disable() is profiler
+    summary = profiler.summary()
+    stages = {i["name"]: i for i in summary["stages"]}
+    assert [i["name"] for i in summary["stages"]] == ["inner", "outer"]
+    assert stages["inner"]["calls"] == 3
+    assert stages["inner"]["items"] == 300000
+    assert stages["inner"]["items_per_second"] > 0
+    assert stages["outer"]["seconds"] >= stages["inner"]["seconds"]
+    # the inner stage's allocations count towards the outer stage's peak
+    assert stages["inner"]["peak_traced_mb"] > 1
+    assert stages["outer"]["peak_traced_mb"] >= stages["inner"]["peak_traced_mb"]
+    assert summary["peak_traced_mb"] >= stages["outer"]["peak_traced_mb"]
+
+
+def test_profiler_without_reset_peak(monkeypatch):
+    """before python 3.9 only the overall peak is recorded"""
+    monkeypatch.setattr(profiling, "CAN_RESET_PEAK", False)
+    profiler = profiling.enable(trace_memory=True)
+    try:
+        with profiling.stage("stage"):
+            data = list(range(100000))
+    finally:
+        profiling.disable()
+    summary = profiler.summary()
+    assert summary["stages"][0]["peak_traced_mb"] is None
+    assert summary["peak_traced_mb"] > 1
+    assert len(data) == 100000
+
+
+def test_max_rss(monkeypatch):
+    usage = profiling.resource.getrusage(profiling.resource.RUSAGE_SELF)
+    monkeypatch.setattr(profiling.sys, "platform", "darwin")
+    assert profiling.max_rss() == pytest.approx(usage.ru_maxrss / 1024 ** 2, rel=0.5)
+
+
+def make_experiment(tmpdir):
+    """a small yokogawa experiment of empty image files"""
+    plate = tmpdir.mkdir("experiment").mkdir("screen").mkdir("A000002-PC")
+    for well in ["C03", "C04"]:
+        for site in range(1, 4):
+            for channel in range(1, 4):
+                plate.join("A000002-PC_{}_T0001F{:03d}L01A{:02d}Z01C{:02d}.tif".format(
+                    well, site, channel, channel
+                )).write("")
+    return str(tmpdir.join("experiment"))
+
+
+def test_profile_command(tmpdir):
+    """cptools2 config.yml --profile --trace-memory --cprofile"""
+    location = tmpdir.mkdir("location")
+    config = tmpdir.join("config.yml")
+    config.write(textwrap.dedent("""\
+        experiment: {experiment}
+        chunk: 2
+        pipeline: {pipeline}
+        location: {location}
+        commands location: {location}
+        microscope: yokogawa
+        """.format(
+            experiment=make_experiment(tmpdir),
+            pipeline=os.path.join(CURRENT_PATH, "example_pipeline.cppipe"),
+            location=location
+        )))
+    env = dict(os.environ, SGE_CLUSTER_NAME="idrs")
+    return_val = subprocess.call(
+        ["cptools2", str(config), "--profile", "--trace-memory", "--cprofile"], env=env
+    )
+    assert return_val == 0
+    with open(str(location.join(profiling.PROFILE_NAME))) as f:
+        summary = json.load(f)
+    names = [i["name"] for i in summary["stages"]]
+    for name in ["filelist.files_from_plate", "splitter.well_site_table",
+                 "loaddata.cast_dataframe", "commands.write_loaddata",
+                 "manifest.write_manifest"]:
+        assert name in names
+    stages = {i["name"]: i for i in summary["stages"]}
+    assert stages["filelist.files_from_plate"]["items"] == 18
+    assert stages["commands.write_loaddata"]["calls"] == 3
+    if profiling.CAN_RESET_PEAK:
+        assert stages["loaddata.cast_dataframe"]["peak_traced_mb"] > 0
+    assert summary["peak_traced_mb"] > 0
+    assert location.join(profiling.CPROFILE_NAME).check()
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import textwrap
+from benchmarks import synthetic
+from cptools2 import generate_scripts
+from cptools2 import job
+from cptools2 import manifest
+from cptools2 import resources
+from tests.test_tiff import write_tiff
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def test_estimate_task():
+    headers = [resources.tiff.TiffHeader(1024, 1024, 16, 1, 1),
+               resources.tiff.TiffHeader(2048, 1024, 16, 1, 1)]
+    memory_mb, seconds = resources.estimate_task(
+        headers, n_channels=4, n_rows=100, base_memory=1000, image_copies=10,
+        seconds_per_megapixel=0.5, startup_seconds=60
+    )
+    # largest image: 2 megapixels as float64 is 16MB
+    assert memory_mb == 1000 + 10 * 4 * 16
+    assert abs(seconds - (60 + 100 * 4 * 2048 * 1024 / 1e6 * 0.5)) < 1e-6
+
+
+def test_estimate_job(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=1, n_wells=4, n_sites=2, n_channels=2
+    )
+    for root, _, files in os.walk(exp_dir):
+        for name in files:
+            if name.endswith(".tif"):
+                write_tiff(os.path.join(root, name), 1024, 1024)
+    location = str(tmpdir.join("location"))
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(4)
+    jobber.create_commands(PIPELINE, location, location, 4, None)
+    estimate = resources.estimate_job(jobber, startup_seconds=0)
+    # 1MP images, 2 channels: (1024MB + 10 * 2 * 8MB) * 1.5, rounded up to 256MB
+    assert estimate.memory_mb == 1792
+    assert estimate.memory == "1792M"
+    # 4 imagesets per task * 2 channels * 0.5s, doubled
+    assert abs(estimate.seconds - 2 * 4 * 2 * 1.048576 * 0.5) < 1e-6
+    assert estimate.runtime == "00:01:00"
+    assert estimate.n_images == resources.DEFAULTS["sample"]
+    resources.write_estimate(location, estimate)
+    assert resources.read_estimate(location) == estimate
+    logfile_location = os.path.join(location, "logfiles")
+    script = generate_scripts.make_qsub_scripts(
+        location, {"cp_commands": len(list(manifest.read_manifest(location)))},
+        logfile_location, runtime=estimate.runtime, memory=estimate.memory
+    )
+    with open(script) as f:
+        text = f.read()
+    assert "#$ -l h_vmem=1792M" in text
+    assert "#$ -l h_rt=00:01:00" in text
+
+
+def test_estimate_job_unreadable(tmpdir):
+    # the synthetic images are empty files
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=1, n_wells=2, n_sites=1, n_channels=2
+    )
+    location = str(tmpdir.join("location"))
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(2)
+    jobber.create_commands(PIPELINE, location, location, 2, None)
+    assert resources.estimate_job(jobber) is None
+
+
+def test_stale_estimate(tmpdir):
+    """an estimate left by an earlier job isn't used when none can be made"""
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=1, n_wells=2, n_sites=1, n_channels=2
+    )
+    location = tmpdir.mkdir("location")
+    resources.write_estimate(str(location), resources.Estimate(
+        memory_mb=1792, memory="1792M", seconds=60.0, runtime="00:01:00", n_images=8
+    ))
+    config = tmpdir.join("config.yml")
+    config.write(textwrap.dedent("""\
+        experiment: {}
+        chunk: 2
+        pipeline: {}
+        location: {}
+        commands location: {}
+        microscope: yokogawa
+        resources: true
+        """).format(exp_dir, PIPELINE, location, location))
+    env = dict(os.environ, SGE_CLUSTER_NAME="idrs")
+    assert subprocess.call(["cptools2", str(config)], env=env) == 0
+    assert resources.read_estimate(str(location)) is None
+    script = location.listdir(lambda i: i.basename.endswith("_analysis_script.sh"))[0]
+    text = script.read()
+    assert "h_vmem" not in text
+    assert "h_rt" not in text
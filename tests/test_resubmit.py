@@ -0,0 +1,91 @@
+import os
+import subprocess
+from cptools2 import manifest
+from cptools2 import resubmit
+from cptools2 import status
+
+
+def make_job(tmpdir, n_tasks=6):
+    """create a manifest, output directories and empty logfile directory"""
+    commands_location = tmpdir.mkdir("commands")
+    logfile_location = tmpdir.mkdir("logfiles")
+    raw_data = tmpdir.mkdir("raw_data")
+    tasks = []
+    for i in range(1, n_tasks + 1):
+        name = "plate_{}".format(i - 1)
+        tasks.append(manifest.Task(
+            task_id=i, name=name, plate="plate", n_imagesets=10,
+            loaddata="/loaddata/{}.csv".format(name),
+            output=os.path.join(str(raw_data), name),
+            command="echo {}".format(name)
+        ))
+    manifest.write_manifest(str(commands_location), tasks)
+    return str(commands_location), str(logfile_location), tasks
+
+
+def write_output(task, filenames=("Image.csv",)):
+    os.makedirs(task.output)
+    for filename in filenames:
+        open(os.path.join(task.output, filename), "w").close()
+
+
+def test_parse_status_line():
+    line = status.format_status_line("1234", 12, "Failed with error code: 1")
+    parsed = status.parse_status_line(line)
+    assert parsed.job_id == "1234"
+    assert parsed.task_id == 12
+    assert parsed.status == "Failed with error code: 1"
+    # job ID is empty when not running under SGE
+    parsed = status.parse_status_line("2020-01-01 12:00    3  Finished\n")
+    assert parsed.task_id == 3
+    assert parsed.status == status.FINISHED
+    assert status.parse_status_line("not a status line") is None
+
+
+def test_find_failed_tasks(tmpdir):
+    commands_location, logfile_location, tasks = make_job(tmpdir)
+    log = os.path.join(logfile_location, "abc123.log")
+    # 1: finished, 2: failed, 3: failed then finished on resubmission,
+    # 4: finished but no output, 5: finished but missing a file, 6: never ran
+    for task_id, task_status in [(1, "Finished"), (2, "Failed with error code: 1"),
+                                 (3, "Failed with error code: 137"), (3, "Finished"),
+                                 (4, "Finished"), (5, "Finished")]:
+        status.append_status_line(log, status.format_status_line("99", task_id, task_status))
+    for task in tasks[:3]:
+        write_output(task, ["Image.csv", "Cells.csv"])
+    write_output(tasks[4], ["Image.csv"])
+    failed = resubmit.find_failed_tasks(commands_location, logfile_location)
+    assert failed == [2, 4, 6]
+    failed = resubmit.find_failed_tasks(
+        commands_location, logfile_location, expected_files=["Image.csv", "Cells.csv"]
+    )
+    assert failed == [2, 4, 5, 6]
+
+
+def test_resubmit_script(tmpdir):
+    """the resubmission script runs the original task for each array task"""
+    commands_location, logfile_location, tasks = make_job(tmpdir)
+    write_output(tasks[0])
+    write_output(tasks[2])
+    log = os.path.join(logfile_location, "abc123.log")
+    for task_id in [1, 3]:
+        status.append_status_line(log, status.format_status_line("99", task_id, "Finished"))
+    os.environ["SGE_CLUSTER_NAME"] = "idrs"
+    failed, script = resubmit.resubmit(commands_location, logfile_location)
+    assert failed == [2, 4, 5, 6]
+    with open(script) as f:
+        assert "#$ -t 1-4" in f.read()
+    # stub out the cluster commands so the script can run locally
+    bin_dir = tmpdir.mkdir("bin")
+    for name, body in [("singularity", 'shift 2\n"$@"'), ("module", "true")]:
+        stub = bin_dir.join(name)
+        stub.write("#!/bin/sh\n" + body + "\n")
+        stub.chmod(0o755)
+    env = dict(os.environ, PATH=str(bin_dir) + os.pathsep + os.environ["PATH"],
+               SGE_TASK_ID="2", JOB_ID="100")
+    output = subprocess.check_output(["bash", script], env=env)
+    # the second task in the resubmission is task 4 in the original job
+    assert output.decode().strip() == "plate_3"
+    status_lines = list(status.read_status_logs(logfile_location))
+    assert status_lines[-1].task_id == 4
+    assert status_lines[-1].status == "Finished"
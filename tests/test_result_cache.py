@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+from benchmarks import synthetic
+from cptools2 import generate_scripts
+from cptools2 import job
+from cptools2 import manifest
+from cptools2 import result_cache
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def make_job(tmpdir, pipeline=PIPELINE):
+    """two plates of 4 wells, in chunks of 2 wells, with a cached result check"""
+    exp_dir = str(tmpdir.join("exp"))
+    if not os.path.isdir(exp_dir):
+        synthetic.make_experiment(exp_dir, "yokogawa", n_plates=2, n_wells=4, n_sites=1, n_channels=2)
+    location = str(tmpdir.join("location"))
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(2)
+    jobber.create_commands(pipeline, location, location, 2, None)
+    done, pending = result_cache.mark_cached_tasks(jobber, location, location, pipeline)
+    return exp_dir, location, done, pending
+
+
+def run_tasks(tmpdir, location, task_ids):
+    """run tasks of the array job, with a stand-in for cellprofiler"""
+    bin_dir = str(tmpdir.join("bin"))
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+        stubs = [
+            ("singularity", 'shift 2\n"$@"'),
+            ("module", "true"),
+            # create the -o directory with a result in it
+            ("cellprofiler", 'while [ "$1" != "-o" ]; do shift; done\n'
+                             'mkdir -p "$2" && touch "$2/Image.csv"'),
+        ]
+        for name, body in stubs:
+            with open(os.path.join(bin_dir, name), "w") as f:
+                f.write("#!/bin/sh\n" + body + "\n")
+            os.chmod(os.path.join(bin_dir, name), 0o755)
+    pending_list = result_cache.pending_list_path(location)
+    script = generate_scripts.make_qsub_scripts(
+        location, {"cp_commands": len(manifest.read_task_list(pending_list))},
+        os.path.join(location, "logfiles"), task_list=pending_list,
+        result_cache=location
+    )
+    for task_id in task_ids:
+        env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ["PATH"],
+                   SGE_TASK_ID=str(task_id), JOB_ID="100")
+        assert subprocess.call(["bash", script], env=env) == 0
+
+
+def test_result_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv("SGE_CLUSTER_NAME", "idrs")
+    exp_dir, location, done, pending = make_job(tmpdir)
+    assert done == []
+    assert pending == [1, 2, 3, 4]
+    assert len(result_cache.read_keys(location)) == 4
+    # the first two tasks of the pending list succeed
+    run_tasks(tmpdir, location, [1, 2])
+    tasks = list(manifest.read_manifest(location))
+    with open(os.path.join(tasks[0].output, result_cache.KEY_NAME)) as f:
+        assert f.read().strip() == result_cache.read_keys(location)[0]
+    _, _, done, pending = make_job(tmpdir)
+    assert done == [1, 2]
+    assert pending == [3, 4]
+    assert manifest.read_task_list(result_cache.pending_list_path(location)) == [3, 4]
+    # the second task's images change
+    name = tasks[1].name
+    for root, _, files in os.walk(exp_dir):
+        for f in files:
+            if f.startswith(name.rsplit("_", 1)[0] + "_A03_"):
+                with open(os.path.join(root, f), "w") as img:
+                    img.write("x")
+    _, _, done, pending = make_job(tmpdir)
+    assert done == [1]
+    assert pending == [2, 3, 4]
+    # the stale key is removed, so the old output isn't mistaken for the new
+    assert not os.path.isfile(os.path.join(tasks[1].output, result_cache.KEY_NAME))
+    # a different pipeline runs everything again
+    pipeline = str(tmpdir.join("pipeline.cppipe"))
+    shutil.copy(PIPELINE, pipeline)
+    with open(pipeline, "a") as f:
+        f.write("\n")
+    _, _, done, pending = make_job(tmpdir, pipeline)
+    assert done == []
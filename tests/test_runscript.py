@@ -1,33 +1,68 @@
 import os
 import subprocess
+import sys
+import yaml
 
-CURRENT_PATH = os.path.dirname(__file__)
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+ROOT_PATH = os.path.dirname(CURRENT_PATH)
 
-def test_run_cptools2():
-    config_path = os.path.join(CURRENT_PATH, "test_config2.yaml")
-    return_val = subprocess.call(
-        ["env", "SGE_CLUSTER_NAME=idrs", "cptools2", config_path]
-    )
-    assert return_val == 0
 
-def test_run_cptools2_config_with_underscores():
-    config_path = os.path.join(CURRENT_PATH, "test_config3.yaml")
-    return_val = subprocess.call(
-        ["env", "SGE_CLUSTER_NAME=idrs", "cptools2", config_path]
+def run_config(tmpdir, name):
+    """
+    run cptools2 on one of the test configs, writing the job to `tmpdir`
+    rather than the source tree
+    """
+    with open(os.path.join(CURRENT_PATH, name)) as f:
+        config = yaml.safe_load(f)
+    for key in ["location", "commands location", "commands_location"]:
+        if key in config:
+            config[key] = str(tmpdir.join("job"))
+    # paths in the test configs are relative to the repository
+    for key in ["experiment", "pipeline"]:
+        config[key] = os.path.join(ROOT_PATH, config[key])
+    config_path = tmpdir.join(name)
+    config_path.write(yaml.safe_dump(config, default_flow_style=False))
+    return subprocess.call(
+        ["env", "SGE_CLUSTER_NAME=idrs", "cptools2", str(config_path)]
     )
-    assert return_val == 0
 
-def test_run_cptools2_duplicate_plate():
-    config_path = os.path.join(CURRENT_PATH, "test_config_duplicate.yaml")
-    return_val = subprocess.call(
-        ["env", "SGE_CLUSTER_NAME=idrs", "cptools2", config_path]
-    )
-    assert return_val == 0
 
+def test_run_cptools2(tmpdir):
+    assert run_config(tmpdir, "test_config2.yaml") == 0
+
+
+def test_run_cptools2_config_with_underscores(tmpdir):
+    assert run_config(tmpdir, "test_config3.yaml") == 0
+
+
+def test_run_cptools2_duplicate_plate(tmpdir):
+    assert run_config(tmpdir, "test_config_duplicate.yaml") == 0
 
-def test_run_cptools2_duplicate_plate_removed():
-    config_path = os.path.join(CURRENT_PATH, "test_config_duplicate_removed.yaml")
-    return_val = subprocess.call(
-        ["env", "SGE_CLUSTER_NAME=idrs", "cptools2", config_path]
+
+def test_run_cptools2_duplicate_plate_removed(tmpdir):
+    assert run_config(tmpdir, "test_config_duplicate_removed.yaml") == 0
+
+
+def test_template_lightweight_imports():
+    """cptools2 --template doesn't import pandas, numpy or yaml"""
+    code = (
+        "import sys\n"
+        "sys.argv = ['cptools2', '--template']\n"
+        "from cptools2 import __main__\n"
+        "try:\n"
+        "    __main__.main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "heavy = [i for i in ('pandas', 'numpy', 'yaml') if i in sys.modules]\n"
+        "sys.stderr.write(','.join(heavy))\n"
     )
-    assert return_val == 0
+    proc = subprocess.run(
+        [sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert proc.returncode == 0
+    assert proc.stderr.decode() == ""
+
+
+def test_lazy_submodules():
+    import cptools2
+    assert cptools2.utils.compact_ranges([1, 2, 3]) == "1-3"
@@ -0,0 +1,98 @@
+import os
+import subprocess
+from cptools2 import generate_scripts
+from cptools2 import manifest
+from cptools2 import runtime
+
+
+def make_job(tmpdir):
+    """a manifest of two tasks, each with a LoadData file of two images"""
+    commands_location = tmpdir.mkdir("commands")
+    images = tmpdir.mkdir("images")
+    loaddata = tmpdir.mkdir("loaddata")
+    tasks = []
+    for i in range(1, 3):
+        name = "plate_{}".format(i - 1)
+        images.join("{}_w1.tif".format(name)).write("x" * 100 * i)
+        images.join("{}_w2.tif".format(name)).write("x" * 10 * i)
+        loaddata_path = loaddata.join(name + ".csv")
+        loaddata_path.write(
+            "Metadata_well,FileName_W1,FileName_W2,PathName_W1,PathName_W2\n"
+            "A01,{0}_w1.tif,{0}_w2.tif,{1},{1}\n".format(name, images)
+        )
+        tasks.append(manifest.Task(
+            task_id=i, name=name, plate="plate", n_imagesets=1,
+            loaddata=str(loaddata_path), output=str(tmpdir.join("raw_data", name)),
+            command="echo {}".format(name)
+        ))
+    manifest.write_manifest(str(commands_location), tasks)
+    return str(commands_location)
+
+
+def test_runtime_record(tmpdir):
+    """the job script appends a runtime record for each task"""
+    commands_location = make_job(tmpdir)
+    logfile_location = str(tmpdir.mkdir("logfiles"))
+    os.environ["SGE_CLUSTER_NAME"] = "idrs"
+    script = generate_scripts.make_qsub_scripts(
+        commands_location, {"cp_commands": 2}, logfile_location
+    )
+    bin_dir = tmpdir.mkdir("bin")
+    for name, body in [("singularity", 'shift 2\n"$@"'), ("module", "true")]:
+        stub = bin_dir.join(name)
+        stub.write("#!/bin/sh\n" + body + "\n")
+        stub.chmod(0o755)
+    for task_id in ["1", "2"]:
+        env = dict(os.environ, PATH=str(bin_dir) + os.pathsep + os.environ["PATH"],
+                   SGE_TASK_ID=task_id, JOB_ID="100")
+        subprocess.check_call(["bash", script], env=env)
+    records = runtime.read_runtime_records(logfile_location)
+    assert [i["task_id"] for i in records] == [1, 2]
+    record = records[1]
+    assert record["job_id"] == "100"
+    assert record["name"] == "plate_1"
+    assert record["return_code"] == 0
+    assert record["n_imagesets"] == 1
+    assert record["input_bytes"] == 220
+    assert record["hostname"]
+    assert record["end"] >= record["start"]
+    assert record["max_rss_kb"] is None or record["max_rss_kb"] > 0
+    config = tmpdir.join("config.yml")
+    config.write("location: {}\ncommands location: {}\n".format(tmpdir, commands_location))
+    output = subprocess.check_output(["cptools2", "stats", str(config)])
+    assert b"task time: median" in output
+
+
+def make_record(task_id, seconds, max_rss_kb, return_code=0, n_imagesets=10):
+    return {
+        "job_id": "1", "task_id": task_id, "name": "plate_{}".format(task_id),
+        "hostname": "node{}".format(task_id % 3), "start": 1000, "end": 1000 + seconds,
+        "return_code": return_code, "max_rss_kb": max_rss_kb,
+        "n_imagesets": n_imagesets, "input_bytes": 100,
+    }
+
+
+def test_summarise():
+    records = [make_record(i, 100 + i, 1024 * (1000 + i)) for i in range(1, 21)]
+    # slow task, memory hungry task, and a failure which was resubmitted
+    records.append(make_record(21, 1000, 1024 * 1010))
+    records.append(make_record(22, 110, 1024 * 8000))
+    records.append(make_record(23, 5, None, return_code=137))
+    records.append(make_record(23, 105, 1024 * 1005))
+    summary = runtime.summarise(records)
+    assert summary.n_tasks == 23
+    assert summary.n_failed == 0
+    assert summary.n_hosts == 3
+    assert summary.n_imagesets == 230
+    assert summary.memory_mb[100] == 8000
+    assert 1000 < summary.memory_mb[50] < 1020
+    assert [(i.task_id, i.reason) for i in summary.outliers] == [
+        (21, "seconds per imageset"), (22, "memory (MB)")
+    ]
+
+
+def test_percentile():
+    assert runtime.percentile([], 50) is None
+    assert runtime.percentile([3, 1, 2], 50) == 2
+    assert runtime.percentile([1, 2, 3, 4], 50) == 2.5
+    assert runtime.percentile([1, 2, 3, 4], 100) == 4
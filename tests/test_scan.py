@@ -0,0 +1,130 @@
+import glob
+import os
+import subprocess
+import textwrap
+import pytest
+from benchmarks import synthetic
+from cptools2 import filelist
+from cptools2 import job
+from cptools2 import manifest
+from cptools2 import parse_config
+from cptools2 import scan
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def write_config(tmpdir, extra="", microscope="yokogawa"):
+    """three plates of 4 wells and 2 sites"""
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), microscope, n_plates=3, n_wells=4, n_sites=2, n_channels=2
+    )
+    location = str(tmpdir.join("location"))
+    config = tmpdir.join("config.yml")
+    config.write(textwrap.dedent("""\
+        experiment: {exp}
+        chunk: 4
+        pipeline: {pipeline}
+        location: {location}
+        commands location: {location}
+        microscope: {microscope}
+        """).format(exp=exp_dir, pipeline=PIPELINE, location=location,
+                    microscope=microscope) + extra)
+    return str(config), location
+
+
+def test_scan_tasks(tmpdir):
+    config_path, location = write_config(tmpdir, "sites: 1\n")
+    config = parse_config.Config(config_path)
+    shards = scan.assign_shards(scan.list_plates(config), 2)
+    assert [i[0] for i in shards] == [1, 2, 1]
+    assert scan.write_plates(location, shards) == 2
+    jobber = job.Job(
+        config.microscope, image_filter=filelist.ImageFilter(**config.image_filter_args())
+    )
+    assert scan.scan_task(jobber, location, 1) == (2, 2 * 4 * 2)
+    with pytest.raises(scan.ScanError):
+        scan.ScanFilelist(config.microscope, location)
+    scan.scan_task(jobber, location, 2)
+    # the same plates and images as listing them here
+    scanned = job.Job(
+        config.microscope, filelister=scan.ScanFilelist(config.microscope, location),
+        image_filter=filelist.ImageFilter(**config.image_filter_args())
+    )
+    scanned.add_experiment(config.experiment)
+    listed = job.Job(
+        config.microscope, image_filter=filelist.ImageFilter(**config.image_filter_args())
+    )
+    listed.add_experiment(config.experiment)
+    assert sorted(scanned.plate_store) == sorted(listed.plate_store)
+    for plate in listed.plate_store:
+        assert scanned.plate_store[plate][0] == listed.plate_store[plate][0]
+        assert sorted(scanned.plate_store[plate][1]) == sorted(listed.plate_store[plate][1])
+    # a new scan removes the old partial tables
+    scan.write_plates(location, shards)
+    assert glob.glob(os.path.join(location, scan.SCAN_DIR, "part_*")) == []
+
+
+def test_scan_imagexpress(tmpdir, monkeypatch):
+    """ImageXpress paths are relative to the experiment, and kept as listed"""
+    config_path, location = write_config(tmpdir, microscope="imagexpress")
+    config = parse_config.Config(config_path)
+    scan.write_plates(location, scan.assign_shards(scan.list_plates(config), 2))
+    # the paths don't depend on where the scan runs from
+    monkeypatch.chdir(str(tmpdir.mkdir("elsewhere")))
+    jobber = job.Job(config.microscope)
+    for task_id in [1, 2]:
+        scan.scan_task(jobber, location, task_id)
+    scanned = job.Job(
+        config.microscope, filelister=scan.ScanFilelist(config.microscope, location)
+    )
+    scanned.add_experiment(config.experiment)
+    listed = job.Job(config.microscope)
+    listed.add_experiment(config.experiment)
+    assert sorted(scanned.plate_store) == sorted(listed.plate_store)
+    for plate in listed.plate_store:
+        images = scanned.plate_store[plate][1]
+        assert sorted(images) == sorted(listed.plate_store[plate][1])
+        assert all(os.path.isfile(os.path.join(config.experiment, i)) for i in images)
+
+
+def test_distributed_scan(tmpdir):
+    """cptools2 config.yml with distributed scan, then the scan and reduce jobs"""
+    config_path, location = write_config(tmpdir, "distributed scan: 2\n")
+    env = dict(os.environ, SGE_CLUSTER_NAME="idrs")
+    assert subprocess.call(["cptools2", config_path], env=env) == 0
+    assert not os.path.isfile(os.path.join(location, manifest.MANIFEST_NAME))
+    scan_script = glob.glob(os.path.join(location, "*_scan_script.sh"))[0]
+    reduce_script = glob.glob(os.path.join(location, "*_reduce_script.sh"))[0]
+    with open(scan_script) as f:
+        text = f.read()
+    assert "#$ -t 1-2" in text
+    scan_name = [i for i in text.splitlines() if i.startswith("#$ -N")][0][6:]
+    with open(reduce_script) as f:
+        assert "#$ -hold_jid {}".format(scan_name) in f.read()
+    # the reduce job fails until every scan task has finished
+    assert subprocess.call(["bash", reduce_script], env=env) == 1
+    for task_id in ["1", "2"]:
+        assert subprocess.call(["bash", scan_script], env=dict(env, SGE_TASK_ID=task_id)) == 0
+    assert subprocess.call(["bash", reduce_script], env=env) == 0
+    # 4 wells * 2 sites per plate, in chunks of 4
+    assert manifest.count_tasks(location) == 3 * 2
+    assert glob.glob(os.path.join(location, "*_analysis_script.sh"))
+
+
+def test_list_plates_removed(tmpdir):
+    """removed plates are only left out of the experiment, as in job.Job"""
+    config_path, _ = write_config(tmpdir)
+    measurement = os.path.dirname(filelist.Filelist("yokogawa").paths_to_plates(
+        str(tmpdir.join("exp"))
+    )[0])
+    with open(config_path, "a") as f:
+        f.write(textwrap.dedent("""\
+            remove plate: A000001-PC
+            add plate:
+                - experiment: {}
+                - plates: [A000001-PC]
+            """).format(measurement))
+    plates = scan.list_plates(parse_config.Config(config_path))
+    assert [os.path.basename(i[1]) for i in plates] == ["A000002-PC", "A000003-PC", "A000001-PC"]
+    assert plates[-1] == (measurement, os.path.join(measurement, "A000001-PC"))
@@ -0,0 +1,37 @@
+import os
+import pytest
+from benchmarks import synthetic
+from cptools2 import filelist
+from cptools2 import parse_metadata
+from cptools2 import splitter
+
+
+@pytest.mark.parametrize("microscope,n_z", [("yokogawa", 2), ("imagexpress", 1)])
+def test_make_experiment(tmpdir, microscope, n_z):
+    """generated files are listed and parsed the same way as real ones"""
+    path = str(tmpdir.join("experiment"))
+    shape = dict(n_plates=2, n_wells=30, n_sites=3, n_z=n_z, n_channels=4)
+    synthetic.make_experiment(path, microscope, **shape)
+    lister = filelist.Filelist(microscope)
+    plate_paths = sorted(lister.paths_to_plates(path))
+    assert len(plate_paths) == 2
+    files = [i for plate in plate_paths for i in lister.files_from_plate(plate)]
+    assert len(files) == synthetic.n_images(**shape)
+    parser = parse_metadata.MetadataParser(microscope)
+    metadata = parser.parse_filepath_list(files)
+    assert {i.Metadata_plate for i in metadata} == {os.path.basename(i) for i in plate_paths}
+    assert {i.Metadata_well for i in metadata} == set(synthetic.well_names(30))
+    assert {i.Metadata_site for i in metadata} == {1, 2, 3}
+    assert {i.Metadata_z for i in metadata} == set(range(1, n_z + 1))
+    assert {i.Metadata_channel for i in metadata} == {1, 2, 3, 4}
+    # one imageset per well and site
+    plate_files = lister.files_from_plate(plate_paths[0])
+    chunks = splitter.split(plate_files, 10, microscope)
+    assert sum(len(i) for i in chunks) == 30 * 3
+
+
+def test_make_experiment_errors(tmpdir):
+    with pytest.raises(ValueError):
+        synthetic.make_experiment(str(tmpdir.join("a")), "imagexpress", n_z=2)
+    with pytest.raises(ValueError):
+        synthetic.well_names(385)
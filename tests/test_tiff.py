@@ -0,0 +1,57 @@
+import struct
+import pytest
+from cptools2 import tiff
+
+
+def write_tiff(path, width, height, n_pages=1, bits=16, samples=1,
+               endian="<", bigtiff=False):
+    """
+    write the image file directories of a TIFF without any pixel data,
+    which is all `tiff.read_header` looks at
+    """
+    if bigtiff:
+        offset_fmt, count_fmt, header_size = "Q", "Q", 16
+    else:
+        offset_fmt, count_fmt, header_size = "I", "H", 8
+    offset_size = struct.calcsize(offset_fmt)
+    count_size = struct.calcsize(count_fmt)
+    entry_size = 4 + 2 * offset_size
+    tags = [(tiff.IMAGE_WIDTH, 4, width), (tiff.IMAGE_LENGTH, 4, height),
+            (tiff.BITS_PER_SAMPLE, 3, bits), (tiff.SAMPLES_PER_PIXEL, 3, samples)]
+    ifd_size = count_size + len(tags) * entry_size + offset_size
+    data = b"II" if endian == "<" else b"MM"
+    if bigtiff:
+        data += struct.pack(endian + "HHHQ", 43, 8, 0, header_size)
+    else:
+        data += struct.pack(endian + "HI", 42, header_size)
+    for page in range(n_pages):
+        data += struct.pack(endian + count_fmt, len(tags))
+        for tag, tag_type, value in tags:
+            fmt = "I" if tag_type == 4 else "H"
+            value = struct.pack(endian + fmt, value).ljust(offset_size, b"\0")
+            data += struct.pack(endian + "HH" + offset_fmt, tag, tag_type, 1) + value
+        last = page == n_pages - 1
+        next_offset = 0 if last else header_size + (page + 1) * ifd_size
+        data += struct.pack(endian + offset_fmt, next_offset)
+    with open(str(path), "wb") as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+@pytest.mark.parametrize("bigtiff", [False, True])
+def test_read_header(tmpdir, endian, bigtiff):
+    path = tmpdir.join("image.tif")
+    write_tiff(path, 2160, 2560, n_pages=3, bits=16, endian=endian, bigtiff=bigtiff)
+    assert tiff.read_header(str(path)) == tiff.TiffHeader(
+        width=2160, height=2560, bits_per_sample=16, samples_per_pixel=1, n_pages=3
+    )
+
+
+def test_read_header_not_tiff(tmpdir):
+    path = tmpdir.join("image.tif")
+    path.write("")
+    with pytest.raises(tiff.TiffError):
+        tiff.read_header(str(path))
+    path.write("II*\0")
+    with pytest.raises(tiff.TiffError):
+        tiff.read_header(str(path))
@@ -63,3 +63,10 @@ def test_count_lines_in_file():
     answer2 = utils.count_lines_in_file(path_to_test_file2)
     assert answer1 == expected
     assert answer2 == expected
+
+
+def test_compact_ranges():
+    """utils.compact_ranges(integers)"""
+    assert utils.compact_ranges([7, 1, 2, 3, 9, 10]) == "1-3,7,9-10"
+    assert utils.compact_ranges([5]) == "5"
+    assert utils.compact_ranges([]) == ""
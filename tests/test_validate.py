@@ -0,0 +1,63 @@
+import os
+from benchmarks import synthetic
+from cptools2 import job
+from cptools2 import validate
+from tests.test_tiff import write_tiff
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(CURRENT_PATH, "example_pipeline.cppipe")
+
+
+def test_check_header(tmpdir):
+    path = tmpdir.join("image.tif")
+    write_tiff(path, 64, 64, endian=">")
+    assert validate.check_header(str(path), os.path.getsize(str(path))) is None
+    write_tiff(path, 64, 64, bigtiff=True)
+    assert validate.check_header(str(path), os.path.getsize(str(path))) is None
+    assert validate.check_header(str(path), 0) == "empty file"
+    # the IFD is past the end of a truncated file
+    assert validate.check_header(str(path), 17).startswith("IFD offset")
+    path.write("not an image")
+    assert validate.check_header(str(path), 12) == "not a TIFF file"
+
+
+def test_validate_job(tmpdir):
+    exp_dir = synthetic.make_experiment(
+        str(tmpdir.join("exp")), "yokogawa", n_plates=1, n_wells=4, n_sites=1, n_channels=2
+    )
+    images = []
+    for root, _, files in os.walk(exp_dir):
+        for name in sorted(files):
+            if name.endswith(".tif"):
+                images.append(os.path.join(root, name))
+                write_tiff(images[-1], 64, 64)
+    # an interrupted transfer, and a file which isn't a TIFF
+    truncated, corrupt = images[0], images[-1]
+    with open(truncated, "r+b") as f:
+        f.truncate(20)
+    with open(corrupt, "r+b") as f:
+        f.write(b"xxxx")
+    location = str(tmpdir.join("location"))
+    jobber = job.Job("yokogawa")
+    jobber.add_experiment(exp_dir)
+    jobber.chunk(2)
+    jobber.create_commands(PIPELINE, location, location, 2, None)
+    n_checked, bad_images = validate.validate_job(jobber, location)
+    assert n_checked == len(images)
+    assert sorted(i.path for i in bad_images) == sorted([truncated, corrupt])
+    assert set(i.task for i in bad_images) == {"A000001-PC_0", "A000001-PC_1"}
+    report = validate.write_report(location, bad_images)
+    with open(report) as f:
+        assert len(f.readlines()) == 3
+    # unchanged files are taken from the cache without being read
+    stat = os.stat(corrupt)
+    with open(corrupt, "r+b") as f:
+        f.write(b"II*\x00")
+    os.utime(corrupt, (stat.st_atime, stat.st_mtime))
+    _, cached = validate.validate_job(jobber, location)
+    assert corrupt in [i.path for i in cached]
+    os.utime(corrupt, (stat.st_atime, stat.st_mtime + 10))
+    _, fixed = validate.validate_job(jobber, location)
+    assert [i.path for i in fixed] == [truncated]
+    n_checked, _ = validate.validate_job(jobber, location, sample=0.25, seed=1)
+    assert n_checked == 2